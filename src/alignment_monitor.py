@@ -0,0 +1,184 @@
+from collections import deque
+
+import cv2
+import numpy as np
+
+import zbuffer
+
+def decimate_depth(depth, decimation: int):
+    """
+    Block-wise nearest depth of a registered depth map: every (decimation x decimation) block
+    keeps its smallest non-zero depth, so the sparse ToF points on the color grid become a
+    mostly dense small map. A min filter (erosion) on depth - 1, where the uint16 wrap-around
+    turns the empty pixels into 0xFFFF (zbuffer.ZBUFFER_EMPTY) and back.
+
+    Args:
+        depth: (H, W) uint16 registered depth [mm], 0 where empty
+        decimation: Block size
+
+    Returns:
+        depth: (H // decimation, W // decimation) uint16 depth [mm], 0 where the block is empty
+        hit: (H // decimation, W // decimation) bool, True where the block had a point
+    """
+    d = decimation
+    H, W = depth.shape
+    h, w = H // d, W // d
+    buf = np.subtract(depth[:h * d, :w * d], np.uint16(1))
+    # Kernel anchored at its top left, so the pixel at (d * i, d * j) holds the min of its block
+    buf = cv2.erode(buf, np.ones((d, d), np.uint8), anchor=(0, 0), borderType=cv2.BORDER_CONSTANT,
+                    borderValue=zbuffer.ZBUFFER_EMPTY)
+    buf = np.ascontiguousarray(buf[::d, ::d])
+    small_hit = buf != zbuffer.ZBUFFER_EMPTY
+    buf += np.uint16(1)
+    return buf, small_hit
+
+def depth_edges(depth, hit, jump_mm: float = 30.0):
+    """
+    Depth discontinuities: pixels whose right or lower neighbor is more than `jump_mm` away,
+    both pixels registered. Holes in the registered depth do not count as edges.
+
+    Returns:
+        edges: (H, W) bool
+    """
+    z = depth.astype(np.int32)
+    edges = np.zeros(depth.shape, dtype=bool)
+    jump_x = (np.abs(z[:, 1:] - z[:, :-1]) > jump_mm) & hit[:, 1:] & hit[:, :-1]
+    jump_y = (np.abs(z[1:] - z[:-1]) > jump_mm) & hit[1:] & hit[:-1]
+    edges[:, :-1] |= jump_x
+    edges[:-1] |= jump_y
+    return edges
+
+def edge_alignment_score(color_img, depth, hit=None, decimation: int = 4, jump_mm: float = 30.0,
+                         max_dist_px: float = 20.0):
+    """
+    Numeric version of the overlay_edges view of visualize_rgb_depth_alignment: mean distance
+    from the registered depth edges to the nearest RGB edge, on a grid decimated by `decimation`.
+    Uses one cv2.distanceTransform of the RGB edge map; distances are clamped to `max_dist_px`
+    so depth edges without a matching RGB edge do not dominate.
+
+    Args:
+        color_img: (H, W, 3) uint8 BGR image
+        depth: (H, W) uint16 depth [mm] registered to the color image, 0 where empty
+        hit: (H, W) bool, None for depth > 0
+        decimation: Grid decimation factor
+        jump_mm: Min. depth step of a depth edge [mm]
+        max_dist_px: Distance clamp [px at full resolution]
+
+    Returns:
+        score: Mean edge distance [px at full resolution], None if there are no depth edges
+        edge_count: Number of depth edge pixels on the decimated grid
+    """
+    if hit is not None:
+        depth = depth * hit
+    small_depth, small_hit = decimate_depth(depth, decimation)
+    h, w = small_depth.shape
+    gray = cv2.cvtColor(color_img[:h * decimation, :w * decimation], cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (w, h), interpolation=cv2.INTER_AREA)
+    edges_rgb = cv2.Canny(gray, 100, 200)
+
+    edges_depth = depth_edges(small_depth, small_hit, jump_mm)
+    edge_count = int(np.count_nonzero(edges_depth))
+    if edge_count == 0 or not edges_rgb.any():
+        return None, edge_count
+    # Distance of every pixel to the nearest RGB edge pixel
+    dist = cv2.distanceTransform(cv2.bitwise_not(edges_rgb), cv2.DIST_L2, 3)
+    d = np.minimum(dist[edges_depth], max_dist_px / decimation)
+    return float(d.mean()) * decimation, edge_count
+
+class ExtrinsicDriftMonitor:
+    """
+    Online check of the RGB / ToF extrinsics: every `every_n`-th fused frame is scored with
+    edge_alignment_score, and the median over the last `window` scores is the drift metric.
+    The first `window` scores after start (or reset()) are the baseline of a good calibration;
+    an alert is raised when the metric exceeds the baseline by more than `alert_px`, e.g. after
+    the camera bridge got bumped.
+
+    A score takes about 5 ms at 1280x1024 with decimation 4, i.e. 0.5 ms per frame at every_n=10.
+
+    Args:
+        every_n: Score every n-th frame
+        window: Number of scores in the median (and in the baseline)
+        alert_px: Allowed increase of the metric over the baseline [px]
+        baseline_px: Known baseline [px], None to learn it from the first scores
+        decimation, jump_mm, max_dist_px: See edge_alignment_score
+        min_edges: Min. depth edge pixels for a score to count
+    """
+    def __init__(self, every_n: int = 10, window: int = 5, alert_px: float = 2.0, baseline_px: float = None,
+                 decimation: int = 4, jump_mm: float = 30.0, max_dist_px: float = 20.0, min_edges: int = 50):
+        self.every_n = every_n
+        self.window = window
+        self.alert_px = alert_px
+        self.decimation = decimation
+        self.jump_mm = jump_mm
+        self.max_dist_px = max_dist_px
+        self.min_edges = min_edges
+        self.frames = 0
+        self.scored = 0
+        self.alerts = 0
+        self.alert = False
+        self.metric_px = None
+        self.scores = deque(maxlen=window)
+        self.baseline_px = baseline_px
+        self._learn_baseline = baseline_px is None
+
+    def reset(self, baseline_px: float = None) -> None:
+        """
+        Forget the scores and the alert, e.g. after a recalibration.
+        """
+        self.scores.clear()
+        self.alert = False
+        self.metric_px = None
+        self.baseline_px = baseline_px
+        self._learn_baseline = baseline_px is None
+
+    def update(self, color_img, depth, hit=None):
+        """
+        Feed one fused frame, only every `every_n`-th one is scored.
+
+        Args:
+            color_img: (H, W, 3) uint8 BGR image
+            depth: (H, W) uint16 depth [mm] registered to the color image
+            hit: (H, W) bool, None for depth > 0
+
+        Returns:
+            metric_px: Current drift metric [px], None if not scored on this frame
+        """
+        self.frames += 1
+        if (self.frames - 1) % self.every_n:
+            return None
+        score, edge_count = edge_alignment_score(color_img, depth, hit, self.decimation, self.jump_mm,
+                                                 self.max_dist_px)
+        if score is None or edge_count < self.min_edges:
+            return None
+        self.scored += 1
+        self.scores.append(score)
+        if len(self.scores) < self.window:
+            return None
+        self.metric_px = float(np.median(self.scores))
+
+        if self._learn_baseline:
+            self.baseline_px = self.metric_px
+            self._learn_baseline = False
+            print(f"Extrinsic drift monitor: baseline edge distance {self.baseline_px:.2f} px")
+        alert = self.metric_px > self.baseline_px + self.alert_px
+        if alert and not self.alert:
+            self.alerts += 1
+            print(f"Extrinsic drift alert: edge distance {self.metric_px:.2f} px, "
+                  f"baseline {self.baseline_px:.2f} px - check the camera mounting / recalibrate")
+        elif self.alert and not alert:
+            print(f"Extrinsic drift monitor: edge distance back to {self.metric_px:.2f} px")
+        self.alert = alert
+        return self.metric_px
+
+    def stats(self) -> dict:
+        """
+        Drift metric and counters of the monitor.
+        """
+        return {
+            "frames": self.frames,
+            "scored": self.scored,
+            "metric_px": self.metric_px,
+            "baseline_px": self.baseline_px,
+            "alert": self.alert,
+            "alerts": self.alerts,
+        }
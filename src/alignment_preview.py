@@ -0,0 +1,151 @@
+import threading
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+@lru_cache(maxsize=8)
+def depth_color_lut(depth_min: int, depth_max: int, colormap: int = cv2.COLORMAP_JET, invert: bool = False):
+    """
+    Fixed-range 16-bit depth -> BGR table, replaces the per-frame cv2.normalize(NORM_MINMAX).
+
+    Args:
+        depth_min, depth_max: Depth range [mm] spread over the colormap, values outside are clamped
+        colormap: OpenCV colormap
+        invert: Reverse the colormap (near = high end)
+
+    Returns:
+        lut: (65536, 3) uint8, lut[0] is black (no depth)
+    """
+    values = np.arange(65536, dtype=np.float32)
+    gray = np.clip((values - depth_min) * 255.0 / max(depth_max - depth_min, 1), 0, 255).astype(np.uint8)
+    if invert:
+        gray = 255 - gray
+    lut = cv2.applyColorMap(gray.reshape(-1, 1), colormap).reshape(65536, 3)
+    lut[0] = 0
+    lut.flags.writeable = False
+    return lut
+
+def depth_to_color(depth: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """
+    Color a uint16 depth map [mm] with a depth_color_lut() table.
+    """
+    return lut[depth]
+
+class AlignmentPreview:
+    """
+    Throttled, reduced-resolution version of basler_fusion_depth_rgb.visualize_rgb_depth_alignment
+    on its own display thread.
+
+    submit() is all the acquisition/fusion loop pays: frames arriving faster than `max_fps`
+    are dropped right away, the others are downscaled (nearest neighbor) into a small copy.
+    Colormap, edge detection, blending and cv2.imshow run on the display thread, which
+    only ever renders the newest submitted frame.
+
+    Args:
+        scale: Preview size relative to the color image
+        max_fps: Max. preview rate
+        depth_range: (min, max) depth [mm] of the fixed colormap range, None for the range the
+            ToF camera is configured with (basler_tof_cam_grab.tof_depth_range)
+        alpha_rgb, alpha_depth: Opacity of the RGB and depth layers in the heatmap overlay
+    """
+    def __init__(self, scale: float = 0.5, max_fps: float = 10.0, depth_range=None,
+                 alpha_rgb: float = 0.6, alpha_depth: float = 0.4):
+        self.scale = scale
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        if depth_range is None:
+            # Imported here, basler_tof_cam_grab itself colors its depth display with this module
+            import basler_tof_cam_grab
+            depth_range = basler_tof_cam_grab.tof_depth_range()
+        self.lut = depth_color_lut(int(depth_range[0]), int(depth_range[1]))
+        self.alpha_rgb = alpha_rgb
+        self.alpha_depth = alpha_depth
+        self.quit_requested = False
+        self.shown = 0
+        self.dropped = 0
+        self._frame = None
+        self._last_submit = 0.0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._display_loop, name="alignment_preview", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def submit(self, color_img: np.ndarray, depth: np.ndarray) -> bool:
+        """
+        Offer a fused frame to the preview, never blocks on the display.
+
+        Args:
+            color_img: (H, W, 3) uint8 BGR image
+            depth: (H, W) uint16 depth [mm] aligned to the color image
+
+        Returns:
+            True if the frame is shown, False if dropped by the rate limit
+        """
+        now = time.perf_counter()
+        if now - self._last_submit < self.min_interval:
+            self.dropped += 1
+            return False
+        self._last_submit = now
+
+        h, w = depth.shape
+        size = (max(int(w * self.scale), 1), max(int(h * self.scale), 1))
+        frame = (cv2.resize(color_img, size, interpolation=cv2.INTER_NEAREST),
+                 cv2.resize(depth, size, interpolation=cv2.INTER_NEAREST))
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._cond.notify()
+        return True
+
+    def render(self, color_img: np.ndarray, depth: np.ndarray):
+        """
+        Heatmap and edge overlays of a (downscaled) frame, see visualize_rgb_depth_alignment.
+        """
+        depth_color = depth_to_color(depth, self.lut)
+        overlay_heatmap = cv2.addWeighted(color_img, self.alpha_rgb, depth_color, self.alpha_depth, 0)
+
+        gray = cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY)
+        edges_rgb = cv2.Canny(gray, 100, 200)
+        edges_depth = cv2.Canny(cv2.convertScaleAbs(depth, alpha=0.03), 50, 150)
+        # RGB edges white, depth edges red
+        overlay_edges = cv2.merge([edges_rgb, edges_rgb, cv2.max(edges_rgb, edges_depth)])
+        return overlay_heatmap, overlay_edges
+
+    def _display_loop(self) -> None:
+        while True:
+            with self._cond:
+                if self._frame is None and not self._stop:
+                    self._cond.wait(timeout=0.05)
+                if self._stop:
+                    break
+                frame, self._frame = self._frame, None
+
+            if frame is not None:
+                overlay_heatmap, overlay_edges = self.render(*frame)
+                cv2.imshow("overlay_heatmap", overlay_heatmap)
+                cv2.imshow("overlay_edges", overlay_edges)
+                self.shown += 1
+            if self.shown:
+                # Keeps the windows responsive between frames, q requests to quit
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    self.quit_requested = True
+        if self.shown:
+            cv2.destroyWindow("overlay_heatmap")
+            cv2.destroyWindow("overlay_edges")
@@ -1,4 +1,4 @@
-from pypylon import pylon
+from pypylon import pylon, genicam
 
 def list_basler_devices() -> None:
     """ 
@@ -30,3 +30,15 @@ def create_basler_cam(serial_number: str) -> pylon.InstantCamera:
     # Create the camera
     cam = pylon.InstantCamera(tl_factory.CreateDevice(device))
     return cam
+
+def get_available_node(cam: pylon.InstantCamera, name: str):
+    """
+    Get a GenICam node by name, or None if the camera does not provide it.
+    """
+    try:
+        node = cam.GetNodeMap().GetNode(name)
+    except genicam.GenericException:
+        return None
+    if node is None or not genicam.IsAvailable(node):
+        return None
+    return node
@@ -0,0 +1,298 @@
+import threading
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+from pypylon import pylon
+
+import basler_cam_init
+import basler_cam_stream
+import basler_rgb_cam_grab
+import basler_tof_cam_grab
+import cam_calibration
+import session_recorder
+
+def config_software_trigger(cam: pylon.InstantCamera) -> None:
+    """
+    Configure a camera so that each software trigger acquires one frame.
+    """
+    if basler_cam_init.get_available_node(cam, "TriggerSelector") is not None:
+        cam.TriggerSelector.Value = "FrameStart"
+    cam.TriggerMode.Value = "On"
+    cam.TriggerSource.Value = "Software"
+
+def config_chunk_timestamp(cam: pylon.InstantCamera) -> bool:
+    """
+    Enable the timestamp chunk, so every frame carries the device time of its exposure.
+
+    Returns:
+        bool: True if the chunk is enabled, False if the camera has no chunk support.
+    """
+    if basler_cam_init.get_available_node(cam, "ChunkModeActive") is None:
+        return False
+    cam.ChunkModeActive.Value = True
+    cam.ChunkSelector.Value = "Timestamp"
+    cam.ChunkEnable.Value = True
+    return True
+
+def timestamp_tick_ns(cam: pylon.InstantCamera) -> float:
+    """
+    Length of one device timestamp tick [ns]. GigE ace cameras count at
+    GevTimestampTickFrequency, the blaze counts in nanoseconds.
+    """
+    node = basler_cam_init.get_available_node(cam, "GevTimestampTickFrequency")
+    if node is None:
+        return 1.0
+    return 1e9 / node.GetValue()
+
+def latch_timestamp_ns(cam: pylon.InstantCamera) -> float:
+    """
+    Latch and read the current device time [ns].
+    """
+    for latch_name, value_name in (("TimestampLatch", "TimestampLatchValue"),
+                                   ("GevTimestampControlLatch", "GevTimestampValue")):
+        latch_node = basler_cam_init.get_available_node(cam, latch_name)
+        if latch_node is not None:
+            latch_node.Execute()
+            return basler_cam_init.get_available_node(cam, value_name).GetValue() * timestamp_tick_ns(cam)
+    raise RuntimeError("Camera does not support latching the timestamp")
+
+def estimate_clock_offset_ns(cam_ref: pylon.InstantCamera, cam_other: pylon.InstantCamera,
+                             repeat: int = 10) -> float:
+    """
+    Estimate the offset between two device clocks (other - ref) [ns].
+
+    The reference clock is latched before and after the other one, the sample with the
+    shortest round trip is used, so the error is bounded by half of that round trip.
+    """
+    best_round_trip = None
+    best_offset = 0.0
+    for _ in range(repeat):
+        ref_before = latch_timestamp_ns(cam_ref)
+        other = latch_timestamp_ns(cam_other)
+        ref_after = latch_timestamp_ns(cam_ref)
+        round_trip = ref_after - ref_before
+        if best_round_trip is None or round_trip < best_round_trip:
+            best_round_trip = round_trip
+            best_offset = other - (ref_before + ref_after) / 2
+    return best_offset
+
+
+class PairedCapture:
+    """
+    Synchronized RGB + ToF acquisition with device timestamp pairing.
+
+    Both cameras are software triggered together (color first, so it already transfers
+    while the blaze is still processing) and acquired by background threads. Frames are
+    paired by their device timestamps: a pair is accepted if the two exposures are at
+    most `max_skew_ms` apart, otherwise the older frame is dropped.
+
+    Args:
+        max_skew_ms (float): Max. time between the two exposures of a pair [ms].
+        trigger_rate_hz (float): Trigger rate. None triggers as soon as both cameras are ready.
+        ring_size (int): Number of frames buffered per camera.
+        record_dir (str): If given, every raw Bayer frame and point cloud is recorded into this
+            session directory, streams "rgb_bayer" and "tof_Point_Cloud". Both are timestamped with
+            their exposure time on the RGB device clock [ns], so session_recorder.PairedSession
+            pairs them like read_pair() does.
+    """
+    def __init__(self, max_skew_ms: float = 5.0, trigger_rate_hz: Optional[float] = None, ring_size: int = 8,
+                 record_dir: Optional[str] = None):
+        self.max_skew_ns = max_skew_ms * 1e6
+        self.trigger_rate_hz = trigger_rate_hz
+        self.ring_size = ring_size
+        self.record_dir = record_dir
+        self.recorder = None
+        self.clock_offset_ns = 0.0
+        self.pairs = 0
+        self.unpaired_color = 0
+        self.unpaired_tof = 0
+        self.skew_sum_ms = 0.0
+        self.skew_max_ms = 0.0
+        self._stop_event = threading.Event()
+
+    def start(self) -> None:
+        """
+        Open and configure both cameras, sync their clocks and start acquisition and triggering.
+        """
+        self.rgb_cam = basler_rgb_cam_grab.create_rgb_cam_obj()
+        self.rgb_cam.Open()
+        basler_rgb_cam_grab.config_rgb_cam_para(self.rgb_cam)
+        self.tof_cam = basler_tof_cam_grab.create_tof_cam()
+        self.tof_cam.Open()
+        basler_tof_cam_grab.config_tof_cam_para(self.tof_cam)
+        basler_tof_cam_grab.config_tof_data_comp(self.tof_cam, "Point_Cloud")
+
+        for cam in (self.rgb_cam, self.tof_cam):
+            config_software_trigger(cam)
+        rgb_timestamp = self._timestamp_func(self.rgb_cam)
+        tof_timestamp = self._timestamp_func(self.tof_cam)
+        self.rgb_tick_ns = timestamp_tick_ns(self.rgb_cam)
+        self.tof_tick_ns = timestamp_tick_ns(self.tof_cam)
+        self.clock_offset_ns = estimate_clock_offset_ns(self.rgb_cam, self.tof_cam)
+        print(f"ToF - RGB clock offset: {self.clock_offset_ns / 1e6:.3f} ms")
+
+        self.rgb_ring = basler_cam_stream.FrameRing(
+            self.ring_size, (self.rgb_cam.Height.Value, self.rgb_cam.Width.Value, 3), np.uint8)
+        self.tof_ring = basler_cam_stream.FrameRing(
+            self.ring_size, (self.tof_cam.Height.Value, self.tof_cam.Width.Value, 3), np.float32)
+        rgb_hook = tof_hook = None
+        if self.record_dir is not None:
+            self.recorder = session_recorder.SessionRecorder(
+                self.record_dir, cam_calibration.load_calibration().calibration_id,
+                info={"timestamp_clock": "rgb_device_ns", "clock_offset_ns": self.clock_offset_ns,
+                      "max_skew_ms": self.max_skew_ns / 1e6})
+            self.recorder.add_stream("rgb_bayer", (self.rgb_cam.Height.Value, self.rgb_cam.Width.Value), np.uint8)
+            self.recorder.add_stream("tof_Point_Cloud", self.tof_ring.frames.shape[1:], np.float32)
+            # Exposure times on the RGB device clock, the same times read_pair() pairs by
+            rgb_hook = basler_rgb_cam_grab.record_bayer_hook(
+                self.recorder, timestamp_func=lambda r: int(rgb_timestamp(r) * self.rgb_tick_ns))
+            tof_hook = basler_tof_cam_grab.record_tof_comps_hook(
+                self.recorder, ["Point_Cloud"],
+                timestamp_func=lambda r: int(tof_timestamp(r) * self.tof_tick_ns - self.clock_offset_ns))
+        self.rgb_worker = basler_cam_stream.AcquisitionWorker(
+            self.rgb_cam, self.rgb_ring, basler_rgb_cam_grab.bayer_result_into_rgb, timestamp_func=rgb_timestamp,
+            frame_hook=rgb_hook)
+        self.tof_worker = basler_cam_stream.AcquisitionWorker(
+            self.tof_cam, self.tof_ring, self._pcl_result_into, timestamp_func=tof_timestamp, frame_hook=tof_hook)
+        self.rgb_reader = self.rgb_ring.reader()
+        self.tof_reader = self.tof_ring.reader()
+        self._color_buf = np.empty_like(self.rgb_ring.frames[0])
+        self._pcl_buf = np.empty_like(self.tof_ring.frames[0])
+        self._color = None
+        self._pcl = None
+
+        self.rgb_worker.start()
+        self.tof_worker.start()
+        self._stop_event.clear()
+        self.trigger_thread = threading.Thread(target=self._trigger_loop, daemon=True)
+        self.trigger_thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop triggering and acquisition, reset the trigger mode and close both cameras.
+        """
+        self._stop_event.set()
+        self.trigger_thread.join()
+        for worker, cam in ((self.rgb_worker, self.rgb_cam), (self.tof_worker, self.tof_cam)):
+            worker.stop()
+            cam.TriggerMode.Value = "Off"
+            cam.Close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    @staticmethod
+    def _timestamp_func(cam: pylon.InstantCamera):
+        if config_chunk_timestamp(cam):
+            return lambda grab_result: grab_result.ChunkTimestamp.Value
+        return lambda grab_result: grab_result.TimeStamp
+
+    @staticmethod
+    def _pcl_result_into(grab_result, out: np.ndarray) -> None:
+        basler_tof_cam_grab.copy_tof_comps_into(grab_result.GetDataContainer(), {"Point_Cloud": out})
+
+    def _trigger_loop(self) -> None:
+        period = 1.0 / self.trigger_rate_hz if self.trigger_rate_hz else 0.0
+        next_trigger = time.perf_counter()
+        while not self._stop_event.is_set():
+            if not (self.rgb_cam.WaitForFrameTriggerReady(100, pylon.TimeoutHandling_Return)
+                    and self.tof_cam.WaitForFrameTriggerReady(100, pylon.TimeoutHandling_Return)):
+                continue
+            if period:
+                delay = next_trigger - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_trigger += period
+            self.rgb_cam.ExecuteSoftwareTrigger()
+            self.tof_cam.ExecuteSoftwareTrigger()
+
+    def read_pair(self, timeout: float = 1.0):
+        """
+        Get the next synchronized frame pair.
+
+        The returned arrays are reused by the next call, copy them to keep them.
+
+        Returns:
+            (color_img, pcl, skew_ms): RGB image (Hc, Wc, 3) uint8, point cloud (Hd, Wd, 3)
+            float32 [mm] and the exposure time difference ToF - RGB [ms].
+            None if no pair arrived in time.
+        """
+        while True:
+            if self._color is None:
+                self._color = self.rgb_reader.read_next(out=self._color_buf, timeout=timeout)
+                if self._color is None:
+                    return None
+            if self._pcl is None:
+                self._pcl = self.tof_reader.read_next(out=self._pcl_buf, timeout=timeout)
+                if self._pcl is None:
+                    return None
+            color_ns = self._color[1] * self.rgb_tick_ns
+            tof_ns = self._pcl[1] * self.tof_tick_ns - self.clock_offset_ns
+            skew_ns = tof_ns - color_ns
+            if abs(skew_ns) <= self.max_skew_ns:
+                skew_ms = skew_ns / 1e6
+                self.pairs += 1
+                self.skew_sum_ms += abs(skew_ms)
+                self.skew_max_ms = max(self.skew_max_ms, abs(skew_ms))
+                color_img, pcl = self._color[0], self._pcl[0]
+                self._color = None
+                self._pcl = None
+                return color_img, pcl, skew_ms
+            # Drop the older frame, it has no partner anymore
+            if skew_ns > 0:
+                self.unpaired_color += 1
+                self._color = None
+            else:
+                self.unpaired_tof += 1
+                self._pcl = None
+
+    def stats(self) -> dict:
+        """
+        Pairing, skew and drop statistics.
+        """
+        return {
+            "pairs": self.pairs,
+            "skew_mean_ms": self.skew_sum_ms / self.pairs if self.pairs else 0.0,
+            "skew_max_ms": self.skew_max_ms,
+            "unpaired_color": self.unpaired_color,
+            "unpaired_tof": self.unpaired_tof,
+            "dropped_color": self.rgb_reader.dropped,
+            "dropped_tof": self.tof_reader.dropped,
+            "rgb_acquisition": self.rgb_worker.stats(),
+            "tof_acquisition": self.tof_worker.stats(),
+            "recording": self.recorder.stats() if self.recorder is not None else None,
+        }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import basler_fusion_depth_rgb
+
+    parser = argparse.ArgumentParser(description="Synchronized RGB + ToF capture")
+    parser.add_argument("--record", help="Record both streams into this (new) session directory, "
+                                         "replay it with main.py --replay")
+    args = parser.parse_args()
+
+    # Fuse synchronized pairs at the cameras' rate
+    with PairedCapture(max_skew_ms=5.0, record_dir=args.record) as capture:
+        while True:
+            pair = capture.read_pair()
+            if pair is None:
+                continue
+            color_img, pcl, skew_ms = pair
+            depth_color_frame, _ = basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img)
+            overlay_heatmap, _ = basler_fusion_depth_rgb.visualize_rgb_depth_alignment(color_img, depth_color_frame)
+            cv2.imshow("overlay_heatmap", overlay_heatmap)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+        print(f"Pairing stats: {capture.stats()}")
+    cv2.destroyAllWindows()
@@ -0,0 +1,156 @@
+import time
+from typing import Callable, Optional
+
+from pypylon import pylon
+import basler_cam_init
+import camera_profile
+
+class BaslerCamSession:
+    """
+    Keep a Basler camera open, configured and grabbing across many grabs.
+
+    The camera is opened and configured once, then kept in continuous acquisition with
+    the "latest image only" strategy, so grab() only waits for the next frame instead of
+    paying the open/configure/close cost every time.
+
+    Args:
+        serial_number (str): Basler camera's serial number.
+        config_func (Callable): Called with the opened pylon.InstantCamera to write the parameters.
+        convert_func (Callable): Called with a successful grab result, returns the output data.
+            The grab result is released right after, so the output must not reference its buffer.
+        grab_timeout_ms (int): Timeout of a single RetrieveResult call [ms].
+        max_reconnects (int): How many times grab() tries to reconnect before raising.
+    """
+    def __init__(
+        self,
+        serial_number: str,
+        config_func: Callable[[pylon.InstantCamera], None],
+        convert_func: Callable = lambda grab_result: grab_result.Array,
+        grab_timeout_ms: int = 1000,
+        max_reconnects: int = 3,
+    ):
+        self.serial_number = serial_number
+        self.config_func = config_func
+        self.convert_func = convert_func
+        self.grab_timeout_ms = grab_timeout_ms
+        self.max_reconnects = max_reconnects
+        self.cam: Optional[pylon.InstantCamera] = None
+        self.open_time_s = 0.0
+
+    def open(self) -> None:
+        """
+        Create, open and configure the camera, then start the continuous grabbing.
+        """
+        if self.is_open():
+            return
+        t0 = time.perf_counter()
+        self.cam = basler_cam_init.create_basler_cam(self.serial_number)
+        self.cam.Open()
+        self.config_func(self.cam)
+        self.cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        self.open_time_s = time.perf_counter() - t0
+        print(f"Camera {self.serial_number} session opened in {self.open_time_s:.2f} s")
+
+    def close(self) -> None:
+        """
+        Stop grabbing, close and destroy the camera. Safe to call more than once.
+        """
+        if self.cam is None:
+            return
+        try:
+            if self.cam.IsGrabbing():
+                self.cam.StopGrabbing()
+            if self.cam.IsOpen():
+                self.cam.Close()
+            self.cam.DestroyDevice()
+        except pylon.GenericException as exc:
+            print(f"Camera {self.serial_number} close error: {exc}")
+        self.cam = None
+
+    def is_open(self) -> bool:
+        return self.cam is not None and self.cam.IsOpen() and not self.cam.IsCameraDeviceRemoved()
+
+    def reconnect(self) -> None:
+        """
+        Drop the current device and bring the camera up again with the same configuration.
+        """
+        print(f"Reconnecting camera {self.serial_number} ...")
+        self.close()
+        # The device may have been power cycled, read its parameters again
+        camera_profile.invalidate_device_state(self.serial_number)
+        self.open()
+
+    def grab(self):
+        """
+        Grab the newest frame from the running acquisition.
+
+        Returns:
+            The output of convert_func for the grabbed frame.
+        """
+        for attempt in range(self.max_reconnects + 1):
+            try:
+                if not self.is_open():
+                    self.reconnect()
+                grab_result = self.cam.RetrieveResult(self.grab_timeout_ms, pylon.TimeoutHandling_ThrowException)
+                try:
+                    if grab_result.GrabSucceeded():
+                        return self.convert_func(grab_result)
+                    print(f"Camera {self.serial_number} grab failed: {grab_result.ErrorDescription}")
+                finally:
+                    grab_result.Release()
+            except pylon.GenericException as exc:
+                print(f"Camera {self.serial_number} grab error ({attempt + 1}/{self.max_reconnects + 1}): {exc}")
+                self.close()
+        raise RuntimeError(f"Failed to grab from camera {self.serial_number}")
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Long-lived sessions, one per serial number: {serial_number: (config_key, session)}
+_sessions = {}
+
+def get_cam_session(serial_number: str, config_func, convert_func=lambda grab_result: grab_result.Array,
+                    config_key=None, **kwargs) -> BaslerCamSession:
+    """
+    Get the opened session of a camera, create and open it on the first call.
+
+    A camera has one session at a time, so asking for the session of a camera with another
+    configuration than the cached one raises instead of returning a session whose grab()
+    delivers other data. Call close_all_sessions() first to switch the configuration.
+
+    Args:
+        serial_number (str): Basler camera's serial number.
+        config_func, convert_func, kwargs: See BaslerCamSession, only used on the first call.
+        config_key: Hashable description of the configuration. None for the identity of
+            config_func, convert_func and the kwargs (callers building new closures on every
+            call should pass a key).
+
+    Returns:
+        BaslerCamSession: The opened camera session
+    """
+    if config_key is None:
+        config_key = (config_func, convert_func, tuple(sorted(kwargs.items())))
+    cached = _sessions.get(serial_number)
+    if cached is None:
+        session = BaslerCamSession(serial_number, config_func, convert_func, **kwargs)
+        _sessions[serial_number] = (config_key, session)
+    else:
+        cached_key, session = cached
+        if cached_key != config_key:
+            raise ValueError(f"Camera {serial_number} already has a session with another configuration "
+                             f"({cached_key} != {config_key}), close it first")
+    session.open()
+    return session
+
+def close_all_sessions() -> None:
+    """
+    Close every camera session created by get_cam_session().
+    """
+    for _, session in _sessions.values():
+        session.close()
+    _sessions.clear()
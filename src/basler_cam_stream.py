@@ -0,0 +1,207 @@
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+from pypylon import pylon
+
+class FrameRing:
+    """
+    Fixed-size ring of preallocated frames with device timestamps and frame IDs.
+
+    A single writer fills the slots in order, any number of readers copy them out.
+    Frame number `seq` lives in slot `seq % capacity` and stays valid until the writer
+    has wrapped around the ring once more.
+
+    Args:
+        capacity (int): Number of frame slots.
+        shape (tuple): Shape of one frame, e.g. (1024, 1280, 3).
+        dtype: numpy dtype of one frame.
+    """
+    def __init__(self, capacity: int, shape: tuple, dtype):
+        if capacity < 2:
+            raise ValueError("FrameRing needs at least 2 slots")
+        self.capacity = capacity
+        self.frames = np.zeros((capacity,) + tuple(shape), dtype=dtype)
+        self.timestamps = np.zeros(capacity, dtype=np.uint64)
+        self.frame_ids = np.zeros(capacity, dtype=np.int64)
+        self.write_count = 0  # Number of committed frames
+        self._cond = threading.Condition()
+
+    def write_slot(self) -> np.ndarray:
+        """
+        Slot the writer fills next. Only valid until commit() is called.
+        """
+        return self.frames[self.write_count % self.capacity]
+
+    def commit(self, timestamp: int, frame_id: int) -> None:
+        """
+        Publish the frame written into write_slot().
+        """
+        with self._cond:
+            idx = self.write_count % self.capacity
+            self.timestamps[idx] = timestamp
+            self.frame_ids[idx] = frame_id
+            self.write_count += 1
+            self._cond.notify_all()
+
+    def _is_valid(self, seq: int) -> bool:
+        # The slot of seq is rewritten once the writer reaches seq + capacity
+        return self.write_count - self.capacity < seq < self.write_count
+
+    def _copy(self, seq: int, out: Optional[np.ndarray]):
+        idx = seq % self.capacity
+        if out is None:
+            out = np.empty_like(self.frames[idx])
+        np.copyto(out, self.frames[idx])
+        return out, int(self.timestamps[idx]), int(self.frame_ids[idx])
+
+    def wait_for(self, seq: int, timeout: Optional[float]) -> bool:
+        """
+        Wait until frame number `seq` is committed.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.write_count > seq, timeout)
+
+    def read_latest(self, out: Optional[np.ndarray] = None, timeout: Optional[float] = 1.0):
+        """
+        Copy the newest frame ("latest" semantics).
+
+        Args:
+            out: Optional preallocated output array, avoids an allocation per read.
+            timeout: Seconds to wait for the first frame.
+
+        Returns:
+            (frame, timestamp, frame_id, seq), or None if no frame arrived in time.
+        """
+        if not self.wait_for(0, timeout):
+            return None
+        while True:
+            seq = self.write_count - 1
+            frame, timestamp, frame_id = self._copy(seq, out)
+            if self._is_valid(seq):
+                return frame, timestamp, frame_id, seq
+
+    def reader(self) -> "FrameReader":
+        """
+        Create a reader with "every frame" semantics, starting at the next committed frame.
+        """
+        return FrameReader(self)
+
+
+class FrameReader:
+    """
+    Consumer cursor into a FrameRing which reads every frame in order.
+
+    Frames the writer overwrote before they were read are skipped and counted in `dropped`.
+    """
+    def __init__(self, ring: FrameRing):
+        self.ring = ring
+        self.next_seq = ring.write_count
+        self.dropped = 0
+
+    def read_next(self, out: Optional[np.ndarray] = None, timeout: Optional[float] = 1.0):
+        """
+        Copy the next unread frame.
+
+        Returns:
+            (frame, timestamp, frame_id, seq), or None if no frame arrived in time.
+        """
+        while True:
+            if not self.ring.wait_for(self.next_seq, timeout):
+                return None
+            oldest = self.ring.write_count - self.ring.capacity + 1
+            if self.next_seq < oldest:
+                self.dropped += oldest - self.next_seq
+                self.next_seq = oldest
+            seq = self.next_seq
+            frame, timestamp, frame_id = self.ring._copy(seq, out)
+            if self.ring._is_valid(seq):
+                self.next_seq = seq + 1
+                return frame, timestamp, frame_id, seq
+
+
+class AcquisitionWorker(threading.Thread):
+    """
+    Background thread that retrieves frames from a grabbing camera into a FrameRing.
+
+    Display, saving and processing run on other threads and read from the ring, so a slow
+    consumer never stalls the GigE stream.
+
+    Args:
+        cam (pylon.InstantCamera): An opened and configured camera.
+        ring (FrameRing): Ring the frames are written into.
+        convert_into (Callable): Called with (grab_result, out) to write one frame into the slot `out`.
+        timeout_ms (int): Timeout of a single RetrieveResult call [ms].
+        timestamp_func (Callable): Returns the device timestamp of a grab result
+            (e.g. the chunk timestamp instead of the transport layer one).
+        frame_hook (Callable): Optional, called with every successful grab result before it is
+            converted (e.g. to record the raw frame with a SessionRecorder).
+    """
+    def __init__(
+        self,
+        cam: pylon.InstantCamera,
+        ring: FrameRing,
+        convert_into: Callable[[pylon.GrabResult, np.ndarray], None],
+        timeout_ms: int = 1000,
+        timestamp_func: Callable[[pylon.GrabResult], int] = lambda grab_result: grab_result.TimeStamp,
+        frame_hook: Optional[Callable[[pylon.GrabResult], None]] = None,
+    ):
+        super().__init__(daemon=True)
+        self.cam = cam
+        self.ring = ring
+        self.convert_into = convert_into
+        self.timeout_ms = timeout_ms
+        self.timestamp_func = timestamp_func
+        self.frame_hook = frame_hook
+        self.failed_grabs = 0   # Grab results with an error (incomplete frame, ...)
+        self.missed_frames = 0  # Gaps in the device frame IDs
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        if not self.cam.IsGrabbing():
+            self.cam.StartGrabbing(pylon.GrabStrategy_OneByOne)
+        last_frame_id = None
+        try:
+            while not self._stop_event.is_set() and self.cam.IsGrabbing():
+                grab_result = self.cam.RetrieveResult(self.timeout_ms, pylon.TimeoutHandling_Return)
+                if grab_result is None or not grab_result.IsValid():
+                    continue
+                try:
+                    if not grab_result.GrabSucceeded():
+                        self.failed_grabs += 1
+                        continue
+                    frame_id = grab_result.BlockID
+                    if last_frame_id is not None and frame_id > last_frame_id + 1:
+                        self.missed_frames += frame_id - last_frame_id - 1
+                    last_frame_id = frame_id
+                    if self.frame_hook is not None:
+                        self.frame_hook(grab_result)
+                    self.convert_into(grab_result, self.ring.write_slot())
+                    self.ring.commit(self.timestamp_func(grab_result), frame_id)
+                finally:
+                    grab_result.Release()
+        except pylon.GenericException as exc:
+            self.error = exc
+            print(f"Acquisition stopped: {exc}")
+        finally:
+            self.cam.StopGrabbing()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """
+        Ask the thread to stop and wait for it.
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self) -> dict:
+        """
+        Drop counters of the acquisition.
+        """
+        return {
+            "frames": self.ring.write_count,
+            "failed_grabs": self.failed_grabs,
+            "missed_frames": self.missed_frames,
+        }
+
@@ -9,6 +9,7 @@ intrinsic camera parameters of the blaze camera and the color camera as well as
 the relative rotation and translation between the cameras.
 """
 
+import argparse
 import os
 import platform
 import traceback
@@ -27,6 +28,8 @@ import open3d as o3d
 # https://github.com/genicam/harvesters
 from harvesters.core import Harvester
 
+import tof_buffer_pool
+
 
 BAYER_FORMATS = {"BayerGR8": cv2.COLOR_BayerGR2BGR,
                  "BayerRG8": cv2.COLOR_BayerRG2BGR,
@@ -188,11 +191,15 @@ class Fusion:
         """
         self.h.reset()
 
-    def get_image_blaze(self):
+    def get_image_blaze(self, out=None):
         """
         Fetch one blaze buffer and return:
            - point cloud as (H, W, 3) float32 (X,Y,Z in meters)
            - intensity as (H, W) uint16
+
+        Args:
+            out: Optional (point cloud, intensity) arrays to copy into, e.g. from a
+                 tof_buffer_pool.ToFFrameBuffer. Avoids allocating two new arrays per frame.
         """
         with self.ia_blaze.fetch() as buffer:
             # Warning: The buffer is only valid in the with statement and will be destroyed
@@ -216,7 +223,11 @@ class Fusion:
             _2d_intensity = intensity.data.reshape(
                 intensity.height, intensity.width)
 
-            return np.copy(_3d), np.copy(_2d_intensity)
+            if out is None:
+                return np.copy(_3d), np.copy(_2d_intensity)
+            np.copyto(out[0], _3d)
+            np.copyto(out[1], _2d_intensity)
+            return out
 
     def get_image_2DCamera(self):
         """
@@ -268,48 +279,53 @@ class Fusion:
         self.color_camera_matrix = cv_file.getNode("colorCameraMatrix").mat()
         self.color_dist = cv_file.getNode("colorDistortion").mat()
 
-    def warp_color_to_depth(self, pointcloud, color):
+    def warp_color_to_depth(self, pointcloud, color, out=None):
         """
         Project each 3D point (in blaze frame) to the color image and sample color.
 
         Args:
-            pointcloud: (H, W, 3) float32, XYZ in meters.
+            pointcloud: (H, W, 3) float32 or float64, XYZ in meters.
             color:      (Hc, Wc, 3) uint8, BGR image from the color camera.
+            out:        Optional (H, W, 3) float64 array to write into, reused frame to frame.
 
         Returns:
             warped: (H, W, 3) float64, per-point BGR sampled from color image.
                     Pixels with invalid depth or out-of-bounds projections remain zero.
         """
-        warped = np.zeros(pointcloud.shape, np.float64)
+        H, W = pointcloud.shape[:2]
+        if out is None:
+            out = np.empty((H, W, 3), np.float64)
+
+        # Determine color values only for the points with depth information.
+        pointvec = pointcloud.reshape(H * W, 3)
+        idx = np.flatnonzero(pointvec[:, 2] != 0.0)
+        warped = out.reshape(H * W, 3)
+        warped.fill(0)
+        if idx.size == 0:
+            return out
 
         # Project the 3D points into the color camera.
-        pointvec = pointcloud.reshape(640*480, 3)
         img_points = cv2.projectPoints(
-            pointvec, self.rotation, self.translation, self.color_camera_matrix, self.color_dist)
-        img_points = img_points[0].reshape(480, 640, 2)
-        img_points = np.rint(img_points)
-        img_points = img_points.astype(int)
-
+            pointvec[idx], self.rotation, self.translation, self.color_camera_matrix, self.color_dist)
+        img_points = img_points[0].reshape(idx.size, 2)
+        u = np.rint(img_points[:, 0]).astype(np.int32)
+        v = np.rint(img_points[:, 1]).astype(np.int32)
 
-        # No depth information available for this pixel or pixel is invalid
-        mask_1 = pointcloud[:, :, 2] == 0.0
-        mask_2 = (img_points[:, :, 1] < 0) | (img_points[:, :, 1] > color.shape[0]-1)
-        mask_3 = (img_points[:, :, 0] < 0) | (img_points[:, :, 0] > color.shape[1]-1)
-        mask_sum = (mask_1 | mask_2) | mask_3
+        # Skip projections outside the color image.
+        inside = (u >= 0) & (u < color.shape[1]) & (v >= 0) & (v < color.shape[0])
+        warped[idx[inside]] = color[v[inside], u[inside]]
+        return out
 
-
-        # Determine color values for the points of the point cloud.
-        for i in range(warped.shape[0]):
-            for j in range(warped.shape[1]):
-                if mask_sum[i, j]:
-                    continue
-                
-                u = img_points.item(i, j, 1)
-                v = img_points.item(i, j, 0)
-
-                warped[i, j] = color[u, v]
-
-        return warped
+    def full_point_cloud(self, pointcloud, color):
+        """
+        Colored Open3D point cloud of all blaze points, e.g. to save it while a decimated one is displayed.
+        """
+        H, W = pointcloud.shape[:2]
+        colors = self.warp_color_to_depth(pointcloud, color)
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(pointcloud.reshape(H * W, 3).astype(np.float64))
+        pcd.colors = o3d.utility.Vector3dVector(colors.reshape(H * W, 3) / 256.0)
+        return pcd
 
     # Open3D callbacks
     def cbStopGrabbing(self, vis):
@@ -320,9 +336,13 @@ class Fusion:
         self.savePcd = True
         return False
 
-    def run(self):
+    def run(self, decimation: int = 1):
         """
         Main loop: setup devices, load calib, fuse, visualize, and optionally save .pcd.
+
+        Args:
+            decimation: Display every n-th point in both directions, fewer points to
+                        color and upload keep the viewer up with the blaze frame rate.
         """
         # Set up the cameras.
         self.setup_blaze()
@@ -345,6 +365,20 @@ class Fusion:
         self.savePcd = False
         self.savePcdCnt = 0
 
+        # Reused blaze buffers, so the loop does not allocate new arrays per frame.
+        blaze_buffer = tof_buffer_pool.ToFBufferPool(
+            1, data_types=("Point_Cloud", "Intensity_Image")).acquire()
+        blaze_out = (blaze_buffer["Point_Cloud"], blaze_buffer["Intensity_Image"])
+
+        # The point and color vectors of the decimated cloud are allocated once, (N,3) float64;
+        # every frame is written in place through numpy views of the Open3D memory.
+        H, W = blaze_buffer["Point_Cloud"].shape[:2]
+        H_d, W_d = -(-H // decimation), -(-W // decimation)
+        self.pcd.points = o3d.utility.Vector3dVector(np.zeros((H_d * W_d, 3), np.float64))
+        self.pcd.colors = o3d.utility.Vector3dVector(np.zeros((H_d * W_d, 3), np.float64))
+        points_view = np.asarray(self.pcd.points).reshape(H_d, W_d, 3)
+        colors_view = np.asarray(self.pcd.colors).reshape(H_d, W_d, 3)
+
         print('')
         print('Fusion of color and depth data')
         print('  - Press "s" in the viewer to save a point cloud as .pcd file')
@@ -360,24 +394,19 @@ class Fusion:
             self.ia_gev.remote_device.node_map.TriggerSoftware.execute()
             self.ia_blaze.remote_device.node_map.TriggerSoftware.execute()
 
-            pointcloud, intensity = self.get_image_blaze()  # (H,W,3), (H,W)
+            pointcloud, intensity = self.get_image_blaze(blaze_out)  # (H,W,3), (H,W)
             color = self.get_image_2DCamera()  # (Hc,Wc,3) BGR
-            color_warped = self.warp_color_to_depth(pointcloud, color)  # (H,W,3)
-
-            # Prepare data for display in Open3d viewer.
-            # Prepare Open3D geometry (N,3) float64
-            self.pcd.points = o3d.utility.Vector3dVector(
-                pointcloud.reshape(pointcloud.shape[0] * pointcloud.shape[1], 3).astype(np.float64))
+            np.copyto(points_view, pointcloud[::decimation, ::decimation])
+            self.warp_color_to_depth(points_view, color, out=colors_view)  # (H_d,W_d,3)
 
             # The color data must be scaled to the range of 0 to 1 for display with Open3d viewer.
-            color_warped = color_warped / 256.0
-            self.pcd.colors = o3d.utility.Vector3dVector(
-                color_warped.reshape(color_warped.shape[0] * color_warped.shape[1], 3).astype(np.float64))
+            np.multiply(colors_view, 1 / 256.0, out=colors_view)
 
-            # Save .pcd file.
+            # Save .pcd file, always at full resolution.
             if self.savePcd:
                 o3d.io.write_point_cloud(
-                    "Pointcloud_{}.pcd".format(self.savePcdCnt), self.pcd)
+                    "Pointcloud_{}.pcd".format(self.savePcdCnt),
+                    self.pcd if decimation == 1 else self.full_point_cloud(pointcloud, color))
                 self.savePcdCnt += 1
                 self.savePcd = False
 
@@ -400,6 +429,7 @@ class Fusion:
             self.vis.update_renderer()
 
         self.vis.destroy_window()
+        blaze_buffer.release()
 
         # Close the camera and release the producers.
         self.close_blaze()
@@ -410,9 +440,13 @@ class Fusion:
 if __name__ == "__main__":
     """ Run the sample.
     """
+    parser = argparse.ArgumentParser(description="Colored point cloud of the blaze and the color camera")
+    parser.add_argument("--decimation", type=int, default=1, help="Display every n-th point in both directions")
+    args = parser.parse_args()
+
     Sample = Fusion()
     try:
-        Sample.run()
+        Sample.run(decimation=args.decimation)
     except Exception:
         traceback.print_exc()
         Sample.close_harvesters()
@@ -1,12 +1,15 @@
 import cv2
 import numpy as np
 
-import basler_rgb_cam_grab
-import basler_tof_cam_grab
+import cam_calibration
+import point_culling
+import projection_lut
+import zbuffer
 
 def load_cam_calibration_file():
     """
     Load intrinsic/extrinsic matrices from the calibration XML.
+    The file is parsed only once, see cam_calibration.load_calibration().
 
     Returns:
         Kc (3x3), dc (Nx1), Kd (3x3), dd (Nx1), R (3x3), T (3x1)
@@ -15,36 +18,46 @@ def load_cam_calibration_file():
           Kd, dd: blaze (depth) intrinsics, distortion (often zeros)
           R, T:   transform from depth(blaze) frame to color frame
     """
-    xml_path = f"./basler_calibration/calibration_24945819_24747625.xml"
-    fs = cv2.FileStorage(xml_path, cv2.FILE_STORAGE_READ)
-    if not fs.isOpened():
-        raise FileNotFoundError(f"Cannot open calibration file: {xml_path}")
-
-    Kc = fs.getNode("colorCameraMatrix").mat()
-    dc = fs.getNode("colorDistortion").mat()
-    Kd = fs.getNode("blazeCameraMatrix").mat()  # may exist in your XML
-    dd = fs.getNode("blazeDistortion").mat()    # may be zeros in your sample
-    R  = fs.getNode("rotation").mat()
-    T  = fs.getNode("translation").mat()
-    fs.release()
-
-    if Kd is None or Kd.size == 0:
-        raise ValueError("Missing 'blazeCameraMatrix' in XML (depth intrinsics are required).")
-
-    if dd is None or dd.size == 0:
-        dd = np.zeros((1,5), dtype=np.float32)
-
-    # Ensure proper shapes
-    Kc = Kc.astype(np.float32)
-    dc = dc.astype(np.float32).reshape(-1,1)
-    Kd = Kd.astype(np.float32)
-    dd = dd.astype(np.float32).reshape(-1,1)
-    R  = R.astype(np.float32)
-    T  = T.astype(np.float32).reshape(3,1)
-
-    return Kc, dc, Kd, dd, R, T
-
-def warp_depth_with_color(pcl, color_img, interp="nearest"):
+    return cam_calibration.load_calibration().as_tuple()
+
+def project_culled_points(pcl, calib: cam_calibration.CamCalibration, confidence=None,
+                          culling: point_culling.PointCulling = None, lut: projection_lut.ProjectionLUT = None):
+    """
+    Cull the depth points first, then project only the kept ones into the color camera.
+
+    Args:
+        pcl:        (Hd, Wd, 3) float32, XYZ in depth frame [millimeters]
+        calib:      calibration
+        confidence: optional (Hd, Wd) uint16 confidence map of the same grab
+        culling:    point selection, None to only drop the Z == 0 points
+        lut:        optional projection table of the calibration, replaces cv2.projectPoints
+
+    Returns:
+        idx:     (M,) flat depth pixel indices of the kept points
+        pts:     (M, 3) float32 kept points [millimeters]
+        img_pts: (M, 2) color pixel coordinates (u, v) of the kept points
+    """
+    if culling is None:
+        culling = point_culling.Z_VALID_CULLING
+    idx = culling.select(pcl, confidence)
+    pts = pcl.reshape(-1, 3)[idx].astype(np.float32)
+    if idx.size == 0:
+        return idx, pts, np.empty((0, 2), dtype=np.float32)
+
+    if lut is not None:
+        # Interpolated from the precomputed projections of every ToF pixel
+        img_pts = lut.project(pts[:, 2], pix=idx)
+    else:
+        # cv2.projectPoints applies: [u, v] = Kc * (R * Xd + T) / Z
+        # It handles both rotation/translation (extrinsics) and lens distortion (dc)
+        # OpenCV can take a 3x3 rotation matrix in place of rvec; cv2 will convert internally
+        img_pts, _ = cv2.projectPoints(pts, calib.R, calib.T, calib.Kc, calib.dc)  # -> (M,1,2)
+        img_pts = img_pts.reshape(-1, 2)
+    return idx, pts, img_pts
+
+def warp_depth_with_color(pcl, color_img, interp="nearest", calib: cam_calibration.CamCalibration = None,
+                          lut: projection_lut.ProjectionLUT = None, confidence=None,
+                          culling: point_culling.PointCulling = None, sampler="numpy", out=None):
     """
     Project organized 3D points (depth frame) into the color camera and sample color.
 
@@ -54,48 +67,62 @@ def warp_depth_with_color(pcl, color_img, interp="nearest"):
         Kc, dc:    color intrinsics and distortion
         color_img: (Hc, Wc, 3) uint8 BGR
         interp:    'nearest' or 'bilinear'
+        calib:     calibration, None for the default calibration file (loaded once)
+        lut:       optional projection table of the calibration, replaces cv2.projectPoints
+        confidence: optional (Hd, Wd) uint16 confidence map, used by the culling
+        culling:   points to sample, None for all points with Z>0 (see project_culled_points)
+        sampler:   'numpy' (gathers) or 'remap' (cv2.remap on maps built from the projected
+                   coordinates, bilinear values may differ by 1 from the 'numpy' sampler)
+        out:       optional (Hd, Wd, 3) uint8 array to write the colors into, reused across frames
 
     Returns:
         color_on_depth: (Hd, Wd, 3) uint8, BGR on depth grid (zeros where invalid)
-        valid_mask:     (Hd, Wd) bool, True if sampled inside color bounds and Z>0
+        valid_mask:     (Hd, Wd) bool, True if sampled inside color bounds and kept by the culling
     """
 
     # Load calibration parameter
-    Kc, dc, Kd, dd, R, T = load_cam_calibration_file()
+    if calib is None:
+        calib = cam_calibration.load_calibration()
 
     Hd, Wd, _ = pcl.shape
     Hc, Wc = color_img.shape[:2]
+    if interp not in ("nearest", "bilinear"):
+        raise ValueError("interp must be 'nearest' or 'bilinear'")
+    if sampler not in ("numpy", "remap"):
+        raise ValueError("sampler must be 'numpy' or 'remap'")
+    if out is None:
+        out = np.empty((Hd, Wd, 3), dtype=np.uint8)
 
-    pts = pcl.reshape(-1, 3)
+    # Only the kept points are projected and sampled
+    idx, _, img_pts = project_culled_points(pcl, calib, confidence, culling, lut)
+    valid = np.zeros(Hd*Wd, dtype=bool)
 
-    # OpenCV can take a 3x3 rotation matrix in place of rvec; cv2 will convert internally
-    img_pts, _ = cv2.projectPoints(pts, R, T, Kc, dc)  # -> (N,1,2)
-    img_pts = img_pts.reshape(-1, 2)
+    if sampler == "remap":
+        return _remap_color(color_img, idx, img_pts, interp, out, valid)
 
     if interp == "nearest":
         u = np.rint(img_pts[:,0]).astype(np.int32)  # x (col)
         v = np.rint(img_pts[:,1]).astype(np.int32)  # y (row)
-        Z = pts[:,2]
-        valid = (Z > 0) & (u >= 0) & (u < Wc) & (v >= 0) & (v < Hc)
+        inside = (u >= 0) & (u < Wc) & (v >= 0) & (v < Hc)
 
-        out = np.zeros((Hd*Wd, 3), dtype=np.uint8)
-        out[valid] = color_img[v[valid], u[valid]]
-        out = out.reshape(Hd, Wd, 3)
+        out_flat = out.reshape(Hd*Wd, 3)
+        out_flat.fill(0)
+        out_flat[idx[inside]] = color_img[v[inside], u[inside]]
+        valid[idx[inside]] = True
         return out, valid.reshape(Hd, Wd)
 
-    elif interp == "bilinear":
+    else:
         # Bilinear sampling on float coords
         u = img_pts[:,0]
         v = img_pts[:,1]
-        Z = pts[:,2]
         # bounds for sampling window
         u0 = np.floor(u).astype(np.int32)
         v0 = np.floor(v).astype(np.int32)
         u1 = u0 + 1
         v1 = v0 + 1
 
-        valid = (Z > 0) & (u0 >= 0) & (v0 >= 0) & (u1 < Wc) & (v1 < Hc)
-        out = np.zeros((Hd*Wd, 3), dtype=np.float32)
+        inside = np.where((u0 >= 0) & (v0 >= 0) & (u1 < Wc) & (v1 < Hc))[0]
+        colors = np.zeros((Hd*Wd, 3), dtype=np.float32)
 
         # weights
         du = (u - u0).astype(np.float32)
@@ -105,24 +132,51 @@ def warp_depth_with_color(pcl, color_img, interp="nearest"):
         w01 = (1-du)*dv
         w11 = du*dv
 
-        idx = np.where(valid)[0]
-        uu0, vv0 = u0[idx], v0[idx]
-        uu1, vv1 = u1[idx], v1[idx]
+        uu0, vv0 = u0[inside], v0[inside]
+        uu1, vv1 = u1[inside], v1[inside]
 
         c00 = color_img[vv0, uu0].astype(np.float32)
         c10 = color_img[vv0, uu1].astype(np.float32)
         c01 = color_img[vv1, uu0].astype(np.float32)
         c11 = color_img[vv1, uu1].astype(np.float32)
 
-        out[idx] = (c00*w00[idx,None] + c10*w10[idx,None] +
-                    c01*w01[idx,None] + c11*w11[idx,None])
-        out = np.clip(out, 0, 255).astype(np.uint8).reshape(Hd, Wd, 3)
+        colors[idx[inside]] = (c00*w00[inside,None] + c10*w10[inside,None] +
+                               c01*w01[inside,None] + c11*w11[inside,None])
+        valid[idx[inside]] = True
+        np.clip(colors, 0, 255, out=colors)
+        np.copyto(out, colors.reshape(Hd, Wd, 3), casting="unsafe")
         return out, valid.reshape(Hd, Wd)
 
+def _remap_color(color_img, idx, img_pts, interp, out, valid):
+    """
+    cv2.remap sampler of warp_depth_with_color: the projected coordinates of the kept points
+    become float maps on the depth grid, the other pixels map outside the color image.
+    """
+    Hd, Wd = out.shape[:2]
+    Hc, Wc = color_img.shape[:2]
+    map_x = np.full(Hd*Wd, -10, dtype=np.float32)
+    map_y = np.full(Hd*Wd, -10, dtype=np.float32)
+    map_x[idx] = img_pts[:, 0]
+    map_y[idx] = img_pts[:, 1]
+    map_x = map_x.reshape(Hd, Wd)
+    map_y = map_y.reshape(Hd, Wd)
+
+    interpolation = cv2.INTER_NEAREST if interp == "nearest" else cv2.INTER_LINEAR
+    cv2.remap(color_img, map_x, map_y, interpolation, dst=out,
+              borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+
+    # Same bounds as the numpy sampler, partially outside bilinear samples are cleared
+    valid = valid.reshape(Hd, Wd)
+    if interp == "nearest":
+        u = np.rint(map_x)
+        v = np.rint(map_y)
+        np.logical_and((u >= 0) & (u < Wc), (v >= 0) & (v < Hc), out=valid)
     else:
-        raise ValueError("interp must be 'nearest' or 'bilinear'")
+        np.logical_and((map_x >= 0) & (map_x < Wc - 1), (map_y >= 0) & (map_y < Hc - 1), out=valid)
+        np.multiply(out, valid[:, :, None], out=out)
+    return out, valid
 
-def transform_pcl_to_color_frame(pcl):
+def transform_pcl_to_color_frame(pcl, calib: cam_calibration.CamCalibration = None):
     """
     Transform an organized point cloud from DEPTH frame to COLOR frame.
 
@@ -130,18 +184,23 @@ def transform_pcl_to_color_frame(pcl):
         pcl: (Hd, Wd, 3) float32, XYZ in depth frame, **millimeters**
         R:      (3,3) rotation,  color <- depth
         T:      (3,1) translation, color <- depth, **millimeters**
+        calib:  calibration, None for the default calibration file (loaded once)
 
     Returns:
         pcl_on_color_frame: (Hd, Wd, 3) float32, XYZ in color frame, **millimeters**
     """
     # Load calibration parameter
-    Kc, dc, Kd, dd, R, T = load_cam_calibration_file()
+    if calib is None:
+        calib = cam_calibration.load_calibration()
+    Kc, dc, Kd, dd, R, T = calib.as_tuple()
     Hd, Wd, _ = pcl.shape
     pts = pcl.reshape(-1, 3).astype(np.float32)
     Xc = (pts @ R.T) + T.ravel()
     return Xc.reshape(Hd, Wd, 3).astype(np.float32)  # pcl_on_color_frame
 
-def project_depth_to_color_frame(pcl, color_img):
+def project_depth_to_color_frame(pcl, color_img, calib: cam_calibration.CamCalibration = None, out=None,
+                                 lut: projection_lut.ProjectionLUT = None, confidence=None,
+                                 culling: point_culling.PointCulling = None):
     """
     Directly project the depth camera point cloud (in mm) into the color camera frame,
     and rasterize it into a Z-buffer depth map at the color image resolution.
@@ -154,6 +213,11 @@ def project_depth_to_color_frame(pcl, color_img):
                     R: 3x3 rotation matrix
                     T: 3x1 translation vector [millimeters]
         color_img : The color image (output depth map size)
+        calib     : calibration, None for the default calibration file (loaded once)
+        out       : optional (Hc, Wc) uint16 array to write the depth map into, reused across frames
+        lut       : optional projection table of the calibration, replaces cv2.projectPoints
+        confidence: optional (Hd, Wd) uint16 confidence map, used by the culling
+        culling   : points to project, None for all points with Z>0 (see project_culled_points)
 
     Returns:
         depth_rgb : (Hc, Wc) uint16
@@ -163,49 +227,29 @@ def project_depth_to_color_frame(pcl, color_img):
     """
 
     # Load calibration parameter
-    Kc, dc, Kd, dd, R, T = load_cam_calibration_file()
+    if calib is None:
+        calib = cam_calibration.load_calibration()
 
-    # Prepare and flatten input points
     Hc, Wc = color_img[:,:,0].shape
-    Hd, Wd, _ = pcl.shape
-    pts_d = pcl.reshape(-1, 3).astype(np.float32)  # (N,3), in mm
 
-    # Project all 3D depth points directly into the color image plane
-    # cv2.projectPoints applies: [u, v] = Kc * (R * Xd + T) / Z
-    # It handles both rotation/translation (extrinsics) and lens distortion (dc)
-    img_pts, _ = cv2.projectPoints(pts_d, R, T, Kc, dc)  # → (N,1,2)
-    img_pts = img_pts.reshape(-1, 2)
+    # Cull, then project only the kept 3D depth points directly into the color image plane
+    _, pts_d, img_pts = project_culled_points(pcl, calib, confidence, culling, lut)
 
     # Round to nearest integer pixel coordinates
     u = np.rint(img_pts[:, 0]).astype(np.int32)
     v = np.rint(img_pts[:, 1]).astype(np.int32)
     Z = pts_d[:, 2]  # depth values in mm (from depth camera frame)
 
-    # Keep only valid pixels inside the color image bounds
-    valid = (Z > 0) & (u >= 0) & (u < Wc) & (v >= 0) & (v < Hc)
+    # Keep only pixels inside the color image bounds
+    valid = (u >= 0) & (u < Wc) & (v >= 0) & (v < Hc)
     u = u[valid]
     v = v[valid]
     Z = Z[valid]
 
-    # Z-buffer rasterization
-    # Initialize the depth map with infinity (meaning "no point yet")
-    depth = np.full((Hc, Wc), np.inf, dtype=np.float32)
-
-    # For each projected pixel (v, u), keep the smallest Z (closest point)
-    # np.minimum.at is an in-place vectorized version of:
-    #   for i in range(len(Z)):
-    #       depth[v[i], u[i]] = min(depth[v[i], u[i]], Z[i])
-    np.minimum.at(depth, (v, u), Z)
-
-    # Pixels that received at least one point will have finite values
-    hit = np.isfinite(depth)
-
-    # Convert to 16-bit depth map (mm)
-    # Replace infinity with zeros and clip the valid range to [0, 65535]
-    raw_depth = np.zeros_like(depth, dtype=np.uint16)
-    if hit.any():
-        np.clip(depth, 0, 65535, out=depth)
-        raw_depth[hit] = depth[hit].astype(np.uint16)
+    # Z-buffer rasterization: keep the smallest Z (closest point) per pixel (v, u)
+    if out is None:
+        out = np.empty((Hc, Wc), dtype=np.uint16)
+    raw_depth, hit = zbuffer.get_zbuffer(Hc, Wc).rasterize(u, v, Z, out=out, hit_out=np.empty((Hc, Wc), dtype=bool))
 
     return raw_depth, hit  # (depth_rgb, valid_mask)
 
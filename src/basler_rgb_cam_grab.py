@@ -2,84 +2,155 @@ import os
 from pypylon import pylon
 import cv2
 import basler_cam_init
+import basler_cam_session
+import basler_cam_stream
+import camera_profile
+import session_recorder
+import cam_calibration
+import undistort_cache
 import numpy as np
 from pathlib import Path
 
+RGB_CAM_SN = "24747625"
+
 def create_rgb_cam_obj():
     """
     Create a RGB camera object by serial number.
     """
-    rgb_cam_sn = "24747625"
-    rgb_cam = basler_cam_init.create_basler_cam(rgb_cam_sn)
+    rgb_cam = basler_cam_init.create_basler_cam(RGB_CAM_SN)
     return rgb_cam
 
-def config_rgb_cam_para(cam: pylon.InstantCamera) -> None:
+def bayer_result_to_rgb(grab_result) -> np.ndarray:
     """
-    Configurate RGB camera (acA1300-75gc) parameter after opening the camera.
+    Convert a BayerBG8 grab result to a RGB image.
+    """
+    return cv2.cvtColor(grab_result.Array, cv2.COLOR_BAYER_BG2RGB)
 
-    Args:
-        camera (pylon.InstantCamera): A RGB camera instance
+def get_rgb_cam_session() -> basler_cam_session.BaslerCamSession:
     """
+    Get the long-lived RGB camera session (opened and configured only once).
+    """
+    return basler_cam_session.get_cam_session(RGB_CAM_SN, config_rgb_cam_para, bayer_result_to_rgb)
+
+# RGB camera (acA1300-75gc) parameters
+RGB_CAM_PROFILE = camera_profile.CameraProfile("RGB acA1300-75gc", [
     # Width and height
-    cam.Width.Value = 1280
-    cam.Height.Value = 1024
+    ("Width", 1280),
+    ("Height", 1024),
     # Pixel format
-    cam.PixelFormat.Value = "BayerBG8"
+    ("PixelFormat", "BayerBG8"),
     # Exposure time (Abs) [us]
-    cam.ExposureTimeAbs.Value = 7500
+    ("ExposureTimeAbs", 7500),
     # Exposure auto
-    cam.ExposureAuto.Value = "Off"
+    ("ExposureAuto", "Off"),
     # Gain (Raw)
-    cam.GainSelector.Value = "All"
-    cam.GainRaw.Value = 136
+    ("GainSelector", "All"),
+    ("GainRaw", 136),
     # Gain auto
-    cam.GainAuto.Value = "Off"
+    ("GainAuto", "Off"),
     # Balance white auto
-    cam.BalanceWhiteAuto.Value = "Off"
+    ("BalanceWhiteAuto", "Off"),
+])
 
-def stream_rgb_img() -> None:
+def config_rgb_cam_para(cam: pylon.InstantCamera) -> None:
+    """
+    Configurate RGB camera (acA1300-75gc) parameter after opening the camera.
+    Only the parameters which differ from the last applied state are written.
+
+    Args:
+        camera (pylon.InstantCamera): A RGB camera instance
+    """
+    RGB_CAM_PROFILE.apply(cam)
+
+def bayer_result_into_rgb(grab_result, out: np.ndarray) -> None:
+    """
+    Debayer a BayerBG8 grab result directly into a preallocated RGB frame.
+    """
+    with grab_result.GetArrayZeroCopy() as bayer_image:
+        cv2.cvtColor(bayer_image, cv2.COLOR_BAYER_BG2RGB, dst=out)
+
+def record_bayer_hook(recorder: session_recorder.SessionRecorder, stream: str = "rgb_bayer",
+                      timestamp_func=lambda grab_result: grab_result.TimeStamp):
+    """
+    Create an AcquisitionWorker frame hook which records the raw BayerBG8 frames.
+    timestamp_func gives the timestamp recorded for a grab result (default: device timestamp).
+    """
+    def hook(grab_result) -> None:
+        with grab_result.GetArrayZeroCopy() as bayer_image:
+            recorder.record(stream, bayer_image, timestamp_func(grab_result), grab_result.BlockID)
+    return hook
+
+def stream_rgb_img(ring_size: int = 8, record_dir: str = None, registry=None) -> None:
     """
     Streaming the RGB images from basler RGB camera.
+    Acquisition runs on a background thread into a frame ring, this thread only displays the latest frame.
+
+    Args:
+        ring_size (int): Number of buffered frames.
+        record_dir (str): If given, every raw Bayer frame is recorded into this session directory.
+        registry: Optional (started) calibration_registry.CalibrationRegistry. If given, the images
+            are displayed undistorted with its current RGB intrinsics, so reloaded intrinsic
+            parameter files take effect right away.
     """
     # Initialize the rgb camera
     cam = create_rgb_cam_obj()
     cam.Open()
     config_rgb_cam_para(cam)
 
-    # Start the grabbing of images with strategy
-    cam.StartGrabbing(pylon.GrabStrategy_OneByOne)
+    recorder = None
+    frame_hook = None
+    if record_dir is not None:
+        # Tag every frame with the calibration it is recorded under
+        recorder = session_recorder.SessionRecorder(record_dir, cam_calibration.load_calibration().calibration_id)
+        recorder.add_stream("rgb_bayer", (cam.Height.Value, cam.Width.Value), np.uint8)
+        frame_hook = record_bayer_hook(recorder)
+
+    # Start the acquisition thread
+    ring = basler_cam_stream.FrameRing(ring_size, (cam.Height.Value, cam.Width.Value, 3), np.uint8)
+    worker = basler_cam_stream.AcquisitionWorker(cam, ring, bayer_result_into_rgb, frame_hook=frame_hook)
+    worker.start()
     print("Start streaming RGB images ...")
-    while cam.IsGrabbing():
-        # Get the grab retrieve
-        grab_retrieve = cam.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-        if grab_retrieve.GrabSucceeded():
-            bayer_image = grab_retrieve.Array
-
-            # Convert bayer to RGB
-            rgb_img = cv2.cvtColor(bayer_image, cv2.COLOR_BAYER_BG2RGB)
-            cv2.imshow("RGB", rgb_img)
-
-            # Read the keyboard keyin
-            key = cv2.waitKey(5) & 0xFF
-            # Break the loop by pressing q
-            if key == ord("q"):
-                break
-            # Save the image by pressing s
-            elif key == ord("s"):
-                file_number = 0
+    rgb_img = np.empty_like(ring.frames[0])
+    file_number = 0
+    while worker.is_alive():
+        if ring.read_latest(out=rgb_img) is None:
+            continue
+        img = rgb_img
+        if registry is not None:
+            img, _ = undistort_rgb_image(rgb_img, alpha=registry.alpha, intrinsics=registry.current().rgb_intrinsics)
+        cv2.imshow("RGB", img)
+
+        # Read the keyboard keyin
+        key = cv2.waitKey(5) & 0xFF
+        # Break the loop by pressing q
+        if key == ord("q"):
+            break
+        # Save the image by pressing s
+        elif key == ord("s"):
+            file_path = f"robot_vision_result/rbg_img_by_stream_{file_number:02d}.png"
+            while os.path.exists(file_path):
+                file_number += 1
                 file_path = f"robot_vision_result/rbg_img_by_stream_{file_number:02d}.png"
-                while os.path.exists(file_path):
-                    file_number += 1
-                    file_path = f"robot_vision_result/rbg_img_by_stream_{file_number:02d}.png"
-                cv2.imwrite(file_path, rgb_img)
-                print(f"Saved: {file_path}")
-        
-            grab_retrieve.Release()
-    cam.StopGrabbing()
+            cv2.imwrite(file_path, img)
+            print(f"Saved: {file_path}")
+    worker.stop()
+    print(f"Acquisition stats: {worker.stats()}")
+    if recorder is not None:
+        recorder.close()
+        print(f"Recording stats: {recorder.stats()}")
     cam.Close()
-    cv2.destroyAllWindows
+    cv2.destroyAllWindows()
+
+def grab_one_rgb_img(session: basler_cam_session.BaslerCamSession = None):
+    """
+    Grab one RGB image.
 
-def grab_one_rgb_img():
+    Args:
+        session: An opened RGB camera session. If None, the camera is opened,
+            configured and closed only for this grab.
+    """
+    if session is not None:
+        return session.grab()
     # Initialize the RGB camera
     cam = create_rgb_cam_obj()
     cam.Open()
@@ -133,7 +204,7 @@ def halcon_to_opencv_intrinsics(
     dist = np.array([k1, k2, p1, p2, k3], dtype=np.float64)
     return K, dist
 
-def undistort_rgb_image(img, alpha=1.0):
+def undistort_rgb_image(img, alpha=1.0, intrinsics=None):
     """
     Apply lens undistortion to an RGB image (OpenCV array) and return the corrected image and new camera matrix.
 
@@ -145,6 +216,9 @@ def undistort_rgb_image(img, alpha=1.0):
         Trade-off between cropping and field of view in cv2.getOptimalNewCameraMatrix.
         - alpha = 0 : no black borders, tighter crop.
         - alpha = 1 : keep full FOV, possible black borders.
+    intrinsics : tuple, optional
+        OpenCV (K, dist) of the camera, e.g. from calibration_registry.CalibrationRegistry.
+        None for halcon_to_opencv_intrinsics() with its default parameters.
 
     Returns
     -------
@@ -155,23 +229,18 @@ def undistort_rgb_image(img, alpha=1.0):
     """
 
     # Build OpenCV intrinsics and distortion coefficients
-    K, dist = halcon_to_opencv_intrinsics()
+    K, dist = halcon_to_opencv_intrinsics() if intrinsics is None else intrinsics
 
     if img is None or not isinstance(img, np.ndarray):
         raise ValueError("Input must be a valid image (numpy array).")
     h, w = img.shape[:2]
 
-    # Compute new optimal camera matrix (alpha controls cropping)
-    newK, roi = cv2.getOptimalNewCameraMatrix(K, dist, (w, h), alpha=alpha)
+    # Undistortion maps (alpha controls cropping) are built once and cached
+    map1, map2, newK, roi = undistort_cache.get_undistort_maps(K, dist, (w, h), alpha=alpha)
 
     # Undistort image
-    map1, map2 = cv2.initUndistortRectifyMap(K, dist, R=None, newCameraMatrix=newK,
-                                            size=(w, h), m1type=cv2.CV_32FC1)
     undist_img = cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR)
 
-    # Alternatively, use remapping for faster processing:
-    # undist_img = cv2.undistort(img, K, dist, None, newK)
-
     # Crop the image based on ROI (optional)
     # x, y, rw, rh = roi
     # if rw > 0 and rh > 0:
@@ -5,48 +5,148 @@ import cv2
 import numpy as np
 from pypylon import pylon
 import basler_cam_init
+import basler_cam_session
+import basler_cam_stream
+import tof_ray_table
+import session_recorder
+import cam_calibration
+import camera_profile
+import undistort_cache
+import alignment_preview
 from pathlib import Path
 
+TOF_CAM_SN = "24945819"
+
 def create_tof_cam():
     """
     Create a ToF camera object by serial number.
     """
-    tof_cam_sn = "24945819"
-    tof_cam = basler_cam_init.create_basler_cam(tof_cam_sn)
+    tof_cam = basler_cam_init.create_basler_cam(TOF_CAM_SN)
     return tof_cam
 
-def config_tof_cam_para(cam: pylon.InstantCamera) -> None:
+def get_tof_cam_session(data_type="Point_Cloud", depth_only: bool = False) -> basler_cam_session.BaslerCamSession:
     """
-    Configure a ToF camera (Basler blaze-101) parameter after opening the camera.
+    Get the long-lived ToF camera session (opened and configured only once).
+    Its grab() returns the requested component of split_tof_container_data().
+
+    Args:
+        data_type (str or list): "Intensity_Image" or "Point_Cloud" or "Confidence_Map".
+            With a list, all listed components are grabbed at once and grab() returns a dict.
+        depth_only (bool): Transport the point cloud as Coord3D_C16 depth map and rebuild
+            the same (H, W, 3) [mm] point cloud on the host (about 6x less GigE bandwidth).
     """
-    print("ToF camera information:")
+    data_types = [data_type] if isinstance(data_type, str) else list(data_type)
+    if depth_only:
+        data_types = ["Depth_Map" if t == "Point_Cloud" else t for t in data_types]
+    ray_table = {}
+
+    def config(cam: pylon.InstantCamera) -> None:
+        config_tof_cam_para(cam)
+        config_tof_data_comps(cam, data_types)
+        if "Depth_Map" in data_types:
+            ray_table["table"] = tof_ray_table.ToFRayTable.from_camera(cam)
+
+    def convert(grab_result):
+        data = split_tof_container_comps(grab_result.GetDataContainer())
+        if depth_only and "Depth_Map" in data:
+            data["Point_Cloud"] = ray_table["table"].depth_to_pcl(data.pop("Depth_Map"))
+        if isinstance(data_type, str):
+            return data.get(data_type)
+        return data
+
+    # The closures are new on every call, the session is identified by what they configure and return
+    config_key = ("tof", tuple(data_types), isinstance(data_type, str), depth_only)
+    return basler_cam_session.get_cam_session(TOF_CAM_SN, config, convert, config_key=config_key)
+
+# ToF camera (Basler blaze-101) parameters
+TOF_CAM_PROFILE = camera_profile.CameraProfile("ToF blaze-101", [
     # Operating mode: ShortRange: 0 - 1498 mm / LongRange: 0 - 9990 mm
-    cam.OperatingMode.Value = "ShortRange"
+    ("OperatingMode", "ShortRange"),
     # Max depth / Min depth (mm)
-    cam.DepthMax.Value = 1498
-    cam.DepthMin.Value = 0
-    print(
-        f"Operating mode: {cam.OperatingMode.Value} / Depth max: {cam.DepthMax.Value} / min: {cam.DepthMin.Value}")
+    ("DepthMax", 1498),
+    ("DepthMin", 0),
     # Fast mode
-    cam.FastMode.Value = True
+    ("FastMode", True),
     # Filter spatial
-    cam.FilterSpatial.Value = True
-    # Filter temporal
-    cam.FilterTemporal.Value = True
-    # Filter temporal strength
-    if cam.FilterTemporal.Value:
-        cam.FilterStrength.Value = 200
+    ("FilterSpatial", True),
+    # Filter temporal and its strength
+    ("FilterTemporal", True),
+    ("FilterStrength", 200),
     # Outlier removal
-    cam.OutlierRemoval.Value = True
+    ("OutlierRemoval", True),
     # Confidence Threshold (0 - 65536)
-    cam.ConfidenceThreshold.Value = 32
-    print(f"Confidence threshold: {cam.ConfidenceThreshold.Value}")
+    ("ConfidenceThreshold", 32),
     # Gamma correction
-    cam.GammaCorrection.Value = True
+    ("GammaCorrection", True),
     # GenDC (Generic Data Container) is used to transmit multiple types of image data,such as depth,
     # intensity, and confidence, in a single, structured data stream, making it
     # ideal for 3D and multi-modal imaging applications.
-    cam.GenDCStreamingMode.Value = "Off"
+    ("GenDCStreamingMode", "Off"),
+])
+
+def tof_depth_range():
+    """
+    (DepthMin, DepthMax) [mm] the ToF camera is configured with (TOF_CAM_PROFILE).
+    """
+    params = dict(TOF_CAM_PROFILE.steps)
+    return params["DepthMin"], params["DepthMax"]
+
+def config_tof_cam_para(cam: pylon.InstantCamera) -> None:
+    """
+    Configure a ToF camera (Basler blaze-101) parameter after opening the camera.
+    Only the parameters which differ from the last applied state are written.
+    """
+    TOF_CAM_PROFILE.apply(cam)
+    params = dict(TOF_CAM_PROFILE.steps)
+    print("ToF camera information:")
+    print(f"Operating mode: {params['OperatingMode']} / Depth max: {params['DepthMax']} / min: {params['DepthMin']}")
+    print(f"Confidence threshold: {params['ConfidenceThreshold']}")
+
+# Data type -> (ComponentSelector, PixelFormat) of the blaze data components
+TOF_DATA_COMPONENTS = {
+    "Point_Cloud": ("Range", "Coord3D_ABC32f"),
+    "Intensity_Image": ("Intensity", "Mono16"),
+    "Confidence_Map": ("Confidence", "Confidence16"),
+    # Depth-only transport: Z as uint16 (2 bytes per pixel instead of 12), XYZ is rebuilt on the host
+    "Depth_Map": ("Range", "Coord3D_C16"),
+}
+
+def _component_data_type(data_component):
+    """
+    Data type key of a delivered data component, or None for unknown components.
+    """
+    if data_component.ComponentType == pylon.ComponentType_Intensity:
+        return "Intensity_Image"
+    elif data_component.ComponentType == pylon.ComponentType_Confidence:
+        return "Confidence_Map"
+    elif data_component.ComponentType == pylon.ComponentType_Range:
+        if data_component.PixelType == pylon.PixelType_Coord3D_C16:
+            return "Depth_Map"
+        return "Point_Cloud"
+    return None
+
+def config_tof_data_comps(cam: pylon.InstantCamera, data_types) -> None:
+    """
+    Enable any subset of the ToF data components at once, so they are all delivered
+    in the data container of a single grab. The other components are disabled.
+    Args:
+        data_types (list): Subset of "Point_Cloud" or "Depth_Map", "Intensity_Image", "Confidence_Map"
+    """
+    for data_type in data_types:
+        if data_type not in TOF_DATA_COMPONENTS:
+            raise ValueError(f"Wrong data type input of function config_tof_data_comps: {data_type}")
+    if "Point_Cloud" in data_types and "Depth_Map" in data_types:
+        raise ValueError("Point_Cloud and Depth_Map share the Range component, enable only one of them")
+    # Component -> (enable, pixel format), the requested data type decides the Range pixel format
+    settings = {}
+    for data_type, (component, pixel_format) in TOF_DATA_COMPONENTS.items():
+        if component not in settings or data_type in data_types:
+            settings[component] = (data_type in data_types, pixel_format)
+    steps = []
+    for component, (enable, pixel_format) in settings.items():
+        steps += [("ComponentSelector", component), ("ComponentEnable", enable), ("PixelFormat", pixel_format)]
+    camera_profile.CameraProfile("ToF components", steps).apply(cam)
+    print(f"Image selector: {', '.join(data_types)}")
 
 def config_tof_data_comp(cam: pylon.InstantCamera, data_type: str) -> None:
     """
@@ -54,87 +154,117 @@ def config_tof_data_comp(cam: pylon.InstantCamera, data_type: str) -> None:
     Args:
         data_type (str): "Intensity_Image" or "Point_Cloud" or "Confidence_Map"
     """
-    # Image component selector
-    if data_type == "Intensity_Image":
-        # Close 3d point cloud image
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Range")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(False)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Coord3D_ABC32f")  # Coord3D_C16 / Coord3D_ABC32f
-        # Open intensity image
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Intensity")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(True)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Mono16")
-        # Close confidence map
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Confidence")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(False)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Confidence16")
-        print("Image selector: Intensity")
-    elif data_type == "Point_Cloud":
-        # Open 3d point cloud image
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Range")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(True)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Coord3D_ABC32f")
-        # Close intensity image
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Intensity")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(False)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Mono16")
-        # Close confidence map
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Confidence")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(False)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Confidence16")
-        print("Image selector: Point cloud")
-    elif data_type == "Confidence_Map":
-        # Close 3d point cloud image
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Range")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(False)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Coord3D_ABC32f")
-        # Close intensity image
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Intensity")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(False)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Mono16")
-        # Open confidence map
-        cam.GetNodeMap().GetNode("ComponentSelector").SetValue("Confidence")
-        cam.GetNodeMap().GetNode("ComponentEnable").SetValue(True)
-        cam.GetNodeMap().GetNode("PixelFormat").SetValue("Confidence16")
-        print("Image selector: Confidence Map")
-    else:
+    if data_type not in TOF_DATA_COMPONENTS:
         print("Wrong data type input of function config_tof_camera_para")
+        return
+    config_tof_data_comps(cam, [data_type])
 
-def split_tof_container_data(container) -> dict:
+def split_tof_container_comps(container) -> dict:
     """
-    Split the data component from the grab retrieve data container
+    Split all enabled data components from one grab retrieve data container.
     Args:
         container: A grab retrieve as data container
 
     Returns:
-        dict: data_dict{Intensity_Image, Confidence_Map, Point_Cloud}
+        dict: Only the delivered components, keyed by "Point_Cloud" (H, W, 3) float32 [mm],
+            "Depth_Map" (H, W) uint16 (C16 gray values), "Intensity_Image" (H, W) uint16
+            and "Confidence_Map" (H, W) uint16
     """
-    data_dict = {
-        "Intensity_Image": None,
-        "Confidence_Map": None,
-        "Point_Cloud": None
-    }
+    data_dict = {}
     for i in range(container.DataComponentCount):
         data_component = container.GetDataComponent(i)
-        if data_component.ComponentType == pylon.ComponentType_Intensity:
-            data_dict["Intensity_Image"] = data_component.Array
-        elif data_component.ComponentType == pylon.ComponentType_Confidence:
-            data_dict["Confidence_Map"] = data_component.Array
-        elif data_component.ComponentType == pylon.ComponentType_Range:
-            data_dict["Point_Cloud"] = data_component.Array.reshape(data_component.Height, data_component.Width, 3)
+        data_type = _component_data_type(data_component)
+        if data_type == "Point_Cloud":
+            data_dict[data_type] = data_component.Array.reshape(data_component.Height, data_component.Width, 3)
+        elif data_type is not None:
+            data_dict[data_type] = data_component.Array.reshape(data_component.Height, data_component.Width)
         data_component.Release()
     return data_dict
 
+def copy_tof_comps_into(container, out: dict) -> None:
+    """
+    Copy the data components of a grab retrieve container into preallocated arrays,
+    without allocating per frame (the component buffers are read zero-copy).
+    Args:
+        container: A grab retrieve as data container
+        out: dict of preallocated arrays keyed like split_tof_container_comps(),
+            components missing in `out` are skipped
+    """
+    for i in range(container.DataComponentCount):
+        data_component = container.GetDataComponent(i)
+        dst = out.get(_component_data_type(data_component))
+        if dst is not None:
+            with data_component.GetArrayZeroCopy() as src:
+                np.copyto(dst, src.reshape(dst.shape))
+        data_component.Release()
+
+def split_tof_container_data(container) -> dict:
+    """
+    Split the data component from the grab retrieve data container
+    Args:
+        container: A grab retrieve as data container
+
+    Returns:
+        dict: data_dict{Intensity_Image, Confidence_Map, Point_Cloud}, None for disabled components
+    """
+    data_dict = dict.fromkeys(TOF_DATA_COMPONENTS)
+    data_dict.update(split_tof_container_comps(container))
+    return data_dict
+
+def filter_pcl_by_confidence(pcl, confidence, threshold: int):
+    """
+    Invalidate (set to 0) the points whose confidence is below the threshold.
+    Args:
+        pcl: (H, W, 3) float32 point cloud [mm]
+        confidence: (H, W) uint16 confidence map of the same grab
+        threshold: Min. confidence of a valid point
+    Returns:
+        pcl: (H, W, 3) float32 filtered copy of the point cloud [mm]
+    """
+    pcl = pcl.copy()
+    pcl[confidence < threshold] = 0
+    return pcl
+
 def pcl_to_rawdepth(pcl):
     return pcl[:,:,2]  # Get z data from point cloud
 
-def rawdepth_to_heatmap(rawdepth):
+def rawdepth_to_heatmap(rawdepth, depth_range=None):
+    # With a fixed (min, max) depth range [mm], colors come from a precomputed table instead of a per-frame normalization
+    if depth_range is not None:
+        lut = alignment_preview.depth_color_lut(int(depth_range[0]), int(depth_range[1]), cv2.COLORMAP_TURBO, invert=True)
+        return alignment_preview.depth_to_color(rawdepth.astype(np.uint16, copy=False), lut)
     gray_img = cv2.normalize(rawdepth, None, 0,255, cv2.NORM_MINMAX).astype(np.uint8)
     heatmap = cv2.applyColorMap(255 - gray_img, cv2.COLORMAP_TURBO)
     # heatmap = cv2.applyColorMap(255 - gray_img, cv2.COLORMAP_JET)
     return heatmap
 
-def stream_tof_img(img_type: str) -> None:
+def record_tof_comps_hook(recorder: session_recorder.SessionRecorder, data_types, prefix: str = "tof_",
+                          timestamp_func=lambda grab_result: grab_result.TimeStamp):
+    """
+    Create an AcquisitionWorker frame hook which records the ToF components of every grab,
+    each into the recorder stream "<prefix><data type>".
+    timestamp_func gives the timestamp recorded for a grab result (default: device timestamp).
+    """
+    def hook(grab_result) -> None:
+        slots = {}
+        for data_type in data_types:
+            slot = recorder.acquire_slot(prefix + data_type)
+            if slot is not None:
+                slots[data_type] = slot
+        copy_tof_comps_into(grab_result.GetDataContainer(), slots)
+        timestamp = timestamp_func(grab_result)
+        for data_type, slot in slots.items():
+            recorder.commit_slot(prefix + data_type, slot, timestamp, grab_result.BlockID)
+    return hook
+
+def stream_tof_img(img_type: str, ring_size: int = 8, record_dir: str = None, registry=None) -> None:
+    """
+    Streaming ToF images ("Intensity_Image", "Confidence_Map" or "Depth_Image").
+    Acquisition runs on a background thread into a frame ring, so display and saving never stall the stream.
+    If record_dir is given, every grabbed component is recorded into this session directory.
+    If registry (a started calibration_registry.CalibrationRegistry) is given, the images are displayed
+    undistorted with its current ToF intrinsics, so reloaded intrinsic parameter files take effect right away.
+    """
     cam = create_tof_cam()
     cam.Open()
     config_tof_cam_para(cam)
@@ -147,34 +277,55 @@ def stream_tof_img(img_type: str) -> None:
     else:
         raise Exception("Not supported image type")
 
-    # Starts the grabbing of data with strategy
-    cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+    # Start the acquisition thread, this thread only displays the latest frame
+    data_key = "Point_Cloud" if img_type == "Depth_Image" else img_type
+    if data_key == "Point_Cloud":
+        ring = basler_cam_stream.FrameRing(ring_size, (cam.Height.Value, cam.Width.Value, 3), np.float32)
+    else:
+        ring = basler_cam_stream.FrameRing(ring_size, (cam.Height.Value, cam.Width.Value), np.uint16)
+
+    def convert_into(grab_result, out):
+        copy_tof_comps_into(grab_result.GetDataContainer(), {data_key: out})
+
+    recorder = None
+    frame_hook = None
+    if record_dir is not None:
+        # Tag every frame with the calibration it is recorded under
+        recorder = session_recorder.SessionRecorder(record_dir, cam_calibration.load_calibration().calibration_id)
+        recorder.add_stream("tof_" + data_key, ring.frames.shape[1:], ring.frames.dtype)
+        frame_hook = record_tof_comps_hook(recorder, [data_key])
+
+    worker = basler_cam_stream.AcquisitionWorker(cam, ring, convert_into, frame_hook=frame_hook)
+    worker.start()
     print("Start grabbing ...")
-    while cam.IsGrabbing():
-        # Get the grab retrieve
-        grab_retrieve = cam.RetrieveResult(1000, pylon.TimeoutHandling_ThrowException)
-
-        if grab_retrieve.GrabSucceeded():
-            # Get the grab retrieve as data container
-            data_container = grab_retrieve.GetDataContainer()
-            # Get the intensity image
-            data = split_tof_container_data(data_container)
-
-            if img_type == "Intensity_Image":
-                img= data["Intensity_Image"]
-                display_title = "Intensity_image"
-            elif img_type == "Confidence_Map":
-                img = data["Confidence_Map"]
-                display_title = "Confidence_map"
-            elif img_type == "Depth_Image":
-                img = rawdepth_to_heatmap(pcl_to_rawdepth(data["Point_Cloud"]))
-                display_title = "Depth_image"
-            else:
-                raise Exception("Not supported image type")
-
-            # Display
-            cv2.imshow(display_title, img)
-            grab_retrieve.Release()
+    # Fixed colormap range of the depth display
+    depth_range = tof_depth_range()
+    data = np.empty_like(ring.frames[0])
+    file_number = 0
+    while worker.is_alive():
+        if ring.read_latest(out=data) is None:
+            continue
+        # Take the intrinsics once per frame
+        intrinsics = registry.current().tof_intrinsics if registry is not None else None
+        if img_type == "Intensity_Image":
+            img = data
+            if intrinsics is not None:
+                img, _ = undistort_tof_intensity(img, alpha=registry.alpha, intrinsics=intrinsics)
+            display_title = "Intensity_image"
+        elif img_type == "Confidence_Map":
+            img = data
+            if intrinsics is not None:
+                img, _ = undistort_tof_depth(img, alpha=registry.alpha, intrinsics=intrinsics)
+            display_title = "Confidence_map"
+        else:
+            rawdepth = pcl_to_rawdepth(data)
+            if intrinsics is not None:
+                rawdepth, _ = undistort_tof_depth(rawdepth, alpha=registry.alpha, intrinsics=intrinsics)
+            img = rawdepth_to_heatmap(rawdepth, depth_range=depth_range)
+            display_title = "Depth_image"
+
+        # Display
+        cv2.imshow(display_title, img)
 
         # Read the keyboard keyin
         key = cv2.waitKey(5) & 0xFF
@@ -182,7 +333,6 @@ def stream_tof_img(img_type: str) -> None:
         if key == ord("q"):
             break
         elif key == ord("s"):
-            file_number = 0
             file_path = f"robot_vision_result/{display_title}_{file_number:02d}.png"
             while os.path.exists(file_path):
                 file_number += 1
@@ -190,28 +340,44 @@ def stream_tof_img(img_type: str) -> None:
             cv2.imwrite(file_path, img)
             print(f"Saved: {file_path}")
 
-    cam.StopGrabbing()
+    worker.stop()
+    print(f"Acquisition stats: {worker.stats()}")
+    if recorder is not None:
+        recorder.close()
+        print(f"Recording stats: {recorder.stats()}")
     cam.Close()
-    cv2.destroyAllWindows
+    cv2.destroyAllWindows()
 
-def grab_one_point_cloud():
+def grab_one_point_cloud(session: basler_cam_session.BaslerCamSession = None, depth_only: bool = False):
     """
     Grab one point cloud from camera.
+    Args:
+        session: An opened ToF session from get_tof_cam_session("Point_Cloud"). If None,
+            the camera is opened, configured and closed only for this grab.
+        depth_only: Grab a Coord3D_C16 depth map and rebuild XYZ from the ray table.
     Returns:
         pcl: point cloud (unit : mm)
     """
+    if session is not None:
+        return session.grab()
     cam = create_tof_cam()
     cam.Open()
     config_tof_cam_para(cam)
-    config_tof_data_comp(cam, "Point_Cloud")
+    config_tof_data_comp(cam, "Depth_Map" if depth_only else "Point_Cloud")
+    ray_table = tof_ray_table.ToFRayTable.from_camera(cam) if depth_only else None
 
     # Grab point cloud data
     grab_result = cam.GrabOne(1000)  # timeout: 1s
     assert grab_result.GrabSucceeded(), "Failed to grab depth data"
     cam.Close()
-    return split_tof_container_data(grab_result.GetDataContainer())["Point_Cloud"]  # Unit: mm
-
-def grab_one_intensity():
+    data = split_tof_container_data(grab_result.GetDataContainer())
+    if depth_only:
+        return ray_table.depth_to_pcl(data["Depth_Map"])  # Unit: mm
+    return data["Point_Cloud"]  # Unit: mm
+
+def grab_one_intensity(session: basler_cam_session.BaslerCamSession = None):
+    if session is not None:
+        return session.grab()
     cam = create_tof_cam()
     cam.Open()
     config_tof_cam_para(cam)
@@ -223,6 +389,29 @@ def grab_one_intensity():
     cam.Close()
     return split_tof_container_data(grab_result.GetDataContainer())["Intensity_Image"]
 
+def grab_tof_comps(data_types=("Point_Cloud", "Intensity_Image", "Confidence_Map"),
+                   session: basler_cam_session.BaslerCamSession = None) -> dict:
+    """
+    Grab several ToF data components with a single grab.
+    Args:
+        data_types: Components to enable, see config_tof_data_comps()
+        session: An opened ToF session from get_tof_cam_session(list_of_data_types). If None,
+            the camera is opened, configured and closed only for this grab.
+    Returns:
+        dict: The grabbed components, see split_tof_container_comps()
+    """
+    if session is not None:
+        return session.grab()
+    cam = create_tof_cam()
+    cam.Open()
+    config_tof_cam_para(cam)
+    config_tof_data_comps(cam, list(data_types))
+
+    grab_result = cam.GrabOne(1000)  # timeout: 1s
+    assert grab_result.GrabSucceeded(), "Failed to grab ToF data"
+    cam.Close()
+    return split_tof_container_comps(grab_result.GetDataContainer())
+
 
 
 def halcon_to_opencv_intrinsics_tof(
@@ -291,18 +480,17 @@ def build_undistort_maps(K, dist, size, alpha=1.0):
     return map1, map2, newK, roi
 
 
-def undistort_tof_intensity(img,alpha=1.0):
+def undistort_tof_intensity(img,alpha=1.0,intrinsics=None):
     """
     Undistort a ToF intensity image (or any 2D image).
+    The undistortion maps are built once and cached (see undistort_cache).
+    intrinsics: OpenCV (K, dist), None for halcon_to_opencv_intrinsics_tof() with its defaults.
     """
     h, w = img.shape[:2]
-    K, dist = halcon_to_opencv_intrinsics_tof()
-    map1, map2, newK, roi = build_undistort_maps(K, dist, (w, h), alpha=alpha)
+    K, dist = halcon_to_opencv_intrinsics_tof() if intrinsics is None else intrinsics
+    map1, map2, newK, roi = undistort_cache.get_undistort_maps(K, dist, (w, h), alpha=alpha)
     undist_img = cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR)
 
-    # Alternatively, use remapping for faster processing:
-    # undist_img = cv2.undistort(img, K, dist, None, newK)
-
     # Crop the image based on ROI (optional)
     # x, y, rw, rh = roi
     # if rw > 0 and rh > 0:
@@ -310,24 +498,25 @@ def undistort_tof_intensity(img,alpha=1.0):
 
     return undist_img, newK
 
-def undistort_tof_depth(depth,alpha=1.0,):
+def undistort_tof_depth(depth,alpha=1.0,intrinsics=None):
     """
     Undistort a ToF depth map (e.g., in millimeters).
+    The undistortion maps are built once and cached (see undistort_cache).
+    intrinsics: OpenCV (K, dist), None for halcon_to_opencv_intrinsics_tof() with its defaults.
     """
-    depth = depth / 1000.0
     if depth is None:
         raise FileNotFoundError(f"Dept data is not available")
     h, w = depth.shape[:2]
 
-    K, dist = halcon_to_opencv_intrinsics_tof()
-    map1, map2, newK, roi = build_undistort_maps(K, dist, (w, h), alpha=alpha)
+    K, dist = halcon_to_opencv_intrinsics_tof() if intrinsics is None else intrinsics
     # Use NEAREST interpolation to avoid averaging depth values.
-    undist_img = cv2.remap(depth, map1, map2, interpolation=cv2.INTER_NEAREST,
+    map1, _, newK, roi = undistort_cache.get_undistort_maps(K, dist, (w, h), alpha=alpha, nearest=True)
+    undist_img = cv2.remap(depth, map1, None, interpolation=cv2.INTER_NEAREST,
                        borderMode=cv2.BORDER_CONSTANT, borderValue=0)
     # Crop the image based on ROI (optional)
     # x, y, rw, rh = roi
     # if rw > 0 and rh > 0:
     #     undist_img = undist_img[y:y+rh, x:x+rw]
-    undist_img = np.clip(undist_img * 1000.0,0,65535).astype(np.uint16)
+    undist_img = np.clip(undist_img, 0, 65535).astype(np.uint16)
 
     return undist_img, newK
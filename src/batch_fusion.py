@@ -0,0 +1,203 @@
+import cv2
+import numpy as np
+
+import cam_calibration
+import point_culling
+import projection_lut
+import session_recorder
+import zbuffer
+
+def _project_chunk(pcls, calib, lut, confidences, culling):
+    """
+    Cull and project a chunk of point clouds in one call,
+    see basler_fusion_depth_rgb.project_culled_points.
+
+    Returns:
+        frame: (M,) chunk frame index of the kept points
+        idx:   (M,) flat ToF pixel index of the kept points (within their frame)
+        pts, img_pts: (M, 3) kept points and (M, 2) their color pixel coordinates
+    """
+    n, Hd, Wd, _ = pcls.shape
+    # The chunk as one tall (n * Hd, Wd, 3) cloud, so culling and projection run once
+    stacked = pcls.reshape(n * Hd, Wd, 3)
+    conf = None if confidences is None else confidences.reshape(n * Hd, Wd)
+    if culling is None:
+        culling = point_culling.Z_VALID_CULLING
+    flat = culling.select(stacked, conf)
+    pts = stacked.reshape(-1, 3)[flat].astype(np.float32)
+    # The kept indices are sorted, so the frame of a point follows from the per-frame counts
+    counts = np.diff(np.searchsorted(flat, np.arange(n + 1) * (Hd * Wd)))
+    frame = np.repeat(np.arange(n, dtype=np.int32), counts)
+    idx = (flat - frame * (Hd * Wd)).astype(np.int32)
+    if idx.size == 0:
+        return frame, idx, pts, np.empty((0, 2), dtype=np.float32)
+
+    if lut is not None:
+        img_pts = lut.project(pts[:, 2], pix=idx)
+    else:
+        img_pts, _ = cv2.projectPoints(pts, calib.R, calib.T, calib.Kc, calib.dc)
+        img_pts = img_pts.reshape(-1, 2)
+    return frame, idx, pts, img_pts
+
+def project_depth_to_color_frames(pcls, color_size=(1280, 1024), calib: cam_calibration.CamCalibration = None,
+                                  lut: projection_lut.ProjectionLUT = None, confidences=None,
+                                  culling: point_culling.PointCulling = None, chunk_size: int = 2,
+                                  out=None, hit_out=None):
+    """
+    Batch version of basler_fusion_depth_rgb.project_depth_to_color_frame.
+
+    Every chunk of `chunk_size` frames is culled, projected and Z-buffered in one call: the
+    chunk is handled as a single tall image, frame i occupying the color rows i * Hc.. .
+    The working memory is bounded by the chunk size, so the inputs and outputs can be
+    memory-mapped files (e.g. session_recorder.SessionReader streams).
+    Larger chunks save per-call overhead, but the per-point temporaries of a chunk fall out of
+    the CPU cache: with 300k points per frame, 1 - 2 frames per chunk were fastest on the
+    development PC, 8 frames per chunk about 20 % slower.
+
+    Args:
+        pcls: (N, Hd, Wd, 3) float32 point clouds in the depth frame [millimeters]
+        color_size: (width, height) of the color images
+        calib: calibration, None for the default calibration file
+        lut: optional projection table of the calibration
+        confidences: optional (N, Hd, Wd) uint16 confidence maps, used by the culling
+        culling: points to project, None for all points with Z>0
+        chunk_size: frames per vectorized call
+        out, hit_out: optional (N, Hc, Wc) uint16 / bool arrays to write into
+
+    Returns:
+        depth_rgb: (N, Hc, Wc) uint16 Z-buffer depth maps [millimeters]
+        valid_mask: (N, Hc, Wc) bool
+    """
+    if calib is None:
+        calib = cam_calibration.load_calibration()
+    N = pcls.shape[0]
+    Wc, Hc = color_size
+    if out is None:
+        out = np.empty((N, Hc, Wc), dtype=np.uint16)
+    if hit_out is None:
+        hit_out = np.empty((N, Hc, Wc), dtype=bool)
+
+    rasterizer = zbuffer.ZBuffer(min(chunk_size, N) * Hc, Wc)
+    for start in range(0, N, chunk_size):
+        stop = min(start + chunk_size, N)
+        conf = None if confidences is None else confidences[start:stop]
+        frame, _, pts, img_pts = _project_chunk(pcls[start:stop], calib, lut, conf, culling)
+
+        u = np.rint(img_pts[:, 0]).astype(np.int32)
+        v = np.rint(img_pts[:, 1]).astype(np.int32)
+        inside = np.flatnonzero((u >= 0) & (u < Wc) & (v >= 0) & (v < Hc))
+        v_stacked = v[inside]
+        v_stacked += frame[inside] * Hc
+
+        n = stop - start
+        if rasterizer.height != n * Hc:
+            rasterizer = zbuffer.ZBuffer(n * Hc, Wc)
+        # Rasterize straight into the outputs if they are contiguous, e.g. not strided memmaps
+        depth, hit = out[start:stop], hit_out[start:stop]
+        direct = depth.flags.c_contiguous and hit.flags.c_contiguous
+        depth, hit = rasterizer.rasterize(u[inside], v_stacked, pts[inside, 2],
+                                          out=depth.reshape(n * Hc, Wc) if direct else None,
+                                          hit_out=hit.reshape(n * Hc, Wc) if direct else None)
+        if not direct:
+            out[start:stop] = depth.reshape(n, Hc, Wc)
+            hit_out[start:stop] = hit.reshape(n, Hc, Wc)
+    return out, hit_out
+
+def warp_depth_with_colors(pcls, color_imgs, interp="nearest", calib: cam_calibration.CamCalibration = None,
+                           lut: projection_lut.ProjectionLUT = None, confidences=None,
+                           culling: point_culling.PointCulling = None, chunk_size: int = 2,
+                           out=None, valid_out=None):
+    """
+    Batch version of basler_fusion_depth_rgb.warp_depth_with_color, `chunk_size` frames per
+    vectorized call (see project_depth_to_color_frames).
+
+    Args:
+        pcls: (N, Hd, Wd, 3) float32 point clouds in the depth frame [millimeters]
+        color_imgs: (N, Hc, Wc, 3) uint8 BGR images
+        interp: 'nearest' or 'bilinear'
+        calib, lut, confidences, culling, chunk_size: See project_depth_to_color_frames
+        out, valid_out: optional (N, Hd, Wd, 3) uint8 / (N, Hd, Wd) bool arrays to write into
+
+    Returns:
+        color_on_depth: (N, Hd, Wd, 3) uint8, BGR on depth grid (zeros where invalid)
+        valid_mask: (N, Hd, Wd) bool
+    """
+    if interp not in ("nearest", "bilinear"):
+        raise ValueError("interp must be 'nearest' or 'bilinear'")
+    if calib is None:
+        calib = cam_calibration.load_calibration()
+    N, Hd, Wd, _ = pcls.shape
+    Hc, Wc = color_imgs.shape[1:3]
+    if out is None:
+        out = np.empty((N, Hd, Wd, 3), dtype=np.uint8)
+    if valid_out is None:
+        valid_out = np.empty((N, Hd, Wd), dtype=bool)
+
+    for start in range(0, N, chunk_size):
+        stop = min(start + chunk_size, N)
+        n = stop - start
+        conf = None if confidences is None else confidences[start:stop]
+        frame, idx, _, img_pts = _project_chunk(pcls[start:stop], calib, lut, conf, culling)
+        # Images of the chunk stacked into one tall image, frame i at rows i * Hc..
+        colors = np.ascontiguousarray(color_imgs[start:stop]).reshape(n * Hc, Wc, 3)
+        target = frame * (Hd * Wd) + idx
+
+        chunk_out = np.zeros((n * Hd * Wd, 3), dtype=np.uint8)
+        chunk_valid = np.zeros(n * Hd * Wd, dtype=bool)
+        if interp == "nearest":
+            u = np.rint(img_pts[:, 0]).astype(np.int32)
+            v = np.rint(img_pts[:, 1]).astype(np.int32)
+            inside = (u >= 0) & (u < Wc) & (v >= 0) & (v < Hc)
+            chunk_out[target[inside]] = colors[v[inside] + frame[inside] * Hc, u[inside]]
+        else:
+            u0 = np.floor(img_pts[:, 0]).astype(np.int32)
+            v0 = np.floor(img_pts[:, 1]).astype(np.int32)
+            inside = (u0 >= 0) & (v0 >= 0) & (u0 + 1 < Wc) & (v0 + 1 < Hc)
+            du = (img_pts[inside, 0] - u0[inside]).astype(np.float32)[:, None]
+            dv = (img_pts[inside, 1] - v0[inside]).astype(np.float32)[:, None]
+            uu0 = u0[inside]
+            vv0 = v0[inside] + frame[inside] * Hc
+            c00 = colors[vv0, uu0].astype(np.float32)
+            c10 = colors[vv0, uu0 + 1].astype(np.float32)
+            c01 = colors[vv0 + 1, uu0].astype(np.float32)
+            c11 = colors[vv0 + 1, uu0 + 1].astype(np.float32)
+            sampled = (c00 * (1 - du) * (1 - dv) + c10 * du * (1 - dv) +
+                       c01 * (1 - du) * dv + c11 * du * dv)
+            chunk_out[target[inside]] = np.clip(sampled, 0, 255)
+        chunk_valid[target[inside]] = True
+
+        out[start:stop] = chunk_out.reshape(n, Hd, Wd, 3)
+        valid_out[start:stop] = chunk_valid.reshape(n, Hd, Wd)
+    return out, valid_out
+
+def fuse_session(session_dir: str, chunk_size: int = 2, calib: cam_calibration.CamCalibration = None,
+                 lut: projection_lut.ProjectionLUT = None, tof_session_dir: str = None, max_skew_ms: float = None):
+    """
+    Re-fuse the streams "rgb_bayer" and "tof_Point_Cloud" of recorded sessions, chunk by chunk:
+    one session recorded by basler_cam_pair.PairedCapture, or an RGB and a separately recorded
+    ToF session (tof_session_dir). The frames are paired by timestamp (session_recorder.PairedSession),
+    read memory-mapped, debayered and registered `chunk_size` pairs at a time.
+
+    Yields:
+        start: Number of the first pair of the chunk
+        color_imgs: (n, Hc, Wc, 3) uint8 BGR images
+        depth_rgb, valid_mask: (n, Hc, Wc) registered depth [mm] and mask, see project_depth_to_color_frames
+    """
+    paired = session_recorder.PairedSession(session_dir, tof_session_dir, max_skew_ms=max_skew_ms)
+    if calib is None:
+        calib = cam_calibration.load_calibration()
+    if paired.calibration_id and paired.calibration_id != calib.calibration_id:
+        print(f"Session {session_dir} was recorded with calibration {paired.calibration_id}, "
+              f"re-fusing with {calib.calibration_id}")
+
+    for start in range(0, len(paired), chunk_size):
+        stop = min(start + chunk_size, len(paired))
+        bayer, pcls = paired.frames(start, stop)
+        n, Hc, Wc = bayer.shape
+        # Debayered one by one, the demosaicing of a stacked image would blend neighboring frames
+        color_imgs = np.empty((n, Hc, Wc, 3), dtype=np.uint8)
+        for i in range(n):
+            cv2.cvtColor(bayer[i], cv2.COLOR_BAYER_BG2RGB, dst=color_imgs[i])
+        depth_rgb, valid_mask = project_depth_to_color_frames(
+            pcls, (Wc, Hc), calib, lut=lut, chunk_size=chunk_size)
+        yield start, color_imgs, depth_rgb, valid_mask
@@ -0,0 +1,31 @@
+"""
+Runtime of the densification strategies of depth_densify at the full 1280x1024 color
+resolution, on a synthetic ToF frame registered with project_depth_to_color_frame.
+
+Runs without cameras:
+    python benchmark_depth_densify.py
+"""
+import cv2
+
+import basler_fusion_depth_rgb
+import benchmark_fused_registration
+import cam_calibration
+import depth_densify
+import tof_ray_table
+
+
+if __name__ == "__main__":
+    calib = cam_calibration.load_calibration()
+    bayer, depth = benchmark_fused_registration.synthetic_frames()
+    color_img = cv2.cvtColor(bayer, cv2.COLOR_BAYER_BG2RGB)
+    pcl = tof_ray_table.ToFRayTable.from_intrinsics(calib.Kd).depth_to_pcl(depth)
+    depth_rgb, hit = basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib)
+    print(f"Registered: {hit.mean():.1%} of the color pixels")
+
+    for method, kwargs in (("splat", dict(radius=1)), ("splat", dict(radius=3)),
+                           ("nearest", dict(max_dist=3.0)),
+                           ("bilateral", dict(radius=1)), ("bilateral", dict(radius=3))):
+        ms = benchmark_fused_registration.time_ms(
+            lambda: depth_densify.densify_depth(depth_rgb, hit, method, guide_img=color_img, **kwargs), repeat=5)
+        _, dense_hit = depth_densify.densify_depth(depth_rgb, hit, method, guide_img=color_img, **kwargs)
+        print(f"{method:9s} {kwargs}: {ms:8.1f} ms, {dense_hit.mean():.1%} valid")
@@ -0,0 +1,50 @@
+"""
+Scaling of the row-band parallel fusion (parallel_fusion.ParallelFusion) per number of
+worker threads, against the single-threaded basler_fusion_depth_rgb functions, on a
+synthetic ToF frame and the stereo calibration XML.
+
+Runs without cameras:
+    python benchmark_parallel_fusion.py
+"""
+import os
+
+import cv2
+import numpy as np
+
+import basler_fusion_depth_rgb
+import benchmark_fused_registration
+import cam_calibration
+import parallel_fusion
+import projection_lut
+import tof_ray_table
+
+
+if __name__ == "__main__":
+    calib = cam_calibration.load_calibration()
+    lut = projection_lut.get_projection_lut(calib)
+    bayer, depth = benchmark_fused_registration.synthetic_frames()
+    color_img = cv2.cvtColor(bayer, cv2.COLOR_BAYER_BG2RGB)
+    pcl = tof_ray_table.ToFRayTable.from_intrinsics(calib.Kd).depth_to_pcl(depth)
+
+    ref_depth, ref_hit = basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib, lut=lut)
+    ref_colors, _ = basler_fusion_depth_rgb.warp_depth_with_color(pcl, color_img, "bilinear", calib, lut=lut,
+                                                                 sampler="remap")
+    base_ms = benchmark_fused_registration.time_ms(lambda: (
+        basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib, lut=lut),
+        basler_fusion_depth_rgb.warp_depth_with_color(pcl, color_img, "bilinear", calib, lut=lut, sampler="remap")),
+        repeat=10)
+    print(f"{os.cpu_count()} CPU cores, projection table and remap sampler")
+    print(f"single-threaded: {base_ms:8.1f} ms per frame")
+
+    workers = 1
+    while workers <= max(os.cpu_count(), 1):
+        with parallel_fusion.ParallelFusion(calib, workers=workers, lut=lut) as fusion:
+            ms = benchmark_fused_registration.time_ms(lambda: (
+                fusion.project_depth_to_color_frame(pcl, color_img),
+                fusion.warp_depth_with_color(pcl, color_img, "bilinear", sampler="remap")), repeat=10)
+            depth_rgb, hit = fusion.project_depth_to_color_frame(pcl, color_img)
+            colors, _ = fusion.warp_depth_with_color(pcl, color_img, "bilinear", sampler="remap")
+            same = (np.array_equal(depth_rgb, ref_depth) and np.array_equal(hit, ref_hit)
+                    and np.array_equal(colors, ref_colors))
+        print(f"{workers:2d} workers:     {ms:8.1f} ms per frame ({base_ms / ms:.2f}x), identical output: {same}")
+        workers *= 2
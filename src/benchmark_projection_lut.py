@@ -0,0 +1,42 @@
+"""
+Benchmark of the depth-binned projection table (projection_lut.ProjectionLUT) against
+cv2.projectPoints in project_depth_to_color_frame, on a synthetic ToF frame.
+
+Runs without cameras:
+    python benchmark_projection_lut.py
+"""
+import time
+
+import numpy as np
+
+import basler_fusion_depth_rgb
+import benchmark_fused_registration
+import cam_calibration
+import projection_lut
+
+
+if __name__ == "__main__":
+    calib = cam_calibration.load_calibration()
+    t0 = time.perf_counter()
+    lut = projection_lut.get_projection_lut(calib, cache_dir=None)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    # Tilted plane inside the table range, on the rays of the ToF pixels
+    _, depth = benchmark_fused_registration.synthetic_frames()
+    pcl = lut.rays.reshape(480, 640, 3) * depth[:, :, None]
+    color_img = np.zeros((1024, 1280, 3), dtype=np.uint8)
+
+    exact_ms = benchmark_fused_registration.time_ms(
+        lambda: basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib))
+    lut_ms = benchmark_fused_registration.time_ms(
+        lambda: basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib, lut=lut))
+
+    exact_depth, exact_hit = basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib)
+    lut_depth, lut_hit = basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib, lut=lut)
+
+    print(f"Table build (once):          {build_ms:8.1f} ms, {lut.bins} bins, {lut.nbytes / 1e6:.1f} MB, "
+          f"max error {lut.error_px:.3f} px")
+    print(f"projectPoints per frame:     {exact_ms:8.1f} ms")
+    print(f"Projection table per frame:  {lut_ms:8.1f} ms  ({exact_ms / lut_ms:.1f}x)")
+    print(f"Hit pixels: projectPoints {exact_hit.sum()}, table {lut_hit.sum()}, "
+          f"same pixel {np.mean(exact_hit == lut_hit):.2%}")
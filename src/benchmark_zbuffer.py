@@ -0,0 +1,72 @@
+"""
+Benchmark of the Z-buffer rasterizer (zbuffer.ZBuffer) against np.minimum.at, on the points
+of a synthetic ToF frame projected onto the 1280x1024 color image with the stereo calibration
+XML, and on uniformly random points with many collisions.
+
+Runs without cameras:
+    python benchmark_zbuffer.py
+"""
+import cv2
+import numpy as np
+
+import benchmark_fused_registration
+import cam_calibration
+import zbuffer
+
+
+def minimum_at_rasterize(u, v, z, height, width):
+    """
+    Reference: the np.minimum.at Z-buffer of project_depth_to_color_frame before zbuffer.ZBuffer.
+    """
+    depth = np.full((height, width), np.inf, dtype=np.float32)
+    np.minimum.at(depth, (v, u), z)
+    hit = np.isfinite(depth)
+    raw_depth = np.zeros_like(depth, dtype=np.uint16)
+    if hit.any():
+        np.clip(depth, 0, 65535, out=depth)
+        raw_depth[hit] = depth[hit].astype(np.uint16)
+    return raw_depth, hit
+
+
+def projected_points(height, width):
+    """
+    Pixel coordinates and depths of a synthetic blaze frame projected like project_depth_to_color_frame.
+    """
+    Kc, dc, Kd, dd, R, T = cam_calibration.load_calibration().as_tuple()
+    _, depth = benchmark_fused_registration.synthetic_frames()
+    Hd, Wd = depth.shape
+    uu, vv = np.meshgrid(np.arange(Wd, dtype=np.float32), np.arange(Hd, dtype=np.float32))
+    pts = np.stack([(uu - Kd[0, 2]) / Kd[0, 0] * depth, (vv - Kd[1, 2]) / Kd[1, 1] * depth, depth], axis=-1)
+    pts = pts.reshape(-1, 3)
+    img_pts, _ = cv2.projectPoints(pts, R, T, Kc, dc)
+    u = np.rint(img_pts[:, 0, 0]).astype(np.int32)
+    v = np.rint(img_pts[:, 0, 1]).astype(np.int32)
+    z = pts[:, 2]
+    inside = (z > 0) & (u >= 0) & (u < width) & (v >= 0) & (v < height)
+    return u[inside], v[inside], z[inside]
+
+
+def random_points(height, width, n=300_000, seed=0):
+    rng = np.random.default_rng(seed)
+    u = rng.integers(0, width, n, dtype=np.int32)
+    v = rng.integers(0, height, n, dtype=np.int32)
+    z = rng.uniform(300, 3000, n).astype(np.float32)
+    return u, v, z
+
+
+if __name__ == "__main__":
+    height, width = 1024, 1280
+    rasterizer = zbuffer.ZBuffer(height, width)
+
+    for name, (u, v, z) in (("projected ToF frame", projected_points(height, width)),
+                            ("random points", random_points(height, width))):
+        ref_ms = benchmark_fused_registration.time_ms(lambda: minimum_at_rasterize(u, v, z, height, width))
+        zbuf_ms = benchmark_fused_registration.time_ms(lambda: rasterizer.rasterize(u, v, z))
+
+        ref_depth, ref_hit = minimum_at_rasterize(u, v, z, height, width)
+        depth, hit = rasterizer.rasterize(u, v, z)
+        same = np.array_equal(ref_depth, depth) and np.array_equal(ref_hit, hit)
+
+        print(f"{name}: {z.size} points, {ref_hit.sum()} hit pixels")
+        print(f"  np.minimum.at:  {ref_ms:8.2f} ms")
+        print(f"  ZBuffer:        {zbuf_ms:8.2f} ms  ({ref_ms / zbuf_ms:.1f}x), identical output: {same}")
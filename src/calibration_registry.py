@@ -0,0 +1,179 @@
+import os
+import threading
+
+import numpy as np
+
+import basler_rgb_cam_grab
+import basler_tof_cam_grab
+import cam_calibration
+import projection_lut
+import undistort_cache
+
+class CalibrationSnapshot:
+    """
+    Immutable set of one calibration version and the caches derived from it.
+    A frame takes one snapshot (CalibrationRegistry.current()) and uses it throughout,
+    so it never mixes two calibration versions.
+
+    Attributes:
+        version (int): Counts up with every swapped-in snapshot
+        calib (CamCalibration): Stereo calibration
+        lut (ProjectionLUT): Projection table of calib, None unless the registry builds tables
+        rgb_intrinsics, tof_intrinsics: OpenCV (K, dist) of the RGB and the ToF camera
+        rgb_size, tof_size: (width, height) the intrinsics were calibrated for
+    """
+    __slots__ = ("version", "calib", "lut", "rgb_intrinsics", "tof_intrinsics", "rgb_size", "tof_size")
+
+    def __init__(self, version, calib, lut, rgb_intrinsics, tof_intrinsics, rgb_size, tof_size):
+        for name, value in (("version", version), ("calib", calib), ("lut", lut),
+                            ("rgb_intrinsics", rgb_intrinsics), ("tof_intrinsics", tof_intrinsics),
+                            ("rgb_size", rgb_size), ("tof_size", tof_size)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CalibrationSnapshot is immutable")
+
+    def __repr__(self) -> str:
+        return f"CalibrationSnapshot(version={self.version}, calib={self.calib})"
+
+def _intrinsics(dat_path, to_opencv):
+    # OpenCV (K, dist) and image size of a HALCON camera parameter file, None for the default parameters
+    if dat_path is None or not os.path.exists(dat_path):
+        return to_opencv(), None
+    params, size = cam_calibration.read_halcon_cam_par(dat_path)
+    return to_opencv(**params), size
+
+class CalibrationRegistry:
+    """
+    Hot-reload of the calibration files into running pipelines.
+
+    A watcher thread polls the stereo calibration XML and the HALCON intrinsic parameter files
+    (modification time and size). After a file changed and stayed unchanged for one more poll
+    (so a file still being written is not read), the new calibration is loaded and its derived
+    caches are built on the watcher thread: the undistortion maps (undistort_cache) and, with
+    build_lut, the projection table (projection_lut). Only then the new CalibrationSnapshot is
+    swapped in with a single reference assignment; frames in flight finish with the old one.
+    A file that fails to load keeps the current snapshot, it is retried after the next change.
+
+    Args:
+        stereo_xml: Stereo calibration XML (cam_calibration.CALIBRATION_XML)
+        rgb_intrinsics_dat, tof_intrinsics_dat: HALCON camera parameter files, None (or a missing
+            file) for the default parameters of halcon_to_opencv_intrinsics(_tof)
+        poll_interval: Seconds between two checks of the files
+        build_lut: Build the projection table of every calibration
+        alpha: Undistortion alpha of the prepared maps (see undistort_cache.get_undistort_maps)
+        on_swap: Optional callback(snapshot), called on the watcher thread after a swap
+    """
+    def __init__(self, stereo_xml: str = cam_calibration.CALIBRATION_XML,
+                 rgb_intrinsics_dat: str = cam_calibration.RGB_INTRINSICS_DAT,
+                 tof_intrinsics_dat: str = cam_calibration.TOF_INTRINSICS_DAT,
+                 poll_interval: float = 1.0, build_lut: bool = False, alpha: float = 1.0, on_swap=None):
+        self.paths = [p for p in (stereo_xml, rgb_intrinsics_dat, tof_intrinsics_dat) if p is not None]
+        self.stereo_xml = stereo_xml
+        self.rgb_intrinsics_dat = rgb_intrinsics_dat
+        self.tof_intrinsics_dat = tof_intrinsics_dat
+        self.poll_interval = poll_interval
+        self.build_lut = build_lut
+        self.alpha = alpha
+        self.on_swap = on_swap
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="calibration_registry", daemon=True)
+        # The first snapshot is built right away, so current() always has one
+        self._signature = self._file_signature()
+        self._snapshot = self._build(1)
+
+    def current(self) -> CalibrationSnapshot:
+        """
+        The latest calibration snapshot, take it once per frame.
+        """
+        return self._snapshot
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stats(self) -> dict:
+        """
+        Current calibration version and reload counters.
+        """
+        return {
+            "version": self._snapshot.version,
+            "calibration_id": self._snapshot.calib.calibration_id,
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+        }
+
+    def _file_signature(self):
+        signature = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _build(self, version: int) -> CalibrationSnapshot:
+        # Also replaces the calibration load_calibration() hands out, for stages built later
+        calib = cam_calibration.load_calibration(self.stereo_xml, reload=True)
+        rgb_intrinsics, rgb_size = _intrinsics(self.rgb_intrinsics_dat,
+                                               basler_rgb_cam_grab.halcon_to_opencv_intrinsics)
+        tof_intrinsics, tof_size = _intrinsics(self.tof_intrinsics_dat,
+                                               basler_tof_cam_grab.halcon_to_opencv_intrinsics_tof)
+
+        # Prepare the undistortion maps the grab functions will ask for
+        if rgb_size is not None:
+            undistort_cache.get_undistort_maps(*rgb_intrinsics, rgb_size, alpha=self.alpha)
+        if tof_size is not None:
+            undistort_cache.get_undistort_maps(*tof_intrinsics, tof_size, alpha=self.alpha)
+            undistort_cache.get_undistort_maps(*tof_intrinsics, tof_size, alpha=self.alpha, nearest=True)
+        # The fusion works on the color undistortion maps of the stereo calibration
+        undistort_cache.get_undistort_maps(np.asarray(calib.Kc, np.float64), np.asarray(calib.dc, np.float64),
+                                           rgb_size or (1280, 1024), alpha=self.alpha)
+        lut = projection_lut.get_projection_lut(calib, size=tof_size or (640, 480)) if self.build_lut else None
+        return CalibrationSnapshot(version, calib, lut, rgb_intrinsics, tof_intrinsics, rgb_size, tof_size)
+
+    def _reload(self) -> None:
+        old = self._snapshot
+        try:
+            snapshot = self._build(old.version + 1)
+        except Exception as e:
+            self.failed_reloads += 1
+            print(f"Calibration reload failed, keeping calibration {old.calib.calibration_id}: {e}")
+            return
+        self._snapshot = snapshot
+        self.reloads += 1
+        print(f"Calibration reloaded: {old.calib.calibration_id} -> {snapshot.calib.calibration_id} "
+              f"(version {snapshot.version})")
+        # The old table is only dropped from the in-memory cache, frames holding the old snapshot keep it
+        if old.lut is not None and old.calib.calibration_id != snapshot.calib.calibration_id:
+            projection_lut.clear_projection_luts(old.calib.calibration_id)
+        if self.on_swap is not None:
+            self.on_swap(snapshot)
+
+    def _watch(self) -> None:
+        pending = None
+        while not self._stop.wait(self.poll_interval):
+            signature = self._file_signature()
+            if signature == self._signature:
+                pending = None
+                continue
+            if signature != pending:
+                # Changed since the last poll, wait until the files are stable
+                pending = signature
+                continue
+            self._signature = signature
+            pending = None
+            self._reload()
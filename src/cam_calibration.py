@@ -0,0 +1,129 @@
+import hashlib
+import struct
+
+import cv2
+import numpy as np
+
+# Stereo calibration of the camera bridge (blaze SN 24945819, ace SN 24747625)
+CALIBRATION_XML = "./basler_calibration/calibration_24945819_24747625.xml"
+
+# HALCON intrinsic camera parameters of the ace (RGB) and blaze (ToF) camera
+RGB_INTRINSICS_DAT = "./halcon_calibration_result/RGB_cam_intrinsic_cal_SN24747625.dat"
+TOF_INTRINSICS_DAT = "./halcon_calibration_result/ToF_cam_intrinsic_cal_SN24945819.dat"
+
+class CamCalibration:
+    """
+    Immutable RGB + ToF stereo calibration, loaded once and shared by all fusion functions.
+
+    Attributes:
+        Kc (3x3), dc (Nx1): color intrinsics, distortion (float32)
+        Kd (3x3), dd (Nx1): blaze (depth) intrinsics, distortion (float32)
+        R (3x3), T (3x1):   transform from depth (blaze) frame to color frame, T in millimeters (float32)
+        calibration_id (str): content hash of all matrices, to key derived caches on
+        path (str): file the calibration was loaded from, if any
+    """
+    __slots__ = ("Kc", "dc", "Kd", "dd", "R", "T", "calibration_id", "path")
+
+    def __init__(self, Kc, dc, Kd, dd, R, T, path: str = None):
+        arrays = {
+            "Kc": np.asarray(Kc, dtype=np.float32).reshape(3, 3),
+            "dc": np.asarray(dc, dtype=np.float32).reshape(-1, 1),
+            "Kd": np.asarray(Kd, dtype=np.float32).reshape(3, 3),
+            "dd": np.asarray(dd, dtype=np.float32).reshape(-1, 1),
+            "R": np.asarray(R, dtype=np.float32).reshape(3, 3),
+            "T": np.asarray(T, dtype=np.float32).reshape(3, 1),
+        }
+        h = hashlib.sha1()
+        for name, array in arrays.items():
+            array = array.copy()
+            array.flags.writeable = False
+            h.update(array.tobytes())
+            object.__setattr__(self, name, array)
+        object.__setattr__(self, "calibration_id", h.hexdigest()[:16])
+        object.__setattr__(self, "path", path)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CamCalibration is immutable")
+
+    def __repr__(self) -> str:
+        return f"CamCalibration(id={self.calibration_id}, path={self.path})"
+
+    def as_tuple(self):
+        """
+        Returns:
+            (Kc, dc, Kd, dd, R, T), like load_cam_calibration_file()
+        """
+        return self.Kc, self.dc, self.Kd, self.dd, self.R, self.T
+
+    def with_extrinsics(self, R, T) -> "CamCalibration":
+        """
+        New calibration with the same intrinsics and other extrinsics.
+        """
+        return CamCalibration(self.Kc, self.dc, self.Kd, self.dd, R, T, path=self.path)
+
+    @classmethod
+    def from_xml(cls, xml_path: str = CALIBRATION_XML) -> "CamCalibration":
+        """
+        Parse the stereo calibration XML written by basler_calibration/calibration.py.
+        """
+        fs = cv2.FileStorage(xml_path, cv2.FILE_STORAGE_READ)
+        if not fs.isOpened():
+            raise FileNotFoundError(f"Cannot open calibration file: {xml_path}")
+
+        Kc = fs.getNode("colorCameraMatrix").mat()
+        dc = fs.getNode("colorDistortion").mat()
+        Kd = fs.getNode("blazeCameraMatrix").mat()
+        dd = fs.getNode("blazeDistortion").mat()
+        R  = fs.getNode("rotation").mat()
+        T  = fs.getNode("translation").mat()
+        fs.release()
+
+        if Kd is None or Kd.size == 0:
+            raise ValueError("Missing 'blazeCameraMatrix' in XML (depth intrinsics are required).")
+
+        if dd is None or dd.size == 0:
+            dd = np.zeros((1,5), dtype=np.float32)
+
+        return cls(Kc, dc, Kd, dd, R, T, path=xml_path)
+
+
+# Loaded calibrations: {path: CamCalibration}
+_calibrations = {}
+
+def load_calibration(xml_path: str = CALIBRATION_XML, reload: bool = False) -> CamCalibration:
+    """
+    Get the calibration of a file, parsing the file only on the first call (or with reload=True).
+    """
+    calib = _calibrations.get(xml_path)
+    if calib is None or reload:
+        calib = CamCalibration.from_xml(xml_path)
+        _calibrations[xml_path] = calib
+    return calib
+
+
+def read_halcon_cam_par(dat_path: str):
+    """
+    Read a HALCON camera parameter file (write_cam_par, area scan polynomial model).
+
+    The binary file holds 10 big-endian doubles (Focus [mm], K1, K2, K3 [1/mm^2, 1/mm^4, 1/mm^6],
+    P1, P2, Sx, Sy [mm], Cx, Cy [px]) and the image width and height.
+
+    Returns:
+        params: keyword arguments of basler_rgb_cam_grab.halcon_to_opencv_intrinsics /
+                basler_tof_cam_grab.halcon_to_opencv_intrinsics_tof (their units)
+        size: (width, height) of the calibrated images
+    """
+    with open(dat_path, "rb") as f:
+        data = f.read()
+    if len(data) < 103 or data[:4] != b"HCPR":
+        raise ValueError(f"Not a HALCON camera parameter file: {dat_path}")
+    f_mm, K1, K2, K3, P1, P2, Sx, Sy, Cx, Cy = struct.unpack(">10d", data[15:95])
+    width, height = struct.unpack(">2i", data[95:103])
+    params = {
+        "Sx_um": Sx * 1e3, "Sy_um": Sy * 1e3,
+        "f_mm": f_mm,
+        "Cx_px": Cx, "Cy_px": Cy,
+        "K1": K1 * 1e6, "K2": K2 * 1e12, "K3": K3 * 1e18,
+        "P1": P1 * 1e3, "P2": P2 * 1e3,
+    }
+    return params, (width, height)
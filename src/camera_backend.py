@@ -0,0 +1,181 @@
+import glob
+import time
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+import session_recorder
+
+class CameraBackend:
+    """
+    Frame source interface of the pipeline. A backend delivers one stream of frames
+    (e.g. RGB images or ToF point clouds), either from a live camera or from a recording.
+    """
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def grab(self) -> Optional[np.ndarray]:
+        """
+        Returns:
+            The next frame, or None when a finite source is exhausted.
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PylonBackend(CameraBackend):
+    """
+    Live camera backend on top of a basler_cam_session.BaslerCamSession.
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def open(self) -> None:
+        self.session.open()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def grab(self) -> Optional[np.ndarray]:
+        return self.session.grab()
+
+
+class SessionSource:
+    """
+    Frames of one stream of a session recorded by session_recorder.SessionRecorder.
+
+    Args:
+        session_dir (str): Session directory
+        stream (str): Stream name
+        seqs: Optional frame numbers to serve (e.g. the paired frames of a PairedSession), None for all
+        times_ns: Optional replay times [ns] of these frames, None for their recorded host times
+    """
+    def __init__(self, session_dir: str, stream: str, seqs=None, times_ns=None):
+        self.reader = session_recorder.SessionReader(session_dir)
+        self.stream = stream
+        host_times_ns = self.reader.index(stream)["host_time_ns"].astype(np.int64)
+        self.seqs = np.arange(len(host_times_ns)) if seqs is None else np.asarray(seqs)
+        self.times_ns = host_times_ns[self.seqs] if times_ns is None else np.asarray(times_ns, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.seqs)
+
+    def get(self, i: int):
+        """
+        Returns:
+            (frame, time [s] relative to the first frame)
+        """
+        return self.reader.frame(self.stream, int(self.seqs[i])), (self.times_ns[i] - self.times_ns[0]) * 1e-9
+
+
+class FolderSource:
+    """
+    Image files of a folder, e.g. "./basler_calibration/color_*.png", in natural sort order.
+
+    Args:
+        pattern (str): glob pattern of the image files
+        fps (float): Frame rate assumed for real-time pacing
+    """
+    def __init__(self, pattern: str, fps: float = 10.0):
+        self.paths = sorted(glob.glob(pattern), key=_natural_key)
+        if not self.paths:
+            raise FileNotFoundError(f"No images match: {pattern}")
+        self.fps = fps
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def get(self, i: int):
+        img = cv2.imread(self.paths[i], cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f"Cannot read image: {self.paths[i]}")
+        return img, i / self.fps
+
+
+def _natural_key(path: str):
+    # "color_10.png" sorts after "color_9.png"
+    digits = "".join(c if c.isdigit() else " " for c in path).split()
+    return (int(digits[-1]) if digits else -1, path)
+
+
+class ReplayBackend(CameraBackend):
+    """
+    Replay recorded frames through the pipeline without cameras.
+
+    Args:
+        source: SessionSource or FolderSource
+        convert_func (Callable): Optional conversion of a stored frame, e.g. debayering raw Bayer frames
+        pacing (str): "realtime" keeps the recorded frame timing, "fast" serves frames as fast as possible
+        loop (bool): Start again at the first frame instead of returning None at the end
+    """
+    def __init__(self, source, convert_func: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                 pacing: str = "realtime", loop: bool = False):
+        if pacing not in ("realtime", "fast"):
+            raise ValueError("pacing must be 'realtime' or 'fast'")
+        self.source = source
+        self.convert_func = convert_func
+        self.pacing = pacing
+        self.loop = loop
+        self.position = 0
+        self._start_time = None
+
+    def open(self) -> None:
+        self.position = 0
+        self._start_time = None
+
+    def grab(self) -> Optional[np.ndarray]:
+        if self.position >= len(self.source):
+            if not self.loop:
+                return None
+            self.position = 0
+            self._start_time = None
+        frame, frame_time = self.source.get(self.position)
+        self.position += 1
+
+        if self.pacing == "realtime":
+            now = time.perf_counter()
+            if self._start_time is None:
+                self._start_time = now - frame_time
+            delay = self._start_time + frame_time - now
+            if delay > 0:
+                time.sleep(delay)
+
+        if self.convert_func is not None:
+            return self.convert_func(frame)
+        return np.array(frame)
+
+
+def debayer_bg(bayer_image: np.ndarray) -> np.ndarray:
+    """
+    Convert a recorded BayerBG8 frame to a RGB image, like the live RGB camera path.
+    """
+    return cv2.cvtColor(bayer_image, cv2.COLOR_BAYER_BG2RGB)
+
+def create_replay_backends(session_dir: str, pacing: str = "realtime", loop: bool = False,
+                           tof_session_dir: str = None, max_skew_ms: float = None):
+    """
+    Create the RGB and ToF point cloud backends replaying the streams "rgb_bayer" and
+    "tof_Point_Cloud", paired by timestamp (see session_recorder.PairedSession): either one
+    session recorded by basler_cam_pair.PairedCapture, or an RGB and a ToF session recorded separately.
+    Both backends serve the pairs in the same order and at the same times.
+
+    Returns:
+        (rgb_backend, tof_backend)
+    """
+    paired = session_recorder.PairedSession(session_dir, tof_session_dir, max_skew_ms=max_skew_ms)
+    print(f"Replaying {session_dir}{' + ' + tof_session_dir if tof_session_dir else ''}: {paired.stats()}")
+    rgb_source = SessionSource(session_dir, "rgb_bayer", paired.rgb_seqs, paired.times_ns)
+    tof_source = SessionSource(tof_session_dir or session_dir, "tof_Point_Cloud", paired.tof_seqs, paired.times_ns)
+    rgb_backend = ReplayBackend(rgb_source, debayer_bg, pacing, loop)
+    tof_backend = ReplayBackend(tof_source, None, pacing, loop)
+    return rgb_backend, tof_backend
@@ -0,0 +1,138 @@
+import cv2
+import numpy as np
+
+import zbuffer
+
+# Densification strategies of densify_depth()
+DENSIFY_METHODS = ("splat", "nearest", "bilateral")
+
+def splat_depth(depth, hit, radius: int = 1):
+    """
+    Fixed-radius splatting: every registered point covers a disc of `radius` pixels, and
+    overlapping discs keep the closest depth (same Z-test as zbuffer.ZBuffer).
+    Done as a min filter (grayscale erosion) over the registered pixels, so the cost does
+    not depend on the number of points.
+    Runtime at 1280x1024: about 4 ms (radius 1) - 6 ms (radius 3).
+
+    Args:
+        depth: (H, W) uint16 registered depth [mm], 0 where empty
+        hit: (H, W) bool, True where a point landed
+        radius: Splat radius [px]
+
+    Returns:
+        depth: (H, W) uint16 splatted depth [mm], 0 where empty
+        hit: (H, W) bool, True where covered by a splat
+    """
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    buf = np.where(hit, depth, zbuffer.ZBUFFER_EMPTY).astype(np.uint16)
+    buf = cv2.erode(buf, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=zbuffer.ZBUFFER_EMPTY)
+    dense_hit = buf != zbuffer.ZBUFFER_EMPTY
+    np.multiply(buf, dense_hit, out=buf)
+    return buf, dense_hit
+
+def nearest_valid_fill(depth, hit, max_dist: float = 3.0):
+    """
+    Fill every empty pixel with the depth of the nearest registered pixel, if that one is
+    at most `max_dist` pixels away. Registered pixels keep their depth.
+    Uses the labels of cv2.distanceTransformWithLabels (one pass, independent of max_dist).
+    Runtime at 1280x1024: about 35 ms.
+
+    Args:
+        depth: (H, W) uint16 registered depth [mm], 0 where empty
+        hit: (H, W) bool, True where a point landed
+        max_dist: Max. distance to the nearest registered pixel [px]
+
+    Returns:
+        depth: (H, W) uint16 filled depth [mm], 0 where empty
+        hit: (H, W) bool, True where filled
+    """
+    if not hit.any():
+        return depth.copy(), hit.copy()
+    holes = (~hit).astype(np.uint8)
+    dist, labels = cv2.distanceTransformWithLabels(holes, cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_PIXEL)
+    # Label i is the i-th registered pixel in raster order
+    values = np.concatenate([[0], depth[hit]]).astype(np.uint16)
+    filled = values[labels]
+    dense_hit = dist <= max_dist
+    np.multiply(filled, dense_hit, out=filled)
+    return filled, dense_hit
+
+def joint_bilateral_fill(depth, hit, guide_img, radius: int = 3, sigma_space: float = 2.0,
+                         sigma_color: float = 10.0, fill_only: bool = True):
+    """
+    RGB-guided joint bilateral upsampling: every pixel gets the average of the registered
+    depths within `radius`, weighted by their distance and by how similar their gray value
+    in the color image is, so the filled depth follows the color edges.
+    Runtime at 1280x1024: about 6.5 ms per window offset, (2 * radius + 1)^2 offsets
+    (about 90 ms for radius 1, 320 ms for radius 3).
+
+    Args:
+        depth: (H, W) uint16 registered depth [mm], 0 where empty
+        hit: (H, W) bool, True where a point landed
+        guide_img: (H, W, 3) uint8 BGR color image of the same frame
+        radius: Window radius [px]
+        sigma_space: Spatial sigma [px]
+        sigma_color: Gray value sigma
+        fill_only: Keep the registered depths, only fill the empty pixels
+
+    Returns:
+        depth: (H, W) uint16 densified depth [mm], 0 where empty
+        hit: (H, W) bool, True where at least one registered pixel was in the window
+    """
+    H, W = depth.shape
+    r = radius
+    gray = cv2.cvtColor(guide_img, cv2.COLOR_BGR2GRAY)
+    gray_p = cv2.copyMakeBorder(gray, r, r, r, r, cv2.BORDER_REPLICATE)
+    depth_p = cv2.copyMakeBorder(depth.astype(np.float32), r, r, r, r, cv2.BORDER_CONSTANT, value=0)
+    hit_p = cv2.copyMakeBorder(hit.astype(np.float32), r, r, r, r, cv2.BORDER_CONSTANT, value=0)
+
+    # Color weight of every absolute gray value difference
+    color_lut = np.exp(-np.arange(256, dtype=np.float32) ** 2 / (2 * sigma_color ** 2)).reshape(1, 256)
+
+    num = np.zeros((H, W), dtype=np.float32)
+    den = np.zeros((H, W), dtype=np.float32)
+    w = np.empty((H, W), dtype=np.float32)
+    for dy in range(-r, r + 1):
+        for dx in range(-r, r + 1):
+            ws = np.float32(np.exp(-(dx * dx + dy * dy) / (2 * sigma_space ** 2)))
+            rows = slice(r + dy, r + dy + H)
+            cols = slice(r + dx, r + dx + W)
+            w[:] = cv2.LUT(cv2.absdiff(gray, gray_p[rows, cols]), color_lut)
+            cv2.multiply(w, hit_p[rows, cols], dst=w, scale=float(ws))
+            cv2.add(den, w, dst=den)
+            cv2.add(num, cv2.multiply(w, depth_p[rows, cols]), dst=num)
+
+    dense_hit = den > 1e-6
+    dense = np.zeros((H, W), dtype=np.float32)
+    np.divide(num, den, out=dense, where=dense_hit)
+    dense = np.clip(np.rint(dense), 0, 65535).astype(np.uint16)
+    if fill_only:
+        dense[hit] = depth[hit]
+    return dense, dense_hit | hit
+
+def densify_depth(depth, hit, method: str = "splat", guide_img=None, **kwargs):
+    """
+    Densify a depth map registered onto the color image (e.g. project_depth_to_color_frame),
+    where most color pixels are empty (640x480 ToF points on a 1280x1024 canvas).
+
+    Args:
+        depth: (H, W) uint16 registered depth [mm], 0 where empty
+        hit: (H, W) bool, True where a point landed
+        method: 'splat' (splat_depth), 'nearest' (nearest_valid_fill) or 'bilateral' (joint_bilateral_fill)
+        guide_img: (H, W, 3) uint8 BGR color image, required for 'bilateral'
+        kwargs: Parameters of the strategy
+
+    Returns:
+        depth: (H, W) uint16 dense depth [mm], 0 where still empty
+        hit: (H, W) bool, True where the dense depth is valid
+    """
+    if method == "splat":
+        return splat_depth(depth, hit, **kwargs)
+    elif method == "nearest":
+        return nearest_valid_fill(depth, hit, **kwargs)
+    elif method == "bilateral":
+        if guide_img is None:
+            raise ValueError("method 'bilateral' needs the color image as guide_img")
+        return joint_bilateral_fill(depth, hit, guide_img, **kwargs)
+    else:
+        raise ValueError(f"method must be one of {DENSIFY_METHODS}")
@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import cam_calibration
+
+def tof_edge_points(pcl, jump_mm: float = 30.0, max_points: int = 4000):
+    """
+    3D points on the depth discontinuities of a ToF point cloud: for every pair of neighboring
+    points with a depth step above `jump_mm`, the nearer (occluding) one. These are the points
+    whose projection should fall onto an RGB edge.
+
+    Args:
+        pcl: (Hd, Wd, 3) float32 point cloud in the depth frame [millimeters], Z=0 where invalid
+        jump_mm: Min. depth step [mm]
+        max_points: Points kept at most (evenly subsampled)
+
+    Returns:
+        points: (M, 3) float32 [mm]
+    """
+    z = pcl[:, :, 2]
+    valid = z > 0
+    pts = pcl.reshape(-1, 3)
+    idx = np.arange(z.size).reshape(z.shape)
+    near = []
+    for a, b, za, zb, va, vb in ((idx[:, :-1], idx[:, 1:], z[:, :-1], z[:, 1:], valid[:, :-1], valid[:, 1:]),
+                                 (idx[:-1], idx[1:], z[:-1], z[1:], valid[:-1], valid[1:])):
+        jump = (np.abs(za - zb) > jump_mm) & va & vb
+        near.append(np.where(za < zb, a, b)[jump])
+    edge_idx = np.unique(np.concatenate(near))
+    if edge_idx.size > max_points:
+        edge_idx = edge_idx[np.linspace(0, edge_idx.size - 1, max_points).astype(np.int64)]
+    return pts[edge_idx].astype(np.float32)
+
+def rgb_edge_distance(color_img, decimation: int = 2):
+    """
+    Distance [px of the decimated grid] of every pixel to the nearest Canny edge of the color image.
+    """
+    gray = cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY)
+    if decimation > 1:
+        h, w = gray.shape
+        gray = cv2.resize(gray, (w // decimation, h // decimation), interpolation=cv2.INTER_AREA)
+    edges = cv2.Canny(gray, 100, 200)
+    return cv2.distanceTransform(cv2.bitwise_not(edges), cv2.DIST_L2, 3)
+
+def edge_alignment_cost(calib: cam_calibration.CamCalibration, rvec, tvec, samples, decimation: int = 2,
+                        max_dist_px: float = 20.0) -> float:
+    """
+    Mean (clamped) distance [px] between the projected ToF edge points and the RGB edges,
+    averaged over the samples, for the extrinsics (rvec, tvec).
+
+    Args:
+        calib: Calibration of the intrinsics
+        rvec, tvec: Rodrigues rotation vector and translation [mm] from depth to color frame
+        samples: [(edge_points, distance_map), ...] see tof_edge_points and rgb_edge_distance
+        decimation: Decimation of the distance maps
+        max_dist_px: Distance clamp [px at full resolution]
+    """
+    total = 0.0
+    for points, dist in samples:
+        img_pts, _ = cv2.projectPoints(points, rvec, tvec, calib.Kc, calib.dc)
+        img_pts = img_pts.reshape(-1, 2) / decimation
+        h, w = dist.shape
+        u = np.rint(img_pts[:, 0]).astype(np.int32)
+        v = np.rint(img_pts[:, 1]).astype(np.int32)
+        inside = (u >= 0) & (u < w) & (v >= 0) & (v < h)
+        d = np.full(len(points), max_dist_px / decimation, dtype=np.float32)
+        d[inside] = np.minimum(dist[v[inside], u[inside]], max_dist_px / decimation)
+        total += float(d.mean()) * decimation
+    return total / len(samples)
+
+class ExtrinsicRefiner:
+    """
+    Background refinement of the ToF -> RGB extrinsics against live frames.
+
+    submit() hands a fused frame pair to a low-priority worker thread (newest pair wins, never
+    blocks). The worker keeps the edge points / RGB edge distance maps of the last `samples`
+    pairs and runs a few iterations of a pattern search over the rotation vector and
+    translation, warm-started from the current extrinsics, minimizing edge_alignment_cost.
+    An improvement of at least `min_gain_px` is swapped in as a new CamCalibration
+    (CamCalibration.with_extrinsics), a single reference assignment, so a frame never sees
+    half-updated extrinsics. Readers take `refiner.calib` once per frame.
+
+    The worker sleeps as needed to stay within `cpu_budget` (fraction of one core, measured with
+    its thread CPU time while working on a pair) and lowers its own scheduling priority where
+    the OS supports it.
+    The refined extrinsics are kept within `max_rot_deg` / `max_trans_mm` of the start.
+
+    Args:
+        calib: Start calibration, None for the default calibration file
+        samples: Frame pairs the cost is averaged over
+        iterations: Pattern search iterations per refinement
+        step_deg, step_mm: Initial search steps of the rotation and the translation
+        min_gain_px: Min. cost reduction to swap in new extrinsics [px]
+        cpu_budget: Max. CPU share of the worker (fraction of one core)
+        max_rot_deg, max_trans_mm: Max. deviation from the start extrinsics
+        decimation: Decimation of the RGB edge distance maps
+        on_update: Optional callback(calib), called on the worker thread before a new calibration
+            is swapped in, e.g. to build derived tables of it. Its CPU time counts against cpu_budget.
+    """
+    def __init__(self, calib: cam_calibration.CamCalibration = None, samples: int = 3, iterations: int = 4,
+                 step_deg: float = 0.2, step_mm: float = 1.0, min_gain_px: float = 0.1, cpu_budget: float = 0.1,
+                 max_rot_deg: float = 2.0, max_trans_mm: float = 10.0, decimation: int = 2, on_update=None):
+        self.calib = cam_calibration.load_calibration() if calib is None else calib
+        self.initial_calib = self.calib
+        self.samples = deque(maxlen=samples)
+        self.iterations = iterations
+        self.step_deg = step_deg
+        self.step_mm = step_mm
+        self.min_gain_px = min_gain_px
+        self.cpu_budget = cpu_budget
+        self.max_rot_deg = max_rot_deg
+        self.max_trans_mm = max_trans_mm
+        self.decimation = decimation
+        self.on_update = on_update
+        self.cost_px = None
+        self.refinements = 0
+        self.updates = 0
+        self._pair = None
+        self._generation = 0
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="extrinsic_refiner", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset(self, calib: cam_calibration.CamCalibration) -> None:
+        """
+        Restart from another calibration (e.g. a reloaded calibration file), dropping the samples.
+        A refinement still running on the old calibration is not swapped in.
+        """
+        with self._cond:
+            self._generation += 1
+            self.calib = calib
+            self.initial_calib = calib
+            self.samples.clear()
+            self.cost_px = None
+
+    def submit(self, pcl, color_img) -> None:
+        """
+        Offer a frame pair (ToF point cloud [mm] in the depth frame, BGR image) to the refiner.
+        The arrays are referenced, not copied: pass arrays that are not overwritten afterwards.
+        """
+        with self._cond:
+            self._pair = (pcl, color_img)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        """
+        Counters, last cost and the deviation of the current from the start extrinsics.
+        """
+        rvec, _ = cv2.Rodrigues(self.calib.R @ self.initial_calib.R.T)
+        return {
+            "refinements": self.refinements,
+            "updates": self.updates,
+            "cost_px": self.cost_px,
+            "rotation_deg": float(np.degrees(np.linalg.norm(rvec))),
+            "translation_mm": float(np.linalg.norm(self.calib.T - self.initial_calib.T)),
+            "calibration_id": self.calib.calibration_id,
+        }
+
+    def _throttle(self, cpu_start: float, wall_start: float) -> None:
+        # Sleep until the CPU time used since the start is within the budget of the elapsed time
+        cpu = time.thread_time() - cpu_start
+        idle = cpu / self.cpu_budget - (time.perf_counter() - wall_start)
+        if idle > 0:
+            with self._cond:
+                if not self._stop:
+                    self._cond.wait(timeout=idle)
+
+    def _within_limits(self, rvec, tvec, rvec0, tvec0) -> bool:
+        R, _ = cv2.Rodrigues(rvec)
+        R0, _ = cv2.Rodrigues(rvec0)
+        drot, _ = cv2.Rodrigues(R @ R0.T)
+        return (np.degrees(np.linalg.norm(drot)) <= self.max_rot_deg and
+                np.linalg.norm(tvec - tvec0) <= self.max_trans_mm)
+
+    def _refine(self, cpu_start: float, wall_start: float) -> None:
+        with self._cond:
+            generation = self._generation
+            calib = self.calib
+            initial_calib = self.initial_calib
+            samples = list(self.samples)
+        rvec0, _ = cv2.Rodrigues(initial_calib.R.astype(np.float64))
+        tvec0 = initial_calib.T.astype(np.float64)
+        rvec, _ = cv2.Rodrigues(calib.R.astype(np.float64))
+        tvec = calib.T.astype(np.float64)
+
+        start_cost = best = edge_alignment_cost(calib, rvec, tvec, samples, self.decimation)
+        steps = np.array([np.radians(self.step_deg)] * 3 + [self.step_mm] * 3)
+        for _ in range(self.iterations):
+            improved = False
+            for i in range(6):
+                for sign in (1.0, -1.0):
+                    if self._stop:
+                        return
+                    r, t = rvec.copy(), tvec.copy()
+                    if i < 3:
+                        r[i] += sign * steps[i]
+                    else:
+                        t[i - 3] += sign * steps[i]
+                    if not self._within_limits(r, t, rvec0, tvec0):
+                        continue
+                    cost = edge_alignment_cost(calib, r, t, samples, self.decimation)
+                    if cost < best:
+                        best, rvec, tvec, improved = cost, r, t, True
+                    self._throttle(cpu_start, wall_start)
+            if not improved:
+                steps *= 0.5
+        self.refinements += 1
+        if generation != self._generation:
+            return
+        self.cost_px = best
+
+        if start_cost - best >= self.min_gain_px:
+            R, _ = cv2.Rodrigues(rvec)
+            new_calib = calib.with_extrinsics(R, tvec)
+            if self.on_update is not None:
+                self.on_update(new_calib)
+            with self._cond:
+                swap = generation == self._generation
+                if swap:
+                    self.calib = new_calib
+            if swap:
+                self.updates += 1
+                print(f"Extrinsic refiner: edge distance {start_cost:.2f} -> {best:.2f} px, "
+                      f"calibration {new_calib.calibration_id}")
+            # Idle off the CPU time of on_update as well
+            self._throttle(cpu_start, wall_start)
+
+    def _run(self) -> None:
+        if hasattr(os, "setpriority"):
+            try:
+                # Per-thread on Linux: the native thread id is a process id of the scheduler
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+        while True:
+            with self._cond:
+                while self._pair is None and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                pcl, color_img = self._pair
+                self._pair = None
+            # The budget applies to the work on every pair, idle time is not saved up
+            cpu_start = time.thread_time()
+            wall_start = time.perf_counter()
+
+            points = tof_edge_points(pcl)
+            if len(points) == 0:
+                continue
+            sample = (points, rgb_edge_distance(color_img, self.decimation))
+            with self._cond:
+                self.samples.append(sample)
+            self._throttle(cpu_start, wall_start)
+            if len(self.samples) == self.samples.maxlen:
+                self._refine(cpu_start, wall_start)
@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+
+import cam_calibration
+import rgbd_frame
+import undistort_cache
+import zbuffer
+
+class FusedRegistration:
+    """
+    Single-pass undistort-and-register stage: raw BayerBG8 image + raw ToF depth ->
+    undistorted color image and ToF depth registered onto its pixel grid.
+
+    Everything that only depends on the rig is precomputed once:
+      - the fixed-point undistortion maps of the color camera (undistort_cache),
+      - for every ToF pixel its undistorted viewing ray, already multiplied with the
+        extrinsics and the undistorted color camera matrix.
+    Per frame, the color image is debayered and remapped (2 passes), and the depth is
+    registered with a few element-wise operations on the valid ToF pixels followed by the
+    Z-buffer. The ToF depth itself is never resampled on an undistorted grid.
+
+    Args:
+        Kc, dc: color camera matrix and distortion
+        Kd, dd: blaze (depth) camera matrix and distortion
+        R, T:   color <- depth transform (3x3, 3x1), T in millimeters
+        color_size: (width, height) of the color image
+        depth_size: (width, height) of the ToF depth map
+        alpha: see cv2.getOptimalNewCameraMatrix for the undistorted color image
+    """
+    def __init__(self, Kc, dc, Kd, dd, R, T, color_size=(1280, 1024), depth_size=(640, 480), alpha=1.0):
+        self.color_size = color_size
+        self.depth_size = depth_size
+        self.calibration_id = None
+
+        # Color undistortion maps and the camera matrix of the undistorted color image
+        self.map1, self.map2, self.newKc, _ = undistort_cache.get_undistort_maps(
+            np.asarray(Kc, np.float64), np.asarray(dc, np.float64), color_size, alpha=alpha)
+
+        # Undistorted, normalized ray (x, y, 1) of every ToF pixel
+        Wd, Hd = depth_size
+        u, v = np.meshgrid(np.arange(Wd, dtype=np.float64), np.arange(Hd, dtype=np.float64))
+        pix = np.stack([u.ravel(), v.ravel()], axis=1).reshape(-1, 1, 2)
+        rays = cv2.undistortPoints(pix, np.asarray(Kd, np.float64), np.asarray(dd, np.float64)).reshape(-1, 2)
+        rays = np.hstack([rays, np.ones((rays.shape[0], 1))])
+
+        # Color pixel of a depth point z * ray: [u*w, v*w, w] = z * (P @ ray) + P @ T
+        # with P = newKc @ R, so per frame only z changes.
+        P = self.newKc @ np.asarray(R, np.float64)
+        self.ray_proj = (rays @ P.T).astype(np.float32)  # (N, 3)
+        self.t_proj = (self.newKc @ np.asarray(T, np.float64).reshape(3)).astype(np.float32)
+
+        Wc, Hc = color_size
+        self.zbuffer = zbuffer.ZBuffer(Hc, Wc)
+
+    @classmethod
+    def from_calibration(cls, calib: cam_calibration.CamCalibration = None, **kwargs) -> "FusedRegistration":
+        """
+        Build the stage from a calibration, None for the stereo calibration XML of the camera bridge.
+        """
+        if calib is None:
+            calib = cam_calibration.load_calibration()
+        stage = cls(*calib.as_tuple(), **kwargs)
+        stage.calibration_id = calib.calibration_id
+        return stage
+
+    def register(self, bayer_img: np.ndarray, depth: np.ndarray, color_out: np.ndarray = None,
+                 depth_out: np.ndarray = None):
+        """
+        Args:
+            bayer_img: (Hc, Wc) uint8 raw BayerBG8 image
+            depth:     (Hd, Wd) ToF Z values [mm] (float32 or uint16, 0 = invalid),
+                       e.g. pcl[:, :, 2] of the blaze point cloud
+            color_out: Optional (Hc, Wc, 3) uint8 array to write the undistorted image into
+            depth_out: Optional (Hc, Wc) uint16 array to write the registered depth into
+
+        Returns:
+            color_undist: (Hc, Wc, 3) uint8 undistorted BGR image
+            depth_on_color: (Hc, Wc) uint16 depth [mm] along the color camera axis, 0 where empty
+            valid_mask: (Hc, Wc) bool, True where at least one ToF point landed
+            Without depth_out, depth_on_color and valid_mask are reused by the next register() call.
+        """
+        # Color: debayer + undistort
+        color = cv2.cvtColor(bayer_img, cv2.COLOR_BAYER_BG2RGB)
+        color_undist = cv2.remap(color, self.map1, self.map2, interpolation=cv2.INTER_LINEAR, dst=color_out)
+
+        # Depth: project the valid ToF pixels straight onto the undistorted color grid
+        Wc, Hc = self.color_size
+        z = depth.reshape(-1)
+        idx = np.flatnonzero(z > 0)
+        z = z[idx].astype(np.float32)
+        ray_proj = self.ray_proj[idx]
+        w = z * ray_proj[:, 2] + self.t_proj[2]  # Z in the color camera frame
+        u = np.rint((z * ray_proj[:, 0] + self.t_proj[0]) / w).astype(np.int32)
+        v = np.rint((z * ray_proj[:, 1] + self.t_proj[1]) / w).astype(np.int32)
+        inside = (w > 0) & (u >= 0) & (u < Wc) & (v >= 0) & (v < Hc)
+        u, v, w = u[inside], v[inside], w[inside]
+
+        # Z-buffer: keep the closest point per color pixel
+        depth_on_color, valid_mask = self.zbuffer.rasterize(u, v, w, out=depth_out)
+        return color_undist, depth_on_color, valid_mask
+
+    def register_frame(self, bayer_img: np.ndarray, depth: np.ndarray, color_timestamp: int = 0,
+                       depth_timestamp: int = 0, frame: rgbd_frame.RGBDFrame = None) -> rgbd_frame.RGBDFrame:
+        """
+        register() straight into a compact RGB-D frame, without intermediate copies.
+
+        Args:
+            bayer_img, depth: See register()
+            color_timestamp, depth_timestamp: Camera timestamps of the two source frames
+            frame: Optional frame to reuse, e.g. from a queue of free frames
+
+        Returns:
+            RGBDFrame of the color image size
+        """
+        Wc, Hc = self.color_size
+        if frame is None:
+            frame = rgbd_frame.RGBDFrame(Hc, Wc)
+        _, _, valid_mask = self.register(bayer_img, depth, color_out=frame.color, depth_out=frame.depth)
+        frame.mask_bits[:] = np.packbits(valid_mask, axis=None)
+        frame.calibration_id = self.calibration_id or ""
+        frame.color_timestamp = color_timestamp
+        frame.depth_timestamp = depth_timestamp
+        return frame
@@ -1,24 +1,178 @@
+import argparse
+import time
+
 import numpy as np
 import cv2
+import basler_cam_session
 import basler_rgb_cam_grab
 import basler_tof_cam_grab
 import basler_fusion_depth_rgb
+import cam_calibration
+import projection_lut
+import camera_backend
+import depth_densify
+import alignment_preview
+import alignment_monitor
+import extrinsic_refiner
+import calibration_registry
+
+
+def run_alignment(rgb_backend: camera_backend.CameraBackend, tof_backend: camera_backend.CameraBackend,
+                  display: bool = True, wait_key: bool = True, use_lut: bool = False,
+                  densify: str = None, preview: alignment_preview.AlignmentPreview = None,
+                  drift_monitor: alignment_monitor.ExtrinsicDriftMonitor = None,
+                  refiner: extrinsic_refiner.ExtrinsicRefiner = None, refine_every: int = 10,
+                  registry: calibration_registry.CalibrationRegistry = None) -> None:
+    """
+    Fuse RGB and ToF frames from two backends and show the alignment overlays.
+    Prints the pipeline throughput at the end.
+    With use_lut, the ToF points are registered with the projection table of the calibration.
+    With densify, the registered depth is densified with that depth_densify method.
+    With preview, the overlays are rendered by that (started) AlignmentPreview instead of in this loop.
+    With drift_monitor, the RGB / depth edge alignment of the registered frames is checked online.
+    With refiner, every refine_every-th frame pair goes to that (started) ExtrinsicRefiner, and every
+    frame is fused with its latest calibration.
+    With registry, every frame takes the latest calibration snapshot of that (started)
+    CalibrationRegistry, so changed calibration files are picked up without a restart.
+    """
+    # Parse the calibration once for the whole run
+    calib = cam_calibration.load_calibration()
+    lut = projection_lut.get_projection_lut(calib) if use_lut else None
+    registry_calib_id = None
+    frames = 0
+    t0 = time.perf_counter()
+    while True:
+        color_img = rgb_backend.grab()
+        pcl = tof_backend.grab()
+        if color_img is None or pcl is None:
+            break
+
+        if registry is not None:
+            snapshot = registry.current()
+            # Only a changed stereo calibration replaces the (possibly refined) one of this run,
+            # a reload of the intrinsic parameter files alone keeps it
+            if snapshot.calib.calibration_id != registry_calib_id:
+                registry_calib_id = snapshot.calib.calibration_id
+                calib = snapshot.calib
+                lut = snapshot.lut if use_lut else None
+                if refiner is not None:
+                    refiner.reset(calib)
+                if drift_monitor is not None and snapshot.version > 1:
+                    # New baseline for the reloaded calibration
+                    drift_monitor.reset()
+        if refiner is not None:
+            # Take the refined calibration once per frame, so both fusion steps use the same one
+            if refiner.calib is not calib:
+                calib = refiner.calib
+                lut = projection_lut.get_projection_lut(calib, cache_dir=None) if use_lut else None
+                if drift_monitor is not None:
+                    # The old baseline belongs to the replaced extrinsics, learn the one of the refined
+                    drift_monitor.reset()
+            if frames % refine_every == 0:
+                refiner.submit(pcl.copy(), color_img.copy())
+
+        pcl_color_frame = basler_fusion_depth_rgb.transform_pcl_to_color_frame(pcl, calib)
+        depth_color_frame, hit = basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img, calib, lut=lut)
+        if drift_monitor is not None:
+            drift_monitor.update(color_img, depth_color_frame, hit)
+        if densify:
+            depth_color_frame, hit = depth_densify.densify_depth(depth_color_frame, hit, densify, guide_img=color_img)
+        frames += 1
+
+        if preview is not None:
+            preview.submit(color_img, depth_color_frame)
+            if preview.quit_requested:
+                break
+        elif display:
+            overlay_heatmap, overlay_edges = basler_fusion_depth_rgb.visualize_rgb_depth_alignment(
+                color_img, depth_color_frame
+            )
+            cv2.imshow("overlay_heatmap", overlay_heatmap)
+            cv2.imshow("overlay_edges", overlay_edges)
+            # Press q to quit, (with wait_key) any other key to grab the next frame pair
+            if cv2.waitKey(0 if wait_key else 1) & 0xFF == ord("q"):
+                break
+    elapsed = time.perf_counter() - t0
+    if frames:
+        print(f"Processed {frames} frame pairs in {elapsed:.2f} s ({frames / elapsed:.1f} fps)")
+    if drift_monitor is not None:
+        print(f"Extrinsic drift monitor: {drift_monitor.stats()}")
+    if refiner is not None:
+        print(f"Extrinsic refiner: {refiner.stats()}")
 
 
 if __name__ == '__main__':
-    color_img = basler_rgb_cam_grab.grab_one_rgb_img()
-    pcl = basler_tof_cam_grab.grab_one_point_cloud()
+    parser = argparse.ArgumentParser(description="RGB and ToF depth alignment")
+    parser.add_argument("--replay", help="Replay a recorded session directory instead of the live cameras "
+                                         "(recorded by basler_cam_pair.py --record, or the RGB session with --replay-tof)")
+    parser.add_argument("--replay-tof", help="Separately recorded ToF session to pair with the --replay RGB session")
+    parser.add_argument("--fast", action="store_true", help="Replay as fast as possible instead of real time")
+    parser.add_argument("--no-display", action="store_true", help="Only measure the pipeline throughput")
+    parser.add_argument("--lut", action="store_true", help="Register the ToF points with the projection table")
+    parser.add_argument("--preview", action="store_true",
+                        help="Throttled, reduced-resolution overlays on a display thread")
+    parser.add_argument("--preview-scale", type=float, default=0.5, help="Preview size relative to the color image")
+    parser.add_argument("--preview-fps", type=float, default=10.0, help="Max. preview rate")
+    parser.add_argument("--drift-monitor", action="store_true",
+                        help="Check the RGB / depth edge alignment every n-th frame")
+    parser.add_argument("--drift-every", type=int, default=10, help="Frames between two drift checks")
+    parser.add_argument("--drift-alert-px", type=float, default=2.0,
+                        help="Alert when the edge distance grows by more than this over its baseline [px]")
+    parser.add_argument("--refine-extrinsics", action="store_true",
+                        help="Refine the ToF -> RGB extrinsics against the live frames in the background")
+    parser.add_argument("--refine-cpu", type=float, default=0.1, help="CPU budget of the refiner (share of one core)")
+    parser.add_argument("--hot-reload", action="store_true",
+                        help="Watch the calibration files and swap in changed calibrations while running")
+    parser.add_argument("--densify", choices=depth_densify.DENSIFY_METHODS, help="Densify the registered depth")
+    args = parser.parse_args()
 
-    pcl_color_frame = basler_fusion_depth_rgb.transform_pcl_to_color_frame(pcl)
-    depth_color_frame, _ = basler_fusion_depth_rgb.project_depth_to_color_frame(pcl, color_img)
+    if args.replay:
+        rgb_backend, tof_backend = camera_backend.create_replay_backends(
+            args.replay, pacing="fast" if args.fast else "realtime", tof_session_dir=args.replay_tof)
+    else:
+        # Open and configure both cameras once, then grab on demand
+        rgb_backend = camera_backend.PylonBackend(basler_rgb_cam_grab.get_rgb_cam_session())
+        tof_backend = camera_backend.PylonBackend(basler_tof_cam_grab.get_tof_cam_session("Point_Cloud"))
 
-    overlay_heatmap, overlay_edges = basler_fusion_depth_rgb.visualize_rgb_depth_alignment(
-        color_img, depth_color_frame
-    )
+    preview = drift_monitor = registry = refiner = None
+    try:
+        if args.preview and not args.no_display:
+            preview = alignment_preview.AlignmentPreview(scale=args.preview_scale, max_fps=args.preview_fps)
+            preview.start()
+        if args.drift_monitor:
+            drift_monitor = alignment_monitor.ExtrinsicDriftMonitor(every_n=args.drift_every,
+                                                                    alert_px=args.drift_alert_px)
+        if args.hot_reload:
+            registry = calibration_registry.CalibrationRegistry(build_lut=args.lut)
+            registry.start()
+        if args.refine_extrinsics:
+            def on_update(new_calib):
+                # With --lut, the table of a refined calibration is built on the refiner thread before the swap.
+                # Refined tables are not persisted, and the one of the superseded refinement is dropped.
+                old_calib = refiner.calib
+                projection_lut.get_projection_lut(new_calib, cache_dir=None)
+                if old_calib is not refiner.initial_calib:
+                    projection_lut.clear_projection_luts(old_calib.calibration_id)
 
-    cv2.imshow("overlay_heatmap", overlay_heatmap)
-    cv2.imshow("overlay_edges", overlay_edges)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+            calib = registry.current().calib if registry is not None else None
+            refiner = extrinsic_refiner.ExtrinsicRefiner(calib, cpu_budget=args.refine_cpu,
+                                                         on_update=on_update if args.lut else None)
+            refiner.start()
+        with rgb_backend, tof_backend:
+            run_alignment(rgb_backend, tof_backend, display=not args.no_display, wait_key=not args.replay,
+                          use_lut=args.lut, densify=args.densify, preview=preview, drift_monitor=drift_monitor,
+                          refiner=refiner, registry=registry)
+    finally:
+        # The background threads are stopped on every exit, the preview before its windows are destroyed
+        if refiner is not None:
+            refiner.stop()
+        if registry is not None:
+            registry.stop()
+            print(f"Calibration registry: {registry.stats()}")
+        if preview is not None:
+            preview.stop()
+            print(f"Preview: {preview.shown} frames shown, {preview.dropped} dropped")
+        basler_cam_session.close_all_sessions()
+        cv2.destroyAllWindows()
 
 
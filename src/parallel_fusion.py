@@ -0,0 +1,129 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import basler_fusion_depth_rgb
+import cam_calibration
+import point_culling
+import projection_lut
+import zbuffer
+
+class ParallelFusion:
+    """
+    Row-band parallel version of the basler_fusion_depth_rgb fusion functions.
+
+    The ToF grid is split into one band of rows per worker thread, and every band runs
+    culling, projection (cv2.projectPoints or the projection table), sampling and
+    Z-buffering on its own. These stages spend most of their time in OpenCV and in large
+    numpy operations, which release the GIL, so the bands run in parallel. For the depth
+    registration, every band rasterizes into its own Z-buffer of the color image size, and
+    the band Z-buffers are min-merged afterwards, also split into row slices.
+
+    Args:
+        calib: Stereo calibration, None for the default calibration file
+        workers: Number of worker threads (and row bands), None for os.cpu_count()
+        lut: Optional projection table of the calibration
+    """
+    def __init__(self, calib: cam_calibration.CamCalibration = None, workers: int = None,
+                 lut: projection_lut.ProjectionLUT = None):
+        self.calib = cam_calibration.load_calibration() if calib is None else calib
+        self.workers = workers or os.cpu_count() or 1
+        self.lut = lut
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fusion")
+        # Per band Z-buffers of the color image size: {(height, width): [ZBuffer, ...]}
+        self._zbuffers = {}
+        self._lut_bands = {}
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _bands(self, rows: int):
+        # Row ranges of the bands, at most one per worker
+        bounds = np.linspace(0, rows, min(self.workers, rows) + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _band_lut(self, start: int, stop: int):
+        if self.lut is None:
+            return None
+        band = self._lut_bands.get((start, stop))
+        if band is None:
+            band = self.lut.rows(start, stop)
+            self._lut_bands[(start, stop)] = band
+        return band
+
+    def _band_zbuffers(self, count: int, height: int, width: int):
+        zbuffers = self._zbuffers.setdefault((height, width), [])
+        while len(zbuffers) < count:
+            zbuffers.append(zbuffer.ZBuffer(height, width))
+        return zbuffers[:count]
+
+    def project_depth_to_color_frame(self, pcl, color_img, confidence=None,
+                                     culling: point_culling.PointCulling = None, out=None):
+        """
+        See basler_fusion_depth_rgb.project_depth_to_color_frame.
+
+        Returns:
+            depth_rgb: (Hc, Wc) uint16 Z-buffer depth map [millimeters], aligned to color frame
+            valid_mask: (Hc, Wc) bool, True for pixels where at least one 3D point projects to it
+        """
+        Hc, Wc = color_img.shape[:2]
+        bands = self._bands(pcl.shape[0])
+        zbuffers = self._band_zbuffers(len(bands), Hc, Wc)
+
+        def rasterize_band(band, zbuf):
+            start, stop = band
+            conf = None if confidence is None else confidence[start:stop]
+            _, pts, img_pts = basler_fusion_depth_rgb.project_culled_points(
+                pcl[start:stop], self.calib, conf, culling, self._band_lut(start, stop))
+            u = np.rint(img_pts[:, 0]).astype(np.int32)
+            v = np.rint(img_pts[:, 1]).astype(np.int32)
+            inside = (u >= 0) & (u < Wc) & (v >= 0) & (v < Hc)
+            zbuf.rasterize(u[inside], v[inside], pts[inside, 2], clear_empty=False)
+
+        list(self.pool.map(rasterize_band, bands, zbuffers))
+
+        # Min-merge of the band Z-buffers, in row slices of the color image
+        if out is None:
+            out = np.empty((Hc, Wc), dtype=np.uint16)
+        hit = np.empty((Hc, Wc), dtype=bool)
+
+        def merge_rows(rows):
+            start, stop = rows
+            zbuffer.merge_min([zbuf.depth[start:stop] for zbuf in zbuffers], out[start:stop])
+            np.not_equal(out[start:stop], zbuffer.ZBUFFER_EMPTY, out=hit[start:stop])
+            np.multiply(out[start:stop], hit[start:stop], out=out[start:stop])
+
+        list(self.pool.map(merge_rows, self._bands(Hc)))
+        return out, hit
+
+    def warp_depth_with_color(self, pcl, color_img, interp="nearest", confidence=None,
+                              culling: point_culling.PointCulling = None, sampler="numpy", out=None):
+        """
+        See basler_fusion_depth_rgb.warp_depth_with_color, every band samples its own rows.
+
+        Returns:
+            color_on_depth: (Hd, Wd, 3) uint8, BGR on depth grid (zeros where invalid)
+            valid_mask:     (Hd, Wd) bool, True if sampled inside color bounds and kept by the culling
+        """
+        Hd, Wd, _ = pcl.shape
+        if out is None:
+            out = np.empty((Hd, Wd, 3), dtype=np.uint8)
+        valid = np.empty((Hd, Wd), dtype=bool)
+
+        def sample_band(band):
+            start, stop = band
+            conf = None if confidence is None else confidence[start:stop]
+            _, band_valid = basler_fusion_depth_rgb.warp_depth_with_color(
+                pcl[start:stop], color_img, interp, self.calib, lut=self._band_lut(start, stop),
+                confidence=conf, culling=culling, sampler=sampler, out=out[start:stop])
+            valid[start:stop] = band_valid
+
+        list(self.pool.map(sample_band, self._bands(Hd)))
+        return out, valid
@@ -0,0 +1,55 @@
+import numpy as np
+
+class PointCulling:
+    """
+    Pre-projection culling of the blaze point cloud: selects the points worth projecting
+    before any projection, sampling or Z-buffering is done.
+
+    A point is kept if
+      - its Z is > 0 (the blaze sets invalid points, e.g. removed by OutlierRemoval or
+        ConfidenceThreshold, to 0),
+      - its confidence is >= min_confidence (only if a confidence map is given),
+      - it lies inside the workspace box (only if a box is set).
+
+    Args:
+        min_confidence (int): Min. confidence of a kept point, 0 to skip the check
+        workspace_min, workspace_max: (3,) corners of an axis-aligned workspace box [mm],
+            e.g. the reach of the gripper, None for no box
+        box_from_tof: Optional 4x4 transform from the ToF camera frame into the frame of the
+            box (e.g. the robot base from the hand-eye calibration), None if the box is
+            given in the ToF camera frame
+    """
+    def __init__(self, min_confidence: int = 0, workspace_min=None, workspace_max=None, box_from_tof=None):
+        if (workspace_min is None) != (workspace_max is None):
+            raise ValueError("workspace_min and workspace_max must be given together")
+        self.min_confidence = min_confidence
+        self.workspace_min = None if workspace_min is None else np.asarray(workspace_min, np.float32)
+        self.workspace_max = None if workspace_max is None else np.asarray(workspace_max, np.float32)
+        self.box_from_tof = None if box_from_tof is None else np.asarray(box_from_tof, np.float32)
+
+    def select(self, pcl: np.ndarray, confidence: np.ndarray = None) -> np.ndarray:
+        """
+        Args:
+            pcl: (H, W, 3) float32 point cloud [mm]
+            confidence: Optional (H, W) uint16 confidence map of the same grab
+
+        Returns:
+            idx: (M,) int flat indices of the kept pixels, in raster order
+        """
+        keep = pcl[:, :, 2] > 0
+        if confidence is not None and self.min_confidence > 0:
+            keep &= confidence >= self.min_confidence
+        idx = np.flatnonzero(keep)
+
+        if self.workspace_min is not None and idx.size:
+            # Box test only on the points which passed the cheap checks
+            pts = pcl.reshape(-1, 3)[idx]
+            if self.box_from_tof is not None:
+                pts = pts @ self.box_from_tof[:3, :3].T + self.box_from_tof[:3, 3]
+            inside = np.all((pts >= self.workspace_min) & (pts <= self.workspace_max), axis=1)
+            idx = idx[inside]
+        return idx
+
+
+# Default culling: only the Z validity of the blaze
+Z_VALID_CULLING = PointCulling()
@@ -0,0 +1,234 @@
+import copy
+import hashlib
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import cam_calibration
+
+# Depth range covered by the table [mm]: DepthMax of basler_tof_cam_grab.TOF_CAM_PROFILE,
+# and a near limit for its DepthMin = 0 (the table is uniform in 1 / Z, so Z must stay > 0).
+# Points outside the range are projected exactly.
+LUT_DEPTH_MIN_MM = 100.0
+LUT_DEPTH_MAX_MM = 1498.0
+
+# Default location of the persisted tables, next to the stereo calibration
+PROJECTION_LUT_CACHE_DIR = "./basler_calibration/projection_lut"
+
+class ProjectionLUT:
+    """
+    Depth-binned ToF -> color registration table.
+
+    For a fixed rig, a ToF pixel always looks along the same ray, so its (distorted) color
+    pixel only depends on its depth. The table stores the exact cv2.projectPoints result of
+    every ToF pixel at `bins` + 1 depths, uniformly spaced in 1 / Z (the projection is
+    close to linear in 1 / Z), and a frame is registered by linear interpolation between
+    the two neighboring depths of every pixel instead of a full projection.
+
+    The number of bins is the smallest power of two whose interpolation error, checked
+    half way between the table depths, stays within `max_error_px`, limited by
+    `memory_budget_mb` (the table takes width * height * (bins + 1) * 8 bytes).
+
+    Args:
+        calib: Stereo calibration of the rig
+        size: (width, height) of the ToF image
+        depth_range: (min, max) depth [mm] covered by the table
+        max_error_px: Accuracy bound of the interpolated color pixel [px]
+        memory_budget_mb: Memory limit of the table [MB]
+        table: Precomputed (width * height, bins + 1, 2) float32 table, skips the build
+    """
+    def __init__(self, calib: cam_calibration.CamCalibration, size=(640, 480),
+                 depth_range=(LUT_DEPTH_MIN_MM, LUT_DEPTH_MAX_MM),
+                 max_error_px: float = 0.1, memory_budget_mb: float = 128.0,
+                 table: np.ndarray = None):
+        self.calibration_id = calib.calibration_id
+        self.size = tuple(size)
+        self.depth_range = tuple(depth_range)
+        self.max_error_px = max_error_px
+        self.memory_budget_mb = memory_budget_mb
+        self._R, self._T, self._Kc, self._dc = calib.R, calib.T, calib.Kc, calib.dc
+
+        # Z-normalized viewing ray of every ToF pixel
+        Kd, dd = calib.Kd, calib.dd
+        W, H = self.size
+        u, v = np.meshgrid(np.arange(W, dtype=np.float64), np.arange(H, dtype=np.float64))
+        pix = np.stack([u.ravel(), v.ravel()], axis=1).reshape(-1, 1, 2)
+        rays = cv2.undistortPoints(pix, Kd.astype(np.float64), dd.astype(np.float64)).reshape(-1, 2)
+        self.rays = np.hstack([rays, np.ones((rays.shape[0], 1))]).astype(np.float32)
+
+        z_min, z_max = self.depth_range
+        self.inv_min = 1.0 / z_max
+        self.inv_max = 1.0 / z_min
+
+        if table is None:
+            table, self.error_px = self._build()
+        else:
+            self.error_px = None
+        self.table = table
+        self.bins = table.shape[1] - 1
+        self.inv_step = (self.inv_max - self.inv_min) / self.bins
+        # First table entry of every pixel in the flattened table
+        self._base = np.arange(W * H, dtype=np.int32) * (self.bins + 1)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def rows(self, start: int, stop: int) -> "ProjectionLUT":
+        """
+        Table of the ToF image rows start..stop, sharing the memory of this table.
+        project() of the result takes the depths of those rows only, e.g. pcl[start:stop, :, 2].
+        """
+        W, _ = self.size
+        band = copy.copy(self)
+        band.size = (W, stop - start)
+        band.table = self.table[start * W:stop * W]
+        band.rays = self.rays[start * W:stop * W]
+        band._base = self._base[:(stop - start) * W]
+        return band
+
+    def _project_exact(self, rays, z):
+        pts = rays * z[:, None]
+        img_pts, _ = cv2.projectPoints(pts, self._R, self._T, self._Kc, self._dc)
+        return img_pts.reshape(-1, 2)
+
+    def _table_at(self, bins: int, rays) -> np.ndarray:
+        # Exact projections of `rays` at bins + 1 depths, uniform in 1 / Z -> (N, bins + 1, 2)
+        inv = np.linspace(self.inv_min, self.inv_max, bins + 1)
+        table = np.empty((rays.shape[0], bins + 1, 2), dtype=np.float32)
+        for i, inv_z in enumerate(inv):
+            table[:, i] = self._project_exact(rays, np.full(rays.shape[0], 1.0 / inv_z, np.float32))
+        return table
+
+    def _build(self):
+        W, H = self.size
+        bytes_per_bin = W * H * 2 * 4
+        max_bins = int(self.memory_budget_mb * 1e6 // bytes_per_bin) - 1
+        if max_bins < 1:
+            raise ValueError(f"Memory budget of {self.memory_budget_mb} MB is too small for a {W}x{H} table")
+
+        # Check the accuracy on a pixel subset including the image corners
+        check = np.unique(np.concatenate([
+            np.arange(0, W * H, 97), [0, W - 1, (H - 1) * W, W * H - 1]]))
+        rays = self.rays[check]
+
+        bins = 1
+        while True:
+            table = self._table_at(bins, rays)
+            mid = 1.0 / ((np.arange(bins) + 0.5) * (self.inv_max - self.inv_min) / bins + self.inv_min)
+            error = 0.0
+            for i, z in enumerate(mid):
+                exact = self._project_exact(rays, np.full(rays.shape[0], z, np.float32))
+                interp = 0.5 * (table[:, i] + table[:, i + 1])
+                error = max(error, float(np.abs(exact - interp).max()))
+            if error <= self.max_error_px or bins * 2 > max_bins:
+                break
+            bins *= 2
+
+        if error > self.max_error_px:
+            print(f"Projection LUT: {bins} bins reach {error:.3f} px, "
+                  f"above the {self.max_error_px} px bound (memory budget {self.memory_budget_mb} MB)")
+        print(f"Projection LUT: {bins} bins, max error {error:.3f} px, {W * H * (bins + 1) * 8 / 1e6:.1f} MB")
+        return self._table_at(bins, self.rays), error
+
+    def project(self, z: np.ndarray, out: np.ndarray = None, pix: np.ndarray = None) -> np.ndarray:
+        """
+        Color pixel of every ToF pixel, by table interpolation.
+
+        Args:
+            z: (H, W) or (N,) depth [mm] of the ToF pixels along their rays, e.g. pcl[:, :, 2]
+            out: Optional (N, 2) float32 output
+            pix: Optional (N,) flat ToF pixel indices of the depths, for a culled point set
+
+        Returns:
+            img_pts: (N, 2) float32 distorted color pixel coordinates (u, v), same as
+                     cv2.projectPoints of the point cloud. Undefined where z <= 0.
+        """
+        z = z.reshape(-1)
+        if out is None:
+            out = np.empty((z.size, 2), dtype=np.float32)
+
+        with np.errstate(divide="ignore"):
+            t = (1.0 / z - self.inv_min) / self.inv_step
+        np.clip(t, 0, self.bins - 1e-3, out=t)
+        i = t.astype(np.int32)
+        frac = (t - i).astype(np.float32)[:, None]
+        idx = (self._base if pix is None else self._base[pix]) + i
+        table = self.table.reshape(-1, 2)
+        p0 = table[idx]
+        np.subtract(table[idx + 1], p0, out=out)
+        np.multiply(out, frac, out=out)
+        np.add(out, p0, out=out)
+
+        # Depths outside the table range are projected exactly
+        z_min, z_max = self.depth_range
+        outside = np.flatnonzero((z > 0) & ((z < z_min) | (z > z_max)))
+        if outside.size:
+            rays = self.rays[outside if pix is None else pix[outside]]
+            out[outside] = self._project_exact(rays, z[outside].astype(np.float32))
+        return out
+
+
+def projection_lut_key(calibration_id: str, size, depth_range, max_error_px: float,
+                       memory_budget_mb: float) -> str:
+    """
+    Key of a projection table: calibration_id, ToF image size, depth range and build limits.
+    """
+    h = hashlib.sha1()
+    h.update(calibration_id.encode())
+    h.update(np.array([*size, *depth_range, max_error_px, memory_budget_mb], dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+# In-memory tables: {key: ProjectionLUT}
+_luts = {}
+
+def get_projection_lut(calib: cam_calibration.CamCalibration = None, size=(640, 480),
+                       depth_range=(LUT_DEPTH_MIN_MM, LUT_DEPTH_MAX_MM), max_error_px: float = 0.1,
+                       memory_budget_mb: float = 128.0,
+                       cache_dir: str = PROJECTION_LUT_CACHE_DIR) -> ProjectionLUT:
+    """
+    Get the projection table of a calibration, built only once.
+
+    The table is kept in memory and persisted to `cache_dir`, keyed by the calibration_id,
+    so a new calibration gets a new table and restarts skip the build.
+
+    Args:
+        calib: Stereo calibration, None for the default calibration file
+        size, depth_range, max_error_px, memory_budget_mb: See ProjectionLUT
+        cache_dir: Directory of the persisted tables, None to keep them only in memory
+
+    Returns:
+        ProjectionLUT
+    """
+    if calib is None:
+        calib = cam_calibration.load_calibration()
+    key = projection_lut_key(calib.calibration_id, size, depth_range, max_error_px, memory_budget_mb)
+    lut = _luts.get(key)
+    if lut is not None:
+        return lut
+
+    path = Path(cache_dir) / f"projection_lut_{key}.npz" if cache_dir is not None else None
+    kwargs = dict(size=size, depth_range=depth_range, max_error_px=max_error_px,
+                  memory_budget_mb=memory_budget_mb)
+    if path is not None and path.exists():
+        data = np.load(path)
+        lut = ProjectionLUT(calib, table=data["table"], **kwargs)
+        lut.error_px = float(data["error_px"])
+    else:
+        lut = ProjectionLUT(calib, **kwargs)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(path, table=lut.table, error_px=lut.error_px)
+    _luts[key] = lut
+    return lut
+
+def clear_projection_luts(calibration_id: str = None) -> None:
+    """
+    Drop the in-memory tables (the persisted files are kept), only those of `calibration_id` if given.
+    """
+    if calibration_id is None:
+        _luts.clear()
+        return
+    for key in [key for key, lut in _luts.items() if lut.calibration_id == calibration_id]:
+        del _luts[key]
@@ -0,0 +1,345 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Per-frame index record of a stream
+INDEX_DTYPE = np.dtype([
+    ("seq", "<i8"),             # Frame number in the stream
+    ("timestamp", "<u8"),       # Device timestamp
+    ("frame_id", "<i8"),        # Device frame (block) ID
+    ("host_time_ns", "<i8"),    # Host time when the frame was recorded
+    ("calibration_id", "S16"),  # Calibration the frame was taken with
+])
+
+class _RecordSlot:
+    """
+    Preallocated staging buffer for one frame on its way to disk.
+    """
+    def __init__(self, shape, dtype):
+        self.data = np.empty(shape, dtype=dtype)
+        self.index = np.zeros(1, dtype=INDEX_DTYPE)
+
+
+class _Stream:
+    def __init__(self, session_dir: Path, name: str, shape, dtype, chunk_frames: int, queue_size: int):
+        self.session_dir = session_dir
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self.free_slots = queue.Queue()
+        for _ in range(queue_size):
+            self.free_slots.put(_RecordSlot(self.shape, self.dtype))
+        self.pending = {}  # Slots handed out by acquire_slot(), keyed by id of their data
+        self.recorded = 0
+        self.dropped = 0
+        self.chunk_file = None
+        self.index_file = open(session_dir / f"{name}.idx", "wb")
+
+    def chunk_path(self, chunk: int) -> Path:
+        return self.session_dir / f"{self.name}_{chunk:05d}.bin"
+
+    def write(self, slot: _RecordSlot) -> None:
+        # Roll over to a new chunk file every chunk_frames frames
+        if self.recorded % self.chunk_frames == 0:
+            if self.chunk_file is not None:
+                self.chunk_file.close()
+            self.chunk_file = open(self.chunk_path(self.recorded // self.chunk_frames), "wb")
+        slot.index["seq"] = self.recorded
+        self.chunk_file.write(memoryview(slot.data).cast("B"))
+        self.index_file.write(slot.index.tobytes())
+        self.recorded += 1
+
+    def close(self) -> None:
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+        self.index_file.close()
+
+    def meta(self) -> dict:
+        return {"shape": list(self.shape), "dtype": self.dtype.str, "chunk_frames": self.chunk_frames}
+
+
+class SessionRecorder:
+    """
+    Record raw camera frames to an append-only, chunked session directory on a background writer thread.
+
+    Every stream (e.g. "rgb_bayer", "tof_Point_Cloud") is written as raw fixed-size frames into
+    chunk files "<stream>_<chunk>.bin", which can be memory-mapped as (N, *shape) arrays, plus a
+    per-frame index "<stream>.idx" (INDEX_DTYPE) and a "session.json" with the stream layouts.
+
+    record() only copies the frame into a preallocated slot and never blocks the acquisition;
+    if the writer falls behind and no slot is free, the frame is counted as dropped.
+
+    Args:
+        session_dir (str): Output directory of the session (created if needed, must be empty).
+        calibration_id (str): ID of the calibration the frames are taken with.
+        chunk_frames (int): Frames per chunk file.
+        queue_size (int): Preallocated slots per stream between acquisition and writer.
+        info (dict): Optional extra description stored in session.json, e.g. the timestamp clock.
+    """
+    def __init__(self, session_dir: str, calibration_id: str = "", chunk_frames: int = 1000, queue_size: int = 32,
+                 info: dict = None):
+        self.session_dir = Path(session_dir)
+        # Frame numbers start at 0, so recording on top of an old session would corrupt both
+        if self.session_dir.exists() and any(self.session_dir.iterdir()):
+            raise FileExistsError(f"Session directory is not empty: {self.session_dir}")
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        self.calibration_id = calibration_id
+        self.info = info or {}
+        self.chunk_frames = chunk_frames
+        self.queue_size = queue_size
+        self.streams = {}
+        self._write_queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def add_stream(self, name: str, shape, dtype) -> None:
+        """
+        Register a stream before recording its first frame.
+        """
+        self.streams[name] = _Stream(self.session_dir, name, shape, dtype, self.chunk_frames, self.queue_size)
+        self._write_meta()
+
+    def acquire_slot(self, name: str) -> Optional[np.ndarray]:
+        """
+        Get a free frame buffer of a stream to fill in place (e.g. with copy_tof_comps_into),
+        then hand it over with commit_slot(). None if the writer is behind (frame dropped).
+        """
+        stream = self.streams[name]
+        try:
+            slot = stream.free_slots.get_nowait()
+        except queue.Empty:
+            stream.dropped += 1
+            return None
+        stream.pending[id(slot.data)] = slot
+        return slot.data
+
+    def commit_slot(self, name: str, data: np.ndarray, timestamp: int = 0, frame_id: int = 0) -> None:
+        """
+        Queue a buffer from acquire_slot() for writing.
+        """
+        stream = self.streams[name]
+        slot = stream.pending.pop(id(data))
+        slot.index["timestamp"] = timestamp
+        slot.index["frame_id"] = frame_id
+        slot.index["host_time_ns"] = time.time_ns()
+        slot.index["calibration_id"] = self.calibration_id.encode()[:16]
+        self._write_queue.put((stream, slot))
+
+    def record(self, name: str, frame: np.ndarray, timestamp: int = 0, frame_id: int = 0) -> bool:
+        """
+        Copy one frame into the recorder.
+
+        Returns:
+            bool: False if the frame was dropped because the writer is behind.
+        """
+        data = self.acquire_slot(name)
+        if data is None:
+            return False
+        np.copyto(data, frame.reshape(data.shape))
+        self.commit_slot(name, data, timestamp, frame_id)
+        return True
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            stream, slot = item
+            stream.write(slot)
+            stream.free_slots.put(slot)
+
+    def _write_meta(self) -> None:
+        meta = {
+            "calibration_id": self.calibration_id,
+            "info": self.info,
+            "streams": {name: stream.meta() for name, stream in self.streams.items()},
+        }
+        (self.session_dir / "session.json").write_text(json.dumps(meta, indent=2))
+
+    def stats(self) -> dict:
+        """
+        Recorded and dropped frames per stream.
+        """
+        return {name: {"recorded": s.recorded, "dropped": s.dropped, "queued": self._write_queue.qsize()}
+                for name, s in self.streams.items()}
+
+    def close(self) -> None:
+        """
+        Write all queued frames and close the files.
+        """
+        self._write_queue.put(None)
+        self._writer.join()
+        for stream in self.streams.values():
+            stream.close()
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SessionReader:
+    """
+    Memory-mapped read access to a session written by SessionRecorder.
+
+    Args:
+        session_dir (str): Directory of the recorded session.
+    """
+    def __init__(self, session_dir: str):
+        self.session_dir = Path(session_dir)
+        meta = json.loads((self.session_dir / "session.json").read_text())
+        self.calibration_id = meta["calibration_id"]
+        self.info = meta.get("info", {})
+        self.streams = meta["streams"]
+        self._chunks = {}
+
+    def index(self, name: str) -> np.ndarray:
+        """
+        Per-frame index (INDEX_DTYPE) of a stream.
+        """
+        return np.fromfile(self.session_dir / f"{name}.idx", dtype=INDEX_DTYPE)
+
+    def __len__(self) -> int:
+        return min((len(self.index(name)) for name in self.streams), default=0)
+
+    def frame(self, name: str, seq: int) -> np.ndarray:
+        """
+        Read-only view of frame number `seq` of a stream (no copy).
+        """
+        meta = self.streams[name]
+        chunk, pos = divmod(seq, meta["chunk_frames"])
+        key = (name, chunk)
+        if key not in self._chunks:
+            self._chunks[key] = np.memmap(
+                self.session_dir / f"{name}_{chunk:05d}.bin", dtype=np.dtype(meta["dtype"]), mode="r"
+            ).reshape((-1,) + tuple(meta["shape"]))
+        return self._chunks[key][pos]
+
+    def frames(self, name: str, start: int, stop: int) -> np.ndarray:
+        """
+        Frames start..stop of a stream: a read-only view if they are in one chunk file,
+        a copy otherwise.
+        """
+        chunk_frames = self.streams[name]["chunk_frames"]
+        if start // chunk_frames == (stop - 1) // chunk_frames:
+            self.frame(name, start)  # map the chunk
+            chunk, pos = divmod(start, chunk_frames)
+            return self._chunks[(name, chunk)][pos:pos + stop - start]
+        return np.stack([self.frame(name, seq) for seq in range(start, stop)])
+
+    def take(self, name: str, seqs) -> np.ndarray:
+        """
+        Frames with the numbers `seqs` of a stream: see frames() for consecutive numbers, a copy otherwise.
+        """
+        seqs = np.asarray(seqs)
+        if len(seqs) and seqs[-1] - seqs[0] == len(seqs) - 1:
+            return self.frames(name, int(seqs[0]), int(seqs[-1]) + 1)
+        return np.stack([self.frame(name, int(seq)) for seq in seqs])
+
+
+def _nearest(sorted_ts: np.ndarray, query: np.ndarray) -> np.ndarray:
+    # Index of the nearest value in sorted_ts for every query value
+    pos = np.searchsorted(sorted_ts, query)
+    lo = np.clip(pos - 1, 0, len(sorted_ts) - 1)
+    hi = np.clip(pos, 0, len(sorted_ts) - 1)
+    return np.where(np.abs(query - sorted_ts[lo]) <= np.abs(sorted_ts[hi] - query), lo, hi)
+
+def match_timestamps(ts_a, ts_b, max_skew: int):
+    """
+    Pair the frames of two streams by timestamp (both in recording order, i.e. ascending).
+    A frame of a is paired with its nearest frame of b if they are at most `max_skew` apart
+    and the a frame is in turn the nearest one of that b frame, so every frame is used once.
+
+    Returns:
+        idx_a, idx_b: (P,) frame numbers of the pairs in both streams
+    """
+    ts_a = np.asarray(ts_a, dtype=np.int64)
+    ts_b = np.asarray(ts_b, dtype=np.int64)
+    if len(ts_a) == 0 or len(ts_b) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    nearest_b = _nearest(ts_b, ts_a)
+    nearest_a = _nearest(ts_a, ts_b)
+    idx_a = np.arange(len(ts_a))
+    keep = (np.abs(ts_b[nearest_b] - ts_a) <= max_skew) & (nearest_a[nearest_b] == idx_a)
+    return idx_a[keep], nearest_b[keep]
+
+
+class PairedSession:
+    """
+    RGB and ToF frames of recorded sessions, paired by timestamp.
+
+    Either one session with both streams, recorded by basler_cam_pair.PairedCapture(record_dir=...),
+    whose timestamps are device exposure times on a common clock, or two sessions recorded
+    separately (e.g. stream_rgb_img and stream_tof_img), which are paired by host time.
+
+    Args:
+        rgb_session_dir (str): Session with the RGB stream (and the ToF stream if tof_session_dir is None).
+        tof_session_dir (str): Separately recorded session with the ToF stream.
+        rgb_stream, tof_stream (str): Stream names.
+        max_skew_ms (float): Max. time between the two frames of a pair [ms], None for the one the
+            session was recorded with (info "max_skew_ms") or else half the median ToF frame interval.
+    """
+    def __init__(self, rgb_session_dir: str, tof_session_dir: str = None, rgb_stream: str = "rgb_bayer",
+                 tof_stream: str = "tof_Point_Cloud", max_skew_ms: float = None):
+        self.rgb = SessionReader(rgb_session_dir)
+        self.tof = self.rgb if tof_session_dir is None else SessionReader(tof_session_dir)
+        self.rgb_stream = rgb_stream
+        self.tof_stream = tof_stream
+        for reader, stream in ((self.rgb, rgb_stream), (self.tof, tof_stream)):
+            if stream not in reader.streams:
+                raise KeyError(f"Session {reader.session_dir} has no stream '{stream}' "
+                               f"(streams: {', '.join(reader.streams)})")
+        rgb_index = self.rgb.index(rgb_stream)
+        tof_index = self.tof.index(tof_stream)
+
+        # Device timestamps are only comparable if the recorder put both streams on one clock
+        self.timestamp_field = "timestamp" if (tof_session_dir is None and
+                                               self.rgb.info.get("timestamp_clock")) else "host_time_ns"
+        rgb_ts = rgb_index[self.timestamp_field].astype(np.int64)
+        tof_ts = tof_index[self.timestamp_field].astype(np.int64)
+        if max_skew_ms is None and self.timestamp_field == "timestamp":
+            max_skew_ms = self.rgb.info.get("max_skew_ms")
+        if max_skew_ms is None:
+            max_skew_ns = int(np.median(np.diff(tof_ts)) / 2) if len(tof_ts) > 1 else 0
+        else:
+            max_skew_ns = int(max_skew_ms * 1e6)
+        self.rgb_seqs, self.tof_seqs = match_timestamps(rgb_ts, tof_ts, max_skew_ns)
+        self.skew_ns = tof_ts[self.tof_seqs] - rgb_ts[self.rgb_seqs]
+        # Host times of the pairs, for real-time replay
+        self.times_ns = rgb_index["host_time_ns"][self.rgb_seqs].astype(np.int64)
+        self.calibration_id = self.tof.calibration_id or self.rgb.calibration_id
+
+    def __len__(self) -> int:
+        return len(self.rgb_seqs)
+
+    def frames(self, start: int, stop: int):
+        """
+        Pairs start..stop.
+
+        Returns:
+            (rgb_frames, tof_frames): (n, ...) arrays, see SessionReader.take
+        """
+        return (self.rgb.take(self.rgb_stream, self.rgb_seqs[start:stop]),
+                self.tof.take(self.tof_stream, self.tof_seqs[start:stop]))
+
+    def stats(self) -> dict:
+        """
+        Paired and unpaired frames and the pair skew.
+        """
+        skew_ms = np.abs(self.skew_ns) / 1e6
+        return {
+            "pairs": len(self),
+            "unpaired_rgb": len(self.rgb.index(self.rgb_stream)) - len(self),
+            "unpaired_tof": len(self.tof.index(self.tof_stream)) - len(self),
+            "skew_mean_ms": float(skew_ms.mean()) if len(self) else 0.0,
+            "skew_max_ms": float(skew_ms.max()) if len(self) else 0.0,
+            "timestamps": self.timestamp_field,
+        }
@@ -0,0 +1,111 @@
+import queue
+import threading
+from typing import Optional
+
+import numpy as np
+
+import basler_tof_cam_grab
+
+# Data type -> (channels, dtype) of one ToF data component
+TOF_COMPONENT_LAYOUT = {
+    "Point_Cloud": (3, np.float32),
+    "Intensity_Image": (1, np.uint16),
+    "Confidence_Map": (1, np.uint16),
+}
+
+class ToFFrameBuffer:
+    """
+    One set of preallocated ToF component arrays owned by a ToFBufferPool.
+
+    The buffer goes back to the pool when its last consumer releases it. Use it as a
+    context manager, or call retain()/release() when it is handed to several consumers.
+    """
+    def __init__(self, pool: "ToFBufferPool", data: dict):
+        self.pool = pool
+        self.data = data
+        self.timestamp = 0
+        self.frame_id = 0
+        self._refs = 0
+        self._lock = threading.Lock()
+
+    def __getitem__(self, data_type: str) -> np.ndarray:
+        return self.data[data_type]
+
+    def retain(self) -> "ToFFrameBuffer":
+        """
+        Register one more consumer of this buffer.
+        """
+        with self._lock:
+            if self._refs <= 0:
+                raise RuntimeError("Buffer was already released to the pool")
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        """
+        Drop one consumer, the last one returns the buffer to the pool.
+        """
+        with self._lock:
+            if self._refs <= 0:
+                raise RuntimeError("Buffer was already released to the pool")
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        self.pool._free.put(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ToFBufferPool:
+    """
+    Fixed pool of reusable ToF component buffers, so the ToF hot path does not allocate
+    per frame and the memory use stays flat during long streams.
+
+    Args:
+        size (int): Number of buffers in the pool.
+        height, width (int): ToF image size.
+        data_types: Components held by every buffer, see TOF_COMPONENT_LAYOUT.
+    """
+    def __init__(self, size: int = 4, height: int = 480, width: int = 640,
+                 data_types=("Point_Cloud", "Intensity_Image", "Confidence_Map")):
+        self.size = size
+        self._free = queue.Queue()
+        for _ in range(size):
+            data = {}
+            for data_type in data_types:
+                channels, dtype = TOF_COMPONENT_LAYOUT[data_type]
+                shape = (height, width, channels) if channels > 1 else (height, width)
+                data[data_type] = np.zeros(shape, dtype=dtype)
+            self._free.put(ToFFrameBuffer(self, data))
+
+    @property
+    def available(self) -> int:
+        """
+        Number of buffers currently free.
+        """
+        return self._free.qsize()
+
+    def acquire(self, timeout: Optional[float] = None) -> ToFFrameBuffer:
+        """
+        Take a free buffer, waiting until a consumer releases one.
+
+        Raises:
+            queue.Empty: No buffer was released within the timeout.
+        """
+        buffer = self._free.get(timeout=timeout)
+        buffer._refs = 1
+        return buffer
+
+    def grab_into(self, grab_result, timeout: Optional[float] = None) -> ToFFrameBuffer:
+        """
+        Copy all components of a successful ToF grab result into a pooled buffer.
+        """
+        buffer = self.acquire(timeout)
+        basler_tof_cam_grab.copy_tof_comps_into(grab_result.GetDataContainer(), buffer.data)
+        buffer.timestamp = grab_result.TimeStamp
+        buffer.frame_id = grab_result.BlockID
+        return buffer
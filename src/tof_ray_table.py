@@ -0,0 +1,82 @@
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+class ToFRayTable:
+    """
+    Per-pixel ray table of the blaze, used to rebuild the XYZ point cloud on the host
+    from a depth-only (Coord3D_C16) transport.
+
+    The blaze delivers rectified data, so each pixel looks along the pinhole ray
+    ((u - cx) / f, (v - cy) / f, 1) and its 3D point is that ray scaled by the Z value.
+    Coord3D_C16 carries only Z (2 bytes per pixel instead of 12 for Coord3D_ABC32f).
+
+    Args:
+        fx, fy (float): Focal length [px]
+        cx, cy (float): Principal point [px]
+        width, height (int): Image size [px]
+        scale (float): Z [mm] per C16 gray value (Scan3dCoordinateScale)
+        offset (float): Z offset [mm] (Scan3dCoordinateOffset)
+    """
+    def __init__(self, fx: float, fy: float, cx: float, cy: float, width: int, height: int,
+                 scale: float = 1.0, offset: float = 0.0):
+        self.intrinsics = (fx, fy, cx, cy, width, height)
+        self.scale = scale
+        self.offset = offset
+        self.ray_x, self.ray_y = _ray_grid(fx, fy, cx, cy, width, height)
+
+    @classmethod
+    def from_camera(cls, cam) -> "ToFRayTable":
+        """
+        Build the table from the Scan3d nodes of an opened blaze configured for Coord3D_C16.
+        """
+        cam.Scan3dCoordinateSelector.Value = "CoordinateC"
+        return cls(
+            cam.Scan3dFocalLength.Value, cam.Scan3dFocalLength.Value,
+            cam.Scan3dPrincipalPointU.Value, cam.Scan3dPrincipalPointV.Value,
+            cam.Width.Value, cam.Height.Value,
+            scale=cam.Scan3dCoordinateScale.Value, offset=cam.Scan3dCoordinateOffset.Value,
+        )
+
+    @classmethod
+    def from_intrinsics(cls, K: np.ndarray, width: int = 640, height: int = 480,
+                        scale: float = 1.0, offset: float = 0.0) -> "ToFRayTable":
+        """
+        Build the table from a 3x3 camera matrix, e.g. halcon_to_opencv_intrinsics_tof().
+        """
+        return cls(K[0, 0], K[1, 1], K[0, 2], K[1, 2], width, height, scale=scale, offset=offset)
+
+    def depth_to_pcl(self, depth: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Rebuild the organized point cloud from a C16 depth map.
+
+        Args:
+            depth: (H, W) uint16 Coord3D_C16 depth map (0 = invalid)
+            out: Optional preallocated (H, W, 3) float32 output
+
+        Returns:
+            pcl: (H, W, 3) float32 point cloud [mm], (0, 0, 0) for invalid pixels,
+                 same layout as the Coord3D_ABC32f point cloud
+        """
+        if out is None:
+            out = np.empty(depth.shape + (3,), dtype=np.float32)
+        z = out[:, :, 2]
+        np.multiply(depth, np.float32(self.scale), out=z)
+        if self.offset:
+            np.add(z, np.float32(self.offset), out=z, where=depth > 0)
+        np.multiply(z, self.ray_x, out=out[:, :, 0])
+        np.multiply(z, self.ray_y, out=out[:, :, 1])
+        return out
+
+
+@lru_cache(maxsize=4)
+def _ray_grid(fx, fy, cx, cy, width, height):
+    # Computed once per set of intrinsics and shared by all tables
+    ray_x = ((np.arange(width, dtype=np.float32) - np.float32(cx)) / np.float32(fx))[None, :]
+    ray_y = ((np.arange(height, dtype=np.float32) - np.float32(cy)) / np.float32(fy))[:, None]
+    ray_x = np.ascontiguousarray(np.broadcast_to(ray_x, (height, width)))
+    ray_y = np.ascontiguousarray(np.broadcast_to(ray_y, (height, width)))
+    ray_x.flags.writeable = False
+    ray_y.flags.writeable = False
+    return ray_x, ray_y
@@ -0,0 +1,74 @@
+import hashlib
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Default location of the persisted maps, next to the HALCON calibration results
+UNDISTORT_CACHE_DIR = "./halcon_calibration_result/undistort_maps"
+
+# In-memory maps: {key: (map1, map2, newK, roi)}
+_maps = {}
+
+def undistort_maps_key(K, dist, size, alpha: float, nearest: bool) -> str:
+    """
+    Key of an undistortion map set: hash of intrinsics, distortion, image size, alpha and interpolation.
+    """
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(K, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(dist, dtype=np.float64).ravel().tobytes())
+    h.update(np.array([size[0], size[1]], dtype=np.int64).tobytes())
+    h.update(np.array([alpha], dtype=np.float64).tobytes())
+    h.update(b"nearest" if nearest else b"linear")
+    return h.hexdigest()[:16]
+
+def get_undistort_maps(K, dist, size, alpha: float = 1.0, nearest: bool = False,
+                       cache_dir: str = UNDISTORT_CACHE_DIR):
+    """
+    Get fixed-point undistortion maps, built only once per (K, dist, size, alpha).
+
+    The maps are kept in memory and persisted to `cache_dir`, so they are reused across
+    frames and process restarts. They use the CV_16SC2 fixed-point format, which remaps
+    faster than the CV_32FC1 float maps.
+
+    Args:
+        K, dist: OpenCV camera matrix and distortion coefficients
+        size: (width, height) in pixels
+        alpha: see cv2.getOptimalNewCameraMatrix (0 = crop black borders, 1 = keep full FOV)
+        nearest: Build maps for cv2.INTER_NEAREST (rounded coordinates, e.g. for depth maps)
+        cache_dir: Directory of the persisted maps, None to keep them only in memory
+
+    Returns:
+        map1, map2, newK, roi (map2 is None for nearest maps)
+    """
+    key = undistort_maps_key(K, dist, size, alpha, nearest)
+    maps = _maps.get(key)
+    if maps is not None:
+        return maps
+
+    path = Path(cache_dir) / f"undistort_{key}.npz" if cache_dir is not None else None
+    if path is not None and path.exists():
+        data = np.load(path)
+        maps = (data["map1"], data["map2"] if "map2" in data else None, data["newK"], tuple(data["roi"]))
+    else:
+        w, h = size
+        newK, roi = cv2.getOptimalNewCameraMatrix(K, dist, (w, h), alpha)
+        map_x, map_y = cv2.initUndistortRectifyMap(K, dist, None, newK, (w, h), cv2.CV_32FC1)
+        map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=nearest)
+        if nearest:
+            map2 = None
+        maps = (map1, map2, newK, tuple(roi))
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            arrays = {"map1": map1, "newK": newK, "roi": np.array(roi)}
+            if map2 is not None:
+                arrays["map2"] = map2
+            np.savez(path, **arrays)
+    _maps[key] = maps
+    return maps
+
+def clear_undistort_maps() -> None:
+    """
+    Drop the in-memory maps (the persisted files are kept).
+    """
+    _maps.clear()
@@ -0,0 +1,126 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Empty Z-buffer pixel, projected depths are clipped below it
+ZBUFFER_EMPTY = 0xFFFF
+
+class ZBuffer:
+    """
+    Reusable Z-buffer rasterizer: keeps the closest depth per pixel of projected points.
+
+    Replaces np.minimum.at, which is unbuffered and processes one point at a time.
+    The depths are quantized to uint16 millimeters first (same result as rasterizing
+    the float depths and converting afterwards, the conversion is monotonic), then:
+      1) all points are scattered into the buffer in one pass, one arbitrary point wins per pixel,
+      2) the points closer than what their pixel holds are scattered again, until none are left.
+    Every pass strictly lowers the depth of the pixels it writes, so the number of passes
+    is bounded by the number of points landing on the same pixel (0 - 3 for ToF -> RGB).
+    If more than `max_passes` are needed, the remaining points are reduced by sorting.
+
+    Without `out` / `hit_out`, the returned depth map and hit mask are buffers owned by
+    the rasterizer, they are overwritten by the next rasterize() call.
+
+    Args:
+        height, width: Output depth map size (e.g. the color image size)
+        max_passes: Scatter passes before falling back to the sort-based reduction
+    """
+    def __init__(self, height: int, width: int, max_passes: int = 8):
+        self.height = height
+        self.width = width
+        self.max_passes = max_passes
+        self.depth = np.empty((height, width), dtype=np.uint16)
+        self.hit = np.empty((height, width), dtype=bool)
+        self._lin = np.empty(0, dtype=np.int32)
+        self._z = np.empty(0, dtype=np.uint16)
+
+    def _point_buffers(self, n: int):
+        if self._lin.size < n:
+            self._lin = np.empty(n, dtype=np.int32)
+            self._z = np.empty(n, dtype=np.uint16)
+        return self._lin[:n], self._z[:n]
+
+    def rasterize(self, u: np.ndarray, v: np.ndarray, z: np.ndarray,
+                  out: np.ndarray = None, hit_out: np.ndarray = None, clear_empty: bool = True):
+        """
+        Args:
+            u, v: (N,) integer pixel coordinates, all inside the image
+            z:    (N,) depths [mm], > 0
+            out:  Optional (height, width) uint16 array to write the depth map into
+            hit_out: Optional (height, width) bool array to write the hit mask into
+            clear_empty: Set the empty pixels to 0, False keeps ZBUFFER_EMPTY in them
+                (to min-merge several depth maps, see merge_min)
+
+        Returns:
+            depth: (height, width) uint16, closest depth per pixel [mm], 0 where empty
+            hit:   (height, width) bool, True where at least one point landed
+        """
+        depth = self.depth if out is None else out
+        hit = self.hit if hit_out is None else hit_out
+        buf = depth.reshape(-1)
+        lin, zq = self._point_buffers(z.size)
+        np.multiply(v, self.width, out=lin, casting="unsafe")
+        np.add(lin, u, out=lin, casting="unsafe")
+        np.clip(z, 0, ZBUFFER_EMPTY - 1, out=zq, casting="unsafe")
+
+        buf.fill(ZBUFFER_EMPTY)
+        buf[lin] = zq
+        for _ in range(self.max_passes):
+            closer = zq < buf[lin]
+            if not closer.any():
+                break
+            lin = lin[closer]
+            zq = zq[closer]
+            buf[lin] = zq
+        else:
+            closer = zq < buf[lin]
+            if closer.any():
+                self._reduce_sorted(buf, lin[closer], zq[closer])
+
+        np.not_equal(depth, ZBUFFER_EMPTY, out=hit)
+        if clear_empty:
+            np.multiply(depth, hit, out=depth)
+        return depth, hit
+
+    @staticmethod
+    def _reduce_sorted(buf: np.ndarray, lin: np.ndarray, zq: np.ndarray) -> None:
+        # Sort by (pixel, depth) and write the first, i.e. closest, point of every pixel
+        key = (lin.astype(np.int64) << 16) | zq
+        key.sort()
+        lin = key >> 16
+        first = np.empty(key.size, dtype=bool)
+        first[0] = True
+        np.not_equal(lin[1:], lin[:-1], out=first[1:])
+        lin = lin[first]
+        buf[lin] = np.minimum(buf[lin], (key[first] & 0xFFFF).astype(np.uint16))
+
+
+def merge_min(depths, out: np.ndarray):
+    """
+    Min-merge depth maps rasterized with clear_empty=False into `out` (same format).
+    cv2.min releases the GIL, so row slices can be merged in parallel.
+    """
+    np.copyto(out, depths[0])
+    for depth in depths[1:]:
+        cv2.min(out, depth, dst=out)
+    return out
+
+
+# Rasterizers of the stateless projection functions, one set per thread: a ZBuffer keeps
+# scratch buffers between calls, so it must not be shared by threads fusing concurrently
+# (e.g. the band workers of parallel_fusion or a refiner / preview thread).
+_zbuffers = threading.local()
+
+def get_zbuffer(height: int, width: int) -> ZBuffer:
+    """
+    Get the calling thread's rasterizer of an image size, create it on the first call.
+    """
+    cache = getattr(_zbuffers, "cache", None)
+    if cache is None:
+        cache = _zbuffers.cache = {}
+    zbuffer = cache.get((height, width))
+    if zbuffer is None:
+        zbuffer = ZBuffer(height, width)
+        cache[(height, width)] = zbuffer
+    return zbuffer